@@ -1,17 +1,42 @@
 #!/usr/bin/env python3
 import sys
 
-tasks = ['activity', 'award-bonus', 'pair', 're-award-bonus']
+tasks = ['activity', 'award-bonus', 'batch', 'pair', 're-award-bonus']
 task = None
 
 if len(sys.argv) < 2:
-    print(f"Usage: picata {' | '.join(tasks)}")
+    print(f"Usage: picata {' | '.join(tasks)} [--refresh] [--archive-reports] [--dry-run] [--no-figures]")
     sys.exit(1)
 else: 
     task = sys.argv[1]
 
 if task == "help" or task == "--help":
-    print(f"Usage: picata.py [{'|'.join(tasks)}]")
+    print(f"Usage: picata.py [{'|'.join(tasks)}] [--refresh] [--archive-reports] [--dry-run] [--no-figures]")
+    print("  --refresh           download everything from Canvas again instead of using the local cache in data/")
+    print("  --archive-reports   also save the raw student_analysis csv report of the quiz in data/")
+    print("  --dry-run           print the bonus points that would be awarded without setting them in Canvas")
+    print("  --no-figures        only compute and write csv files, without drawing any figures")
+    print("  --figures <names>   only draw these figures (comma-separated: histograms, distance, pairing)")
+    print("activity options (snapshot the activity of many courses at once, without prompts):")
+    print("  --courses <ids>     comma-separated ids of the courses")
+    print("  --term <id>         all of your courses in the enrollment term with this id")
+    print("  --csv               also save the activity as dated csv files (it is always added to data/activity_history.sqlite)")
+    print("pair options:")
+    print("  --draws <n>         also compare the pairing methods with n random pairings (drawn in parallel), saved as json in data/")
+    print("  --group-size <k>    form diverse groups of k students (e.g. 3-5) instead of pairs")
+    print("  --history <n>       compute distances over this quiz and the n quizzes before it (each weighted half the next)")
+    print("  --avoid-repeats <p> subtract p from the distance of two students for each time they were grouped before, or 'forbid'")
+    print("  --repeat-sessions <n> only count repeat partners from the last n sessions of the course")
+    print("  --large-class <n>   pair classes of more than n students (default 5000) approximately, without a distance matrix")
+    print("  --live              keep the pairing open after writing it, to add or remove students who arrive late or leave")
+    print("batch options (analyze every quiz of a course without prompts):")
+    print("  --course <id>       id of the course (required)")
+    print("  --quiz <regex>      only quizzes whose title matches the regular expression")
+    print("  --workers <n>       number of worker processes (default: up to 4)")
+    sys.exit(1)
+
+if task not in tasks:
+    print(f"Unknown task '{task}'. Usage: picata.py [{'|'.join(tasks)}] [options] (see picata.py help)")
     sys.exit(1)
 
 #elif task not in tasks:
@@ -26,7 +51,13 @@ if task == "help" or task == "--help":
 
 import os
 import re
+import time
 import canvasapi
+import picata_activity
+import picata_batch
+import picata_canvas
+import picata_figures
+import picata_session
 import picata_utils as pu
 import picata_config as pc
 
@@ -38,13 +69,48 @@ if not (API_URL or API_KEY):
     raise Exception("'CANVAS_' environment variables not set - see installation instructions to resolve this")
 
 pica_config = pc.PicataConfig()
+if '--refresh' in sys.argv[2:]:
+    pica_config.refresh_since = time.time()
+pica_config.archive_reports = '--archive-reports' in sys.argv[2:]
+pica_config.dry_run = '--dry-run' in sys.argv[2:]
+pica_config.activity_csv = '--csv' in sys.argv[2:]
+if '--no-figures' in sys.argv[2:]:
+    pica_config.figures = []
+elif pu.optionValue(sys.argv, '--figures') is not None:
+    pica_config.figures = pu.optionValue(sys.argv, '--figures').split(',')
+pica_config.pairing_draws = int(pu.optionValue(sys.argv, '--draws', 0))
+pica_config.group_size = int(pu.optionValue(sys.argv, '--group-size', 2))
+pica_config.history_window = int(pu.optionValue(sys.argv, '--history', 0))
+pica_config.repeat_penalty = float(pu.optionValue(sys.argv, '--avoid-repeats', '0').replace('forbid', 'inf'))
+pica_config.repeat_sessions = int(pu.optionValue(sys.argv, '--repeat-sessions', 0))
+pica_config.large_class_students = int(pu.optionValue(sys.argv, '--large-class', 5000))
+cache = picata_canvas.openCache(pica_config)
 
 # Initialize a new Canvas object
 canvas = canvasapi.Canvas(API_URL, API_KEY)
 
-# Prompt user to select a course
+# Fleet mode: the activity of many courses (by id or term), fetched concurrently into one partitioned output
+if task == 'activity' and (pu.optionValue(sys.argv, '--courses') or pu.optionValue(sys.argv, '--term')):
+    course_ids = [int(c) for c in pu.optionValue(sys.argv, '--courses', '').split(',') if c.strip()]
+    term_id = int(pu.optionValue(sys.argv, '--term')) if pu.optionValue(sys.argv, '--term') else None
+    courses = picata_activity.selectCourses(canvas, cache, course_ids, term_id)
+    activity, failures = picata_activity.fleetActivity(courses, cache)
+    n_changed = picata_activity.openHistory(pica_config).record(activity)
+    print(f"Recorded activity changes of {n_changed} students in {pica_config.activity_history_path}")
+    if pica_config.activity_csv:
+        print(f"Saved to {picata_activity.saveFleetActivity(activity, pica_config.data_path)}")
+    print("\n** Done ***\n")
+    sys.exit(1 if failures else 0)
+
+# Prompt user to select a course (batch mode takes it from --course instead)
 #chosen_course = pu.selectFromList(canvas.get_courses(), "course")
-chosen_course = pu.selectCourse(canvas)
+if task == 'batch':
+    if pu.optionValue(sys.argv, '--course') is None:
+        print("Usage: picata.py batch --course <id> [--quiz <regex>] [--workers <n>]")
+        sys.exit(1)
+    chosen_course = picata_batch.findCourse(canvas, cache, int(pu.optionValue(sys.argv, '--course')))
+else:
+    chosen_course = pu.selectCourse(canvas, cache)
 
 
 print(f"\nSelected course: {chosen_course.name}")
@@ -56,7 +122,7 @@ if task == 'activity':
 
 elif task in ['pair', 'award-bonus', 're-award-bonus']:
     # Prompt user to select a quiz
-    chosen_quiz = pu.selectFromList(chosen_course.get_quizzes(), "quiz")
+    chosen_quiz = pu.selectFromList(picata_canvas.getQuizzes(chosen_course, cache), "quiz")
     print(f"\nSelected quiz: {chosen_quiz.title}")
 
     # Obtain quiz data and generate plots to visualize the data.
@@ -70,11 +136,18 @@ elif task in ['pair', 'award-bonus', 're-award-bonus']:
         pica_quiz.openPresentCSV()
         pica_quiz.generateDistanceMatrix(only_present=True)
 
-        # Compare all four methods of pairings students
+        # Compare all five methods of pairing students (and how far each is from the optimum)
         pica_quiz.comparePairingMethods()
 
-        # Generate pairings for today using the median method
-        pica_quiz.createStudentPairings(method='med', write_csv=True)
+        # Generate pairings for today using the median method, or groups with --group-size (and keep pairs open
+        # for late arrivals if --live)
+        if '--live' in sys.argv and pica_config.group_size == 2 and pica_quiz.large_class is None:
+            picata_session.PairingSession(pica_quiz, pica_course.students, method='med').run()
+        else:
+            if '--live' in sys.argv:
+                print(f"\nWarning: --live is ignored {'with --group-size' if pica_config.group_size != 2 else 'for a class this large'}; "
+                      "the pairing csv is written once")
+            pica_quiz.createStudentPairings(method='med', write_csv=True)
 
     elif task == 'award-bonus':
         # Prompt user to find the pairings CSV file
@@ -93,4 +166,11 @@ elif task in ['pair', 'award-bonus', 're-award-bonus']:
         # Re-Award bonus points to students who received it by setting fudge points
         pica_quiz.reAwardBonusPoints()
 
+elif task == 'batch':
+    # Regenerate the histograms, distance matrices and event logs of all (matching) quizzes
+    quizzes = picata_batch.selectQuizzes(picata_canvas.getQuizzes(chosen_course, cache), pu.optionValue(sys.argv, '--quiz'))
+    workers = pu.optionValue(sys.argv, '--workers')
+    picata_batch.runQuizBatch(API_URL, API_KEY, pica_course, quizzes, pica_config, int(workers) if workers else None)
+
+picata_figures.finishFigures()
 print("\n** Done ***\n")
@@ -0,0 +1,180 @@
+import os
+import sys
+import time
+from datetime import datetime
+import pandas as pd
+import picata_canvas
+import picata_config
+import picata_sqlite
+
+ACTIVITY_COLUMNS = ['name', 'id', 'page_views', 'missing', 'late', 'total_activity_mins', 'last_activity_at']
+
+# Columns whose changes are recorded by ActivityHistory (a new row is only stored when one of them changes).
+HISTORY_VALUES = ['name', 'page_views', 'missing', 'late', 'total_activity_mins', 'last_activity_at']
+
+
+def activeStudents(enrollments):
+    """ The user dicts of the active students (with a SIS id) among enrollment JSON dicts, with their activity totals added. """
+    students = []
+    for enrollment in enrollments:
+        if enrollment['role'] == 'StudentEnrollment' and enrollment['enrollment_state'] == 'active' and enrollment.get('sis_user_id') is not None:
+            student = dict(enrollment['user'])
+            total_activity_time = enrollment.get('total_activity_time')
+            last_activity_at = enrollment.get('last_activity_at')
+            student['total_activity_time'] = total_activity_time if isinstance(total_activity_time, (int, float)) else None
+            student['last_activity_at'] = last_activity_at if isinstance(last_activity_at, (int, float)) else None
+            students.append(student)
+    return students
+
+
+def summaryFrame(summaries):
+    """ Page views and missing/late counts from the course student summaries (JSON dicts), built in one go. """
+    return pd.DataFrame({
+        'id': [s['id'] for s in summaries],
+        'page_views': [s.get('page_views') for s in summaries],
+        'missing': [s['tardiness_breakdown']['missing'] for s in summaries],
+        'late': [s['tardiness_breakdown']['late'] for s in summaries],
+    })
+
+
+def studentFrame(students):
+    """ Name, total activity time (in minutes) and last activity of each student (user dicts of activeStudents). """
+    return pd.DataFrame({
+        'name': [s['name'] for s in students],
+        'id': [s['id'] for s in students],
+        'total_activity_mins': pd.to_numeric(pd.Series([s['total_activity_time'] for s in students], dtype=object)) / 60.0,
+        'last_activity_at': [s['last_activity_at'] for s in students],
+    })
+
+
+def mergeActivity(summ_acts, acts):
+    """ Outer join of the summary and student frames on 'id'. """
+    return pd.merge(summ_acts, acts, on='id', how='outer')[ACTIVITY_COLUMNS]
+
+
+def getStudentSummaries(course, limiter=picata_canvas.rate_limiter):
+    """ The course level student summaries (page views, missing/late assignments) of a course as JSON dicts. """
+    return limiter.getPaginated(course._requester, f"courses/{course.id}/analytics/student_summaries")
+
+
+def selectCourses(canvas, cache, course_ids=None, term_id=None):
+    """ The courses with the given ids (in that order), or else the user's courses in the enrollment term term_id. """
+    courses = picata_canvas.getCourses(canvas, cache)
+    if course_ids:
+        by_id = {course.id: course for course in courses}
+        return [by_id[course_id] if course_id in by_id else canvas.get_course(course_id) for course_id in course_ids]
+    return [course for course in courses if getattr(course, 'enrollment_term_id', None) == term_id]
+
+
+def courseActivity(course, cache, limiter=picata_canvas.rate_limiter):
+    """ The merged activity frame of one course, with course_id and course_name columns in front. """
+    enrollments = picata_canvas.getEnrollments(course, cache, limiter)
+    activity = mergeActivity(summaryFrame(getStudentSummaries(course, limiter)), studentFrame(activeStudents(enrollments)))
+    activity.insert(0, 'course_name', course.name)
+    activity.insert(0, 'course_id', course.id)
+    return activity
+
+
+def fleetActivity(courses, cache, limiter=picata_canvas.rate_limiter):
+    """
+    Activity snapshot of many courses at once: the enrollments and student summaries of all courses are
+    fetched concurrently, all through the one (shared) rate limiter. Returns the consolidated frame of
+    every course that succeeded and a dict of course id to error for those that did not.
+    """
+    def fetch(course):
+        try:
+            return courseActivity(course, cache, limiter), None
+        except Exception as e:
+            return None, f"{type(e).__name__}: {e}"
+
+    start = time.perf_counter()
+    results = picata_canvas.fetchConcurrently(fetch, courses, limiter)
+    frames = [activity for activity, _ in results if activity is not None]
+    failures = {course.id: error for course, (_, error) in zip(courses, results) if error}
+    activity = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=['course_id', 'course_name'] + ACTIVITY_COLUMNS)
+    print(f"\nActivity of {len(frames)} of {len(courses)} courses ({len(activity)} students) in {time.perf_counter() - start:.1f}s")
+    for course_id, error in failures.items():
+        print(f"  course {course_id} failed: {error}")
+    return activity, failures
+
+
+def saveFleetActivity(activity, data_path):
+    """
+    Save a consolidated activity frame in data/, partitioned by course: one csv per course in a directory
+    course_activity_<date>/ (course_<id>.csv) plus all_courses.csv with every course. Returns the directory.
+    """
+    out_dir = data_path + "course_activity_" + datetime.today().strftime('%Y%m%d') + "/"
+    os.makedirs(out_dir, exist_ok=True)
+    for course_id, course_activity in activity.groupby('course_id', sort=True):
+        course_activity.to_csv(out_dir + f"course_{course_id}.csv", index=False)
+    activity.sort_values(['course_id', 'id'], kind='stable').to_csv(out_dir + "all_courses.csv", index=False)
+    return out_dir
+
+
+class ActivityHistory(picata_sqlite.SQLiteStore):
+    """
+    Append-only history of student activity in a SQLite file. Each snapshot only adds a row for the
+    students whose activity changed since the last one recorded for them, so a student's activity over
+    time is a handful of rows that can be read with one indexed query.
+    """
+
+    def __init__(self, path):
+        """ Open (or create) the history database at path. """
+        super().__init__(path)
+        self.execute("CREATE TABLE IF NOT EXISTS activity_history (course_id INTEGER, id INTEGER, snapshot TEXT, name TEXT, "
+                     "page_views REAL, missing REAL, late REAL, total_activity_mins REAL, last_activity_at TEXT, "
+                     "PRIMARY KEY (course_id, id, snapshot))")
+        self.execute("CREATE INDEX IF NOT EXISTS activity_history_student ON activity_history (id, snapshot)")
+
+    def latest(self, course_ids, before=None):
+        """ The last recorded row of every student in the given courses (as of the snapshot before, if given). """
+        # (SQLite takes the other columns of a MAX() aggregate from the row holding the maximum)
+        marks = ','.join('?' * len(course_ids))
+        params = [int(c) for c in course_ids] + ([before] if before else [])
+        latest = self.read(f"SELECT *, MAX(snapshot) AS latest FROM activity_history WHERE course_id IN ({marks}) "
+                           f"{'AND snapshot <= ?' if before else ''} GROUP BY course_id, id", params)
+        return latest.drop(columns='latest')
+
+    def record(self, activity, snapshot=None):
+        """
+        Add a snapshot (default: now) of an activity frame with a course_id column (as made by courseActivity
+        or fleetActivity), storing only the students whose activity changed. Returns the number of rows added.
+        """
+        snapshot = snapshot or datetime.now().strftime('%Y-%m-%dT%H:%M:%S')
+        current = activity.dropna(subset=['id'])[['course_id', 'id'] + HISTORY_VALUES].copy()
+        current[['course_id', 'id']] = current[['course_id', 'id']].astype('int64')
+        previous = self.latest(current['course_id'].unique().tolist())
+        merged = current.merge(previous, on=['course_id', 'id'], how='left', suffixes=('', '_previous'), indicator=True)
+        changed = merged['_merge'] == 'left_only'
+        for column in HISTORY_VALUES:
+            new, old = merged[column], merged[column + '_previous']
+            changed |= (new != old) & ~(new.isna() & old.isna())
+        rows = merged.loc[changed, ['course_id', 'id'] + HISTORY_VALUES].astype(object)
+        rows = rows.where(rows.notna(), None)
+        with self.transaction() as db:
+            db.executemany("INSERT OR REPLACE INTO activity_history VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           [(r[0], r[1], snapshot) + tuple(r[2:]) for r in rows.itertuples(index=False)])
+        return len(rows)
+
+    def timeSeries(self, student_id, course_id=None):
+        """ The recorded activity of one student (in one course, or all of them) over time: one row per change. """
+        if course_id is None:
+            return self.read("SELECT * FROM activity_history WHERE id = ? ORDER BY course_id, snapshot", (int(student_id),))
+        return self.read("SELECT * FROM activity_history WHERE id = ? AND course_id = ? ORDER BY snapshot", (int(student_id), int(course_id)))
+
+    def snapshotAt(self, course_id, snapshot):
+        """ The activity of every student of a course as it was at the time of snapshot. """
+        return self.latest([course_id], before=snapshot).sort_values('id', ignore_index=True)
+
+
+def openHistory(config):
+    """ The activity history for a PicataConfig. """
+    return ActivityHistory(config.activity_history_path)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: picata_activity.py <student id> [--course <course id>]")
+        sys.exit(1)
+    course = sys.argv[sys.argv.index('--course') + 1] if '--course' in sys.argv else None
+    print(openHistory(picata_config.PicataConfig()).timeSeries(int(sys.argv[1]), course).to_string(index=False))
@@ -0,0 +1,132 @@
+import os
+import re
+import copy
+import time
+import traceback
+import multiprocessing
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import pandas as pd
+import canvasapi
+import picata_canvas
+import picata_config
+import picata_utils
+
+# Steps of the per-quiz analysis run in batch mode, in order: (name, function of a PicaQuiz).
+BATCH_STEPS = [
+    ('histograms', lambda pica_quiz: pica_quiz.generateQuestionHistograms()),
+    ('distance', lambda pica_quiz: pica_quiz.generateDistanceMatrix(only_present=False)),
+    ('events', lambda pica_quiz: pica_quiz.getUserQuizEvents()),
+]
+
+
+def findCourse(canvas, cache, course_id):
+    """ The course with the given id, from the user's (cached) course list if it is there. """
+    for course in picata_canvas.getCourses(canvas, cache):
+        if course.id == course_id:
+            return course
+    return canvas.get_course(course_id)
+
+
+def selectQuizzes(quizzes, title_pattern=None):
+    """ The quizzes whose title matches the regular expression title_pattern (case insensitive), or all of them. """
+    if not title_pattern:
+        return list(quizzes)
+    return [quiz for quiz in quizzes if re.search(title_pattern, quiz.title, re.IGNORECASE)]
+
+
+def quizAttributes(quiz):
+    """ The JSON attributes of a canvasapi Quiz (which, unlike the Quiz itself, can be sent to another process). """
+    return {key: value for key, value in vars(quiz).items() if not key.startswith('_')}
+
+
+def initWorker(max_concurrent):
+    """
+    Set up a batch worker process: no windows for figures, and its share of the Canvas request concurrency
+    (with the limiter's locks made anew, since the parent's were copied by the fork). The worker opens its own
+    Canvas cache with its PicaQuiz, after the fork; CanvasCache connects per statement, so no SQLite connection
+    of the parent is open when the workers are forked.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    picata_canvas.rate_limiter.resize(max_concurrent)
+
+
+def analyzeQuiz(api_url, api_key, quiz_attrs, config, roster):
+    """
+    Run the batch steps for one quiz in a worker process and return a summary dict with the time of
+    each step (or the error that stopped it). roster is the course's students (dicts with 'id' and 'name'),
+    of which the quiz's summary counts those who took it. The quiz's own output goes to a log file in data/,
+    named like its other outputs.
+    """
+    summary = {'quiz_id': quiz_attrs['id'], 'title': quiz_attrs['title'], 'status': 'ok', 'error': None}
+    config = copy.copy(config)  # (PicaQuiz sets the quiz_prefix, and the quizzes may all run in this process)
+    config.background_figures = False  # (the quizzes are already spread over processes)
+    log_path = config.data_path + picata_utils.quizPrefix(quiz_attrs['title']) + str(quiz_attrs['id']) + \
+        "_batch_" + datetime.today().strftime('%Y%m%d') + ".log"
+    with open(log_path, 'w') as log, redirect_stdout(log):
+        try:
+            canvas = canvasapi.Canvas(api_url, api_key)
+            quiz = canvasapi.quiz.Quiz(picata_canvas.canvasRequester(canvas), quiz_attrs)
+            start = time.perf_counter()
+            pica_quiz = picata_utils.PicaQuiz(canvas, quiz, config, verbose=False)
+            summary['load'] = time.perf_counter() - start
+            summary['students'] = pica_quiz.n_students
+            takers = set(pica_quiz.quiz_df['id'])
+            absent = [student['name'] for student in roster if student['id'] not in takers]
+            summary['roster_fraction'] = 1.0 - len(absent) / max(len(roster), 1)
+            print(f"Students of the course who did not take the quiz ({len(absent)}): {', '.join(absent)}")
+            for step, run in BATCH_STEPS:
+                start = time.perf_counter()
+                run(pica_quiz)
+                summary[step] = time.perf_counter() - start
+        except Exception as e:
+            traceback.print_exc(file=log)
+            summary['status'] = 'failed'
+            summary['error'] = f"{type(e).__name__}: {e}"
+    return summary
+
+
+def runQuizBatch(api_url, api_key, pica_course, quizzes, config, workers=None):
+    """
+    Analyze every quiz in quizzes (histograms, distance matrix, event log) without any prompts, fanning
+    the quizzes out over a pool of forked worker processes (or one after the other in this process where
+    fork is not safe, see picata_config.forkSafe). Each worker makes its own Canvas client and reads the
+    quiz's data itself; the roster of pica_course, downloaded once, is passed to every worker.
+    The Canvas request concurrency is split between the workers. Prints and saves a summary of the per-quiz
+    timings and failures, and returns it as a dataframe.
+    """
+    workers = workers or min(len(quizzes), os.cpu_count() or 1, 4)
+    if not picata_config.forkSafe():
+        workers = 1
+    roster = [{'id': student['id'], 'name': student['name']} for student in pica_course.students]
+    max_concurrent = max(1, picata_canvas.rate_limiter.max_concurrent // max(workers, 1))
+    start = time.perf_counter()
+    summaries = []
+    if workers <= 1:
+        print(f"\nAnalyzing {len(quizzes)} quizzes in this process")
+        for quiz in quizzes:
+            summaries.append(analyzeQuiz(api_url, api_key, quizAttributes(quiz), config, roster))
+            print(f"  [{len(summaries):3d}/{len(quizzes)}] {summaries[-1]['title']}: {summaries[-1]['status']}")
+    else:
+        print(f"\nAnalyzing {len(quizzes)} quizzes with {workers} worker processes")
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=initWorker, initargs=(max_concurrent,)) as pool:
+            futures = [pool.submit(analyzeQuiz, api_url, api_key, quizAttributes(quiz), config, roster) for quiz in quizzes]
+            for future in as_completed(futures):
+                summary = future.result()
+                summaries.append(summary)
+                print(f"  [{len(summaries):3d}/{len(quizzes)}] {summary['title']}: {summary['status']}")
+
+    columns = ['quiz_id', 'title', 'status', 'students', 'roster_fraction', 'load'] + [step for step, _ in BATCH_STEPS] + ['error']
+    batch_summary = pd.DataFrame(summaries).reindex(columns=columns).sort_values('quiz_id')
+    batch_summary_csv = config.data_path + "batch_summary_" + datetime.today().strftime('%Y%m%d') + ".csv"
+    batch_summary.to_csv(batch_summary_csv, index=False)
+
+    print(f"\nBatch summary ({time.perf_counter() - start:.1f}s in total, saved to {batch_summary_csv}):")
+    print(batch_summary.drop(columns='error').to_string(index=False, float_format=lambda x: f"{x:.2f}"))
+    for summary in summaries:
+        if summary['error']:
+            print(f"  {summary['title']} failed: {summary['error']}")
+    return batch_summary
@@ -0,0 +1,586 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the picata computation stages, using synthetic data only (no Canvas access).
+
+Usage: python picata_bench.py <benchmark> [--sizes 50,500,5000]
+"""
+import os
+import csv
+import sys
+import time
+import types
+import subprocess
+import tempfile
+import contextlib
+import tracemalloc
+import warnings
+import random
+import numpy as np
+import pandas as pd
+import scipy.spatial.distance as distance
+import canvasapi
+import picata_bonus
+import picata_canvas
+import picata_config
+import picata_distance
+import picata_figures
+import picata_largeclass
+import picata_mock
+import picata_montecarlo
+import picata_pairing
+import picata_partners
+import picata_profiles
+import picata_session
+import picata_utils
+
+
+def syntheticQuizScores(n_students, n_questions=6, seed=0):
+    """ Quiz dataframe shaped like a student_analysis report, with scores of 0, 0.5 or 1 per question. """
+    rng = np.random.default_rng(seed)
+    quiz_df = pd.DataFrame({
+        'name': [f"Student {i:05d}" for i in range(n_students)],
+        'id': rng.permutation(n_students) + 10000,
+    })
+    for q in range(n_questions):
+        quiz_df[str(500 + q) + '_score'] = rng.choice([0.0, 0.5, 1.0], size=n_students, p=[0.3, 0.1, 0.6])
+    quiz_df['score'] = quiz_df.filter(like='_score').sum(axis=1)
+    return quiz_df
+
+
+def timeIt(func, *args, **kwargs):
+    """ Run func once and return (seconds, result). """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def legacyDistanceMatrix(quiz_df_local, distance_type='euclid', max_rows=None):
+    """
+    The original per-pair loop of PicaQuiz.generateDistanceMatrix, kept for comparison. If max_rows
+    is given only that many rows of the outer loop are computed (used to estimate very slow runs).
+    """
+    student_ids = list(quiz_df_local['id'])
+    student_ids.sort()
+    dist_matrix = pd.DataFrame(0.0, columns=student_ids, index=student_ids)
+    for i, id1 in enumerate(student_ids[:max_rows]):
+        x = quiz_df_local.loc[quiz_df_local.id == id1, quiz_df_local.columns.str.endswith('_score')].to_numpy().flatten()
+        x = [0.0 if pd.isna(val) else val for val in x]
+        for j, id2 in enumerate(student_ids):
+            if i < j:
+                y = quiz_df_local.loc[quiz_df_local.id == id2, quiz_df_local.columns.str.endswith('_score')].to_numpy().flatten()
+                y = [0.0 if pd.isna(val) else val for val in y]
+                if distance_type == 'euclid':
+                    dist = distance.euclidean(x, y)
+                elif distance_type == 'cosine':
+                    dist = distance.cosine(x, y)
+                if dist == 0:
+                    dist = 1E-4
+                dist_matrix.loc[id1, id2] = dist
+                dist_matrix.loc[id2, id1] = dist
+    return dist_matrix
+
+
+def benchDistance(sizes, legacy_pairs=2000):
+    """ Compare the vectorized distance matrix with the original loop (estimated from ~legacy_pairs pairs when n is large). """
+    print(f"{'students':>9} {'vectorized (s)':>15} {'loop (s)':>12} {'speedup':>9}")
+    for n in sizes:
+        quiz_df = syntheticQuizScores(n)
+        t_new, dm_new = timeIt(picata_distance.distanceMatrix, quiz_df)
+
+        rows = n if n * (n - 1) / 2 <= legacy_pairs else max(1, legacy_pairs // n)
+        t_old, dm_old = timeIt(legacyDistanceMatrix, quiz_df, max_rows=rows)
+        # row i of the loop computes n - 1 - i pairs, so scale by the fraction of pairs done
+        pairs_done = sum(n - 1 - i for i in range(rows))
+        t_old = t_old * (n * (n - 1) / 2) / max(pairs_done, 1)
+        estimated = " (est.)" if rows < n else ""
+        if rows == n:
+            assert np.allclose(dm_new.to_numpy(), dm_old.to_numpy())
+        print(f"{n:>9d} {t_new:>15.4f} {t_old:>12.2f} {t_old / t_new:>8.0f}x{estimated}")
+
+
+def presentScores(quiz_df, n_present, n_late, seed=1):
+    """ Scores of n_present students of quiz_df plus n_late students who missed the quiz, zero-filled as in openPresentCSV. """
+    present = quiz_df[['name', 'id']].sample(n_present, random_state=seed)
+    late = pd.DataFrame({'name': [f"Late {k}" for k in range(n_late)], 'id': np.arange(n_late) + 1})
+    return pd.merge(pd.concat([present, late]), quiz_df, how='left').fillna(0)
+
+
+def benchPresent(sizes):
+    """ Time the present students' distance matrix recomputed from scratch and taken from the whole class's distances. """
+    print(f"{'students':>9} {'present':>8} {'whole class (s)':>16} {'recomputed (s)':>15} {'from store (s)':>15} {'+ 3 late (s)':>13}")
+    for n in sizes:
+        quiz_df = syntheticQuizScores(n)
+        t_full, store = timeIt(picata_distance.DistanceStore, quiz_df)
+        present_df = presentScores(quiz_df, int(0.8 * n), 0)
+        t_recomputed, dm_old = timeIt(picata_distance.distanceMatrix, present_df)
+        t_store, dm_new = timeIt(store.matrix, present_df)
+        assert np.array_equal(dm_new.to_numpy(), dm_old.to_numpy())
+        t_late, _ = timeIt(store.matrix, presentScores(quiz_df, int(0.8 * n), 3))
+        print(f"{n:>9d} {len(present_df):>8d} {t_full:>16.3f} {t_recomputed:>15.3f} {t_store:>15.3f} {t_late:>13.3f}")
+
+
+def benchSession(sizes, changes=5):
+    """ Time adding and removing students in a live pairing session, compared with pairing everyone again. """
+    print(f"{'students':>9} {'pair again (s)':>15} {'add (s)':>8} {'remove (s)':>11} {'groups kept':>12}")
+    with tempfile.TemporaryDirectory() as data_path:
+        for n in sizes:
+            quiz_df = syntheticQuizScores(n)
+            quiz = BenchQuiz(quiz_df, data_path + '/')
+            quiz.config.figures = []
+            present = presentScores(quiz_df, int(0.8 * n), 0)
+            quiz.setPresentStudents(present[['name', 'id']].assign(present=1))
+            quiz.generateDistanceMatrix(only_present=True)
+            roster = [{'id': k + 1, 'name': f"Late {k}"} for k in range(changes)]
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                session = picata_session.PairingSession(quiz, roster)
+                t_again, _ = timeIt(quiz.createStudentPairings, 'med', True)
+            before = set(session.groups)
+            late = [student['id'] for student in roster] + quiz_df['id'][~quiz_df['id'].isin(present['id'])].tolist()[:changes]
+            t_add = sum(timeIt(session.add, student_id)[0] for student_id in late) / len(late)
+            leaving = present['id'].tolist()[:changes] + late[:changes]
+            t_remove = sum(timeIt(session.remove, student_id)[0] for student_id in leaving) / len(leaving)
+            members = [m for group in session.groups for m in group]
+            assert sorted(members) == sorted(session.present()) and all(len(group) in (2, 3) for group in session.groups)
+            kept = len(before & set(session.groups)) / len(before)
+            print(f"{n:>9d} {t_again:>15.3f} {t_add:>8.3f} {t_remove:>11.3f} {100 * kept:>11.0f}%")
+
+
+def benchGroups(sizes, group_sizes=(3, 4, 5)):
+    """ Time diverse group formation and compare its total within-group distance with random groups of the same sizes. """
+    print(f"{'students':>9} {'k':>3} {'time (s)':>9} {'distance':>10} {'random groups':>14} {'gain':>7}")
+    rng = np.random.default_rng(0)
+    for n in sizes:
+        dists = picata_distance.distanceMatrix(syntheticQuizScores(n)).to_numpy()
+        for k in group_sizes:
+            t, groups = timeIt(picata_pairing.diverseGroups, dists, k)
+            cuts = np.cumsum([0] + picata_pairing.groupSizes(n, k))
+            order = rng.permutation(n)
+            random_groups = [tuple(order[cuts[g]:cuts[g + 1]]) for g in range(len(cuts) - 1)]
+            weight, random_weight = picata_pairing.groupingWeight(dists, groups), picata_pairing.groupingWeight(dists, random_groups)
+            print(f"{n:>9d} {k:>3d} {t:>9.3f} {weight:>10.1f} {random_weight:>14.1f} {100 * (weight / random_weight - 1):>6.1f}%")
+
+
+def benchPartners(sizes, sessions=30):
+    """
+    Pair the same class (with new scores) once per session for a semester, recording every pairing in the pairing
+    history, and time recording a pairing and reading the repeat counts of the class; compare the repeat partners
+    of the last session's pairing with and without them forbidden.
+    """
+    print(f"{'students':>9} {'sessions':>9} {'record (s)':>11} {'repeat counts (s)':>18} {'repeats':>8} {'forbidden':>10}")
+    with tempfile.TemporaryDirectory() as data_path:
+        for n in sizes:
+            history = picata_partners.PairingHistory(f"{data_path}/pairing_history_{n}.sqlite")
+            t_record = 0.0
+            for session in range(sessions + 1):
+                dist_matrix = picata_distance.distanceMatrix(syntheticQuizScores(n, seed=session).sort_values('id'))
+                t_counts, counts = timeIt(history.repeatCounts, dist_matrix.index, 1)
+                penalty = picata_partners.repeatPenalty(counts, np.inf)
+                pairings = picata_pairing.studentPairings(dist_matrix, 'med', penalty)
+                if session < sessions:
+                    t_record += timeIt(history.record, 1, 100 + session, f"2026{session // 28 + 9:02d}{session % 28 + 1:02d}",
+                                       [pairing[:-1] for pairing in pairings])[0]
+            repeats = picata_partners.repeatPartners(counts, dist_matrix.index, picata_pairing.studentPairings(dist_matrix, 'med'))
+            forbidden = picata_partners.repeatPartners(counts, dist_matrix.index, pairings)
+            print(f"{n:>9d} {sessions:>9d} {t_record / sessions:>11.3f} {t_counts:>18.3f} {repeats:>8d} {forbidden:>10d}")
+
+
+def benchPatterns(sizes, dense_max=5000):
+    """
+    Time and peak memory of the whole class's distances as a dense array and compressed by score pattern (DistanceStore),
+    and the bonus check of all pairs of the class looked up from each (the dense array only up to dense_max students).
+    """
+    print(f"{'students':>9} {'patterns':>9} {'dense (s)':>10} {'dense (MB)':>11} {'store (s)':>10} {'store (MB)':>11} "
+          f"{'bonus dense (s)':>16} {'bonus store (s)':>16}")
+    rule = picata_bonus.BonusRule()
+    for n in sizes:
+        quiz_df = syntheticQuizScores(n)
+        order = np.random.default_rng(0).permutation(quiz_df['id'].to_numpy())
+        pairings = pd.DataFrame({'id1': order[0::2][:n // 2], 'id2': order[1::2][:n // 2]})
+        tracemalloc.start()
+        t_store, store = timeIt(picata_distance.DistanceStore, quiz_df)
+        store_mb = tracemalloc.get_traced_memory()[1] / 1E6
+        tracemalloc.stop()
+        t_bonus_store, by_store = timeIt(picata_bonus.evaluateBonus, pairings, store, quiz_df, rule, 6.0)
+        if n <= dense_max:
+            tracemalloc.start()
+            t_dense, dist_matrix = timeIt(picata_distance.distanceMatrix, quiz_df)
+            dense_mb = tracemalloc.get_traced_memory()[1] / 1E6
+            tracemalloc.stop()
+            t_bonus_dense, by_matrix = timeIt(picata_bonus.evaluateBonus, pairings, dist_matrix, quiz_df, rule, 6.0)
+            assert np.allclose(by_store.to_numpy(), by_matrix.to_numpy(), equal_nan=True)
+            dense = f"{t_dense:>10.3f} {dense_mb:>11.0f}"
+            bonus_dense = f"{t_bonus_dense:>16.3f}"
+        else:
+            dense = f"{'-':>10} {'> ' + format(8 * n * n / 1E6, '.0f'):>11}"
+            bonus_dense = f"{'-':>16}"
+        print(f"{n:>9d} {len(store.patterns):>9d} {dense} {t_store:>10.3f} {store_mb:>11.1f} {bonus_dense} {t_bonus_store:>16.3f}")
+
+
+def benchLargeClass(sizes, exact_max=5000, n_questions=10):
+    """
+    Time and peak memory of pairing a large class approximately by score pattern, and of the exact method (distance
+    matrix and greedy 'med' pairing, up to exact_max students), with the approximate pairing's quality on samples.
+    """
+    print(f"{'students':>9} {'patterns':>9} {'approx (s)':>11} {'approx (MB)':>12} {'exact (s)':>10} {'exact (MB)':>11} {'sample ratio':>13}")
+    for n in sizes:
+        ids, scores = picata_distance.scoreMatrix(syntheticQuizScores(n, n_questions))
+        patterns = len(np.unique(scores, axis=0))
+        tracemalloc.start()
+        t_approx, _ = timeIt(picata_largeclass.approximatePairings, ids.tolist(), scores)
+        approx_mb = tracemalloc.get_traced_memory()[1] / 1E6
+        tracemalloc.stop()
+        if n <= exact_max:
+            tracemalloc.start()
+            t_exact, _ = timeIt(lambda: picata_pairing.studentPairings(picata_distance.distanceMatrix(syntheticQuizScores(n, n_questions))))
+            exact_mb = tracemalloc.get_traced_memory()[1] / 1E6
+            tracemalloc.stop()
+            exact = f"{t_exact:>10.3f} {exact_mb:>11.0f}"
+        else:
+            exact = f"{'-':>10} {'> ' + format(8 * n * n / 1E6, '.0f'):>11}"
+        ratio = picata_largeclass.sampleQuality(scores)['ratio'].mean()
+        print(f"{n:>9d} {patterns:>9d} {t_approx:>11.3f} {approx_mb:>12.1f} {exact} {ratio:>13.3f}")
+
+
+def writeArchivedReport(path, quiz_df):
+    """ Save a synthetic quiz dataframe as a raw student_analysis csv (question text and points columns), as --archive-reports does. """
+    columns, header = [quiz_df['name'], quiz_df['id']], ['name', 'id']
+    for col in [col for col in quiz_df.columns if col.endswith('_score')]:
+        columns += [pd.Series('answer', index=quiz_df.index), quiz_df[col]]
+        header += [f"{col[:-len('_score')]}: Question text", '1.0']
+    columns += [quiz_df['score'].round(), quiz_df['score']]
+    header += ['n correct', 'score']
+    pd.concat(columns, axis=1).set_axis(header, axis=1).to_csv(path, index=False)
+
+
+def benchProfiles(sizes, students=500, window=5):
+    """ Time reading the scores of the last window quizzes from archived csv reports and from the profile store. """
+    print(f"{'quizzes':>8} {'students':>9} {'parse csv reports (s)':>22} {'profile store (s)':>18}")
+    with tempfile.TemporaryDirectory() as data_path:
+        for n_quizzes in sizes:
+            store = picata_profiles.ProfileStore(f"{data_path}/profiles_{n_quizzes}")
+            paths = []
+            for k in range(n_quizzes):
+                quiz_df = syntheticQuizScores(students, n_questions=8, seed=k)
+                quiz_df.columns = [f"{int(col[:3]) + 10 * k}_score" if col.endswith('_score') else col for col in quiz_df.columns]
+                paths.append(f"{data_path}/quiz_{1000 + k}_202609{k % 28 + 1:02d}_student_analysis.csv")
+                writeArchivedReport(paths[-1], quiz_df)
+                picata_profiles.importReport(store, paths[-1], 1)
+
+            def parseReports():
+                frames = []
+                for path in paths[-window - 1:]:
+                    with open(path, encoding='utf-8-sig', newline='') as f:
+                        question_ids = [col.split(':')[0] for col in next(csv.reader(f)) if col.split(':')[0].isdigit()]
+                        f.seek(0)
+                        frames.append(picata_canvas.parseQuizReport(f, question_ids).set_index('id').filter(like='_score'))
+                return pd.concat(frames, axis=1)
+            t_csv, _ = timeIt(parseReports)
+            t_store, _ = timeIt(lambda: picata_profiles.ProfileStore(store.path).historyFrame(1, 1000 + n_quizzes - 1, window))
+            print(f"{n_quizzes:>8d} {students:>9d} {t_csv:>22.3f} {t_store:>18.3f}")
+
+
+def legacyPairings(dist_matrix, method='med'):
+    """ The original DataFrame-drop loop of PicaQuiz.createStudentPairings, kept for comparison. """
+    dm = dist_matrix.copy()
+    pairings = []
+    while dm.shape[0] > 2:
+        col_maximums = dm.max()
+        col_max_indices = dm.idxmax()
+        if method == 'max':
+            person_A = col_maximums.idxmax()
+        elif method == 'med':
+            col_maximums.sort_values(inplace=True)
+            person_A = col_maximums.index[len(col_maximums) // 2]
+        elif method == 'min':
+            person_A = col_maximums.idxmin()
+        elif method == 'rand':
+            people = list(dm.index)
+            random.shuffle(people)
+            person_A = people[0]
+            person_B = people[1]
+            pairings.append((person_A, person_B, dm.loc[person_A, person_B]))
+        if method != 'rand':
+            person_B = col_max_indices[person_A]
+            pairings.append((person_A, person_B, col_maximums[person_A]))
+        dm.drop(index=[person_A, person_B], columns=[person_A, person_B], inplace=True)
+    if dm.shape[0] == 2:
+        pairings.append((dm.index[0], dm.index[1], dm.iat[0, 1]))
+    else:
+        temp_tuple = pairings[-1]
+        pairings[-1] = (temp_tuple[0], temp_tuple[1], dm.index[0],
+                        max(temp_tuple[2], dist_matrix.loc[temp_tuple[0], dm.index[0]], dist_matrix.loc[temp_tuple[1], dm.index[0]]))
+    return pairings
+
+
+def benchPairing(sizes, legacy_max=2000):
+    """ Compare the array-backed greedy pairing with the original DataFrame-drop loop (skipped above legacy_max). """
+    print(f"{'students':>9} {'method':>7} {'array (s)':>10} {'loop (s)':>10} {'speedup':>9}")
+    for n in sizes:
+        dist_matrix = picata_distance.distanceMatrix(syntheticQuizScores(n, n_questions=12))
+        for method in ['max', 'med', 'min']:
+            t_new, pairs_new = timeIt(picata_pairing.studentPairings, dist_matrix, method)
+            if n > legacy_max:
+                print(f"{n:>9d} {method:>7} {t_new:>10.4f} {'-':>10} {'-':>9}")
+                continue
+            t_old, pairs_old = timeIt(legacyPairings, dist_matrix, method)
+            if method != 'med':  # (the original sort for 'med' is not stable, so ties may be broken differently)
+                assert [p[:-1] for p in pairs_new] == [p[:-1] for p in pairs_old]
+            print(f"{n:>9d} {method:>7} {t_new:>10.4f} {t_old:>10.2f} {t_old / t_new:>8.0f}x")
+
+
+def legacyUserQuizEvents(canvas_quiz, quiz_takers):
+    """ The original serial loop of PicaQuiz.getUserQuizEvents, kept for comparison. """
+    user_events = pd.DataFrame(columns=['name', 'id', 'event', 'timestamp'])
+    for sub in canvas_quiz.get_submissions():
+        row = quiz_takers[quiz_takers['id'] == sub.user_id]
+        if len(row) == 0:
+            continue
+        for event in sub.get_submission_events():
+            user_events.loc[len(user_events)] = [row['name'].values[0], sub.user_id, event.event_type, event.created_at]
+    return user_events
+
+
+class EventsQuiz(picata_utils.PicaQuiz):
+    """ PicaQuiz of a (mock) Canvas quiz taken by quiz_takers, without downloading its report, writing any csv files to data_path. """
+
+    def __init__(self, canvas_quiz, quiz_takers, data_path):
+        """ Set up the attributes getUserQuizEvents needs. """
+        self.config = picata_config.PicataConfig()
+        self.config.data_path = data_path
+        self.config.quiz_prefix = picata_utils.quizPrefix(canvas_quiz.title)
+        self.verbose = False
+        self.canvas_quiz = canvas_quiz
+        self.quiz_df = quiz_takers
+        self.submissions = None
+
+
+def concurrentUserQuizEvents(canvas_quiz, quiz_takers):
+    """ The events downloaded by PicaQuiz.getUserQuizEvents (read back from the csv it writes, in a temporary directory). """
+    with tempfile.TemporaryDirectory() as data_path:
+        EventsQuiz(canvas_quiz, quiz_takers, data_path + '/').getUserQuizEvents()
+        events_csv, = [name for name in os.listdir(data_path) if '_user_events_' in name]
+        return pd.read_csv(os.path.join(data_path, events_csv))
+
+
+def benchEvents(sizes, latency=0.02):
+    """
+    Compare serial and concurrent downloads of submission events from a local mock Canvas server. The serial
+    baseline is reported as rate limited when it runs out of the mock's request quota.
+    """
+    print(f"{'students':>9} {'events':>7} {'concurrent (s)':>15} {'serial (s)':>11} {'speedup':>9}")
+    warnings.filterwarnings('ignore', message='Canvas may respond unexpectedly when making requests to HTTP URLs')
+    for n in sizes:
+        course = picata_mock.syntheticCourse(n_students=n, events_per_submission=60)
+        server, url = picata_mock.startMockCanvas(picata_mock.MockCanvas(course, latency=latency))
+        canvas = canvasapi.Canvas(url, "mock-token")
+        quiz = canvasapi.quiz.Quiz(canvas._Canvas__requester, {'id': 1, 'course_id': course['id'], 'title': 'Quiz 1'})
+        quiz_takers = pd.DataFrame(course['students'])[['name', 'id']]
+
+        t_new, events_new = timeIt(concurrentUserQuizEvents, quiz, quiz_takers)
+        try:
+            t_old, events_old = timeIt(legacyUserQuizEvents, quiz, quiz_takers)
+        except canvasapi.exceptions.RateLimitExceeded:
+            # (the serial loop has no rate limiter, so with a few hundred students it runs out of the mock's quota)
+            print(f"{n:>9d} {len(events_new):>7d} {t_new:>15.2f} {'rate limited':>11} {'-':>9}")
+            continue
+        finally:
+            server.shutdown()
+        assert events_new.astype(str).equals(events_old.astype(str))
+        print(f"{n:>9d} {len(events_new):>7d} {t_new:>15.2f} {t_old:>11.2f} {t_old / t_new:>8.1f}x")
+
+
+def alikePairings(course, quiz_id):
+    """ Pairings (as a pairing csv dataframe) of the students of a synthetic course with identical answers, who all earn the bonus. """
+    names = {student['id']: student['name'] for student in course['students']}
+    by_answers = {}
+    for sub in course['quizzes'][quiz_id]['submissions']:
+        by_answers.setdefault(tuple(sub['answers']), []).append(sub['user_id'])
+    pairs = [(ids[k], ids[k + 1]) for ids in by_answers.values() for k in range(0, len(ids) - 1, 2)]
+    return pd.DataFrame({'person1': [names[a] for a, _ in pairs], 'person2': [names[b] for _, b in pairs],
+                         'id1': [a for a, _ in pairs], 'id2': [b for _, b in pairs]})
+
+
+def benchEndToEnd(sizes, latency=0.01, report_seconds=0.5, quota=1E6):
+    """
+    Time whole picata.py runs (activity, pair and award-bonus, in a fresh interpreter and working directory)
+    against a local mock Canvas serving a synthetic course, with the number of Canvas requests each makes.
+    The prompts are answered on stdin: the current course, its quiz, and the csv of students present (all of
+    them) or of pairings (students with identical answers, so that award-bonus sets fudge points). The mock's
+    quota is large enough that picata is never throttled; with Canvas's 700 the runs mostly time the rate limiter.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    today = time.strftime('%Y%m%d')
+    print(f"{'students':>9} {'task':>12} {'time (s)':>9} {'requests':>9}")
+    for n in sizes:
+        course = picata_mock.syntheticCourse(n_students=n, events_per_submission=5)
+        mock = picata_mock.MockCanvas(course, latency=latency, max_per_page=100, quota=quota, report_seconds=report_seconds)
+        server, url = picata_mock.startMockCanvas(mock)
+        env = dict(os.environ, CANVAS_URL=url, CANVAS_TOKEN="mock-token")
+        with tempfile.TemporaryDirectory() as workdir:
+            os.makedirs(workdir + '/data')
+            os.makedirs(workdir + '/figures')
+            students = pd.DataFrame(course['students'])[['name', 'id']]
+            students.assign(present=1).to_csv(f"{workdir}/data/present_{today}.csv", index=False)
+            # ('alike_...' is listed before the pairing csv the pair task writes)
+            alikePairings(course, 1).to_csv(f"{workdir}/data/alike_pairing_{today}.csv", index=False)
+            for task, answers in [('activity', "1\n0\n"), ('pair', "1\n0\n0\n0\n"), ('award-bonus', "1\n0\n0\n0\n")]:
+                n_requests = mock.n_requests
+                t_task, result = timeIt(subprocess.run, [sys.executable, os.path.join(here, 'picata.py'), task, '--no-figures'],
+                                        cwd=workdir, env=env, input=answers, capture_output=True, text=True)
+                if result.returncode != 0:
+                    raise RuntimeError(f"picata.py {task} failed:\n{result.stdout[-2000:]}\n{result.stderr[-2000:]}")
+                print(f"{n:>9d} {task:>12} {t_task:>9.2f} {mock.n_requests - n_requests:>9d}")
+        server.shutdown()
+
+
+class BenchQuiz(picata_utils.PicaQuiz):
+    """ PicaQuiz on synthetic data: the submissions snapshot is given rather than downloaded and no fudge points are set. """
+
+    def __init__(self, quiz_df, data_path):
+        """ Set up the attributes PicaQuiz would get from Canvas, writing any csv files to data_path. """
+        self.config = picata_config.PicataConfig()
+        self.config.data_path = data_path
+        self.config.pairing_history_path = data_path + "pairing_history.sqlite"
+        self.verbose = False
+        self.canvas_quiz = types.SimpleNamespace(id=1, course_id=1, points_possible=6.0)
+        self.quiz_df = quiz_df
+        self.df_quiz_scores_present = quiz_df
+        self.quiz_question_ids = [col[:-len('_score')] for col in quiz_df.columns if col.endswith('_score')]
+        self.dist_matrix = picata_distance.distanceMatrix(quiz_df)
+        self.distances = None
+        self.history = None
+        self.large_class = None
+        items = [{'id': 50000 + k, 'user_id': int(row.id), 'score': float(row.score), 'fudge_points': None, 'attempt': 1,
+                  'started_at': '2026-09-01T09:00:00Z', 'finished_at': '2026-09-01T09:20:00Z', 'time_spent': 1200}
+                 for k, row in enumerate(quiz_df.itertuples())]
+        self.submissions = picata_canvas.SubmissionsSnapshot(items, None, 1, 1)
+
+    def updateFudgePoints(self, updates):
+        """ Nothing is sent to Canvas. """
+        return True
+
+
+def benchMonteCarlo(sizes, draws=10000, legacy_draws=200):
+    """ Time draws random pairings drawn with vectorized permutations (in this process and on all cores) and one at a time with the 'rand' method. """
+    print(f"{'students':>9} {'draws':>7} {'vectorized (s)':>15} {f'{os.cpu_count()} workers (s)':>15} {'one at a time (s)':>18} {'speedup':>9}")
+    for n in sizes:
+        dists = picata_distance.distanceArray(syntheticQuizScores(n)[['500_score', '501_score', '502_score']].to_numpy())
+        t_vector, _ = timeIt(picata_montecarlo.randomPairingStats, dists, draws, 0, 1)
+        picata_montecarlo.PARALLEL_MIN_WORK, min_work = 0, picata_montecarlo.PARALLEL_MIN_WORK
+        t_workers, _ = timeIt(picata_montecarlo.randomPairingStats, dists, draws, 0)
+        picata_montecarlo.PARALLEL_MIN_WORK = min_work
+        t_loop, _ = timeIt(lambda: [picata_pairing.greedyGroups(dists, 'rand') for _ in range(legacy_draws)])
+        t_loop *= draws / legacy_draws
+        print(f"{n:>9d} {draws:>7d} {t_vector:>15.3f} {t_workers:>15.3f} {t_loop:>17.2f}* {t_loop / t_vector:>8.0f}x")
+    print(f"* estimated from {legacy_draws} draws (without computing the pair distances)")
+
+
+def benchLookups(sizes):
+    """ Time the PicaQuiz stages that match students by id, whose cost per student should stay flat as classes grow. """
+    print(f"{'students':>9} {'stage':>20} {'time (s)':>9} {'us/student':>11}")
+    with tempfile.TemporaryDirectory() as data_path:
+        for n in sizes:
+            quiz_df = syntheticQuizScores(n)
+            quiz_df['n_correct'] = quiz_df['score'].round()
+            quiz_df['n_incorrect'] = 6 - quiz_df['n_correct']
+            quiz = BenchQuiz(quiz_df, data_path + '/')
+            pairs = picata_pairing.studentPairings(quiz.dist_matrix, 'med')
+
+            t_write, _ = timeIt(quiz.writePairingsCSV, 'med', pairs)
+            quiz.df_past_pairings = pd.DataFrame({'id1': [p[0] for p in pairs], 'id2': [p[1] for p in pairs],
+                                                  'id3': [p[2] if len(p) == 4 else -1 for p in pairs], 'distance': [p[-1] for p in pairs]})
+            quiz.df_paired_students = quiz_df[['name', 'id']].copy()
+            t_check, _ = timeIt(quiz.checkForBonusEarned)
+            t_award, _ = timeIt(quiz.awardBonusPoints)
+            for stage, t in [('writePairingsCSV', t_write), ('checkForBonusEarned', t_check), ('awardBonusPoints', t_award)]:
+                print(f"{n:>9d} {stage:>20} {t:>9.3f} {1E6 * t / n:>11.1f}")
+
+
+def pairPath(quiz):
+    """ The computations of 'picata.py pair' after the quiz data is loaded (histograms, distances, comparison, pairing csv). """
+    quiz.generateQuestionHistograms()
+    quiz.generateDistanceMatrix(only_present=False)
+    quiz.generateDistanceMatrix(only_present=True)
+    quiz.comparePairingMethods()
+    quiz.createStudentPairings(method='med', write_csv=True)
+
+
+def benchStartup(sizes, repeats=3):
+    """ Time picata.py startup (median of repeats runs in a fresh interpreter), then the pair path with and without figures. """
+    here = os.path.dirname(os.path.abspath(__file__))
+    commands = {
+        'picata.py help': [sys.executable, 'picata.py', 'help'],
+        'picata.py <bad task>': [sys.executable, 'picata.py', 'no-such-task'],
+        'import picata modules': [sys.executable, '-c', 'import picata_utils, picata_activity, picata_batch'],
+    }
+    print(f"{'startup':>24} {'time (s)':>9}")
+    for name, command in commands.items():
+        times = sorted(timeIt(subprocess.run, command, cwd=here, capture_output=True)[0] for _ in range(repeats))
+        print(f"{name:>24} {times[len(times) // 2]:>9.2f}")
+
+    print(f"\n{'students':>9} {'pair path, figures (s)':>23} {'--no-figures (s)':>17}")
+    with tempfile.TemporaryDirectory() as data_path:
+        for n in sizes:
+            quiz = BenchQuiz(syntheticQuizScores(n), data_path + '/')
+            quiz.config.figures_path = data_path + '/'
+            quiz.config.background_figures = False
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                t_figures, _ = timeIt(pairPath, quiz)
+                quiz.config.figures = []
+                t_none, _ = timeIt(pairPath, quiz)
+            print(f"{n:>9d} {t_figures:>23.2f} {t_none:>17.3f}")
+
+
+def benchFigures(sizes):
+    """
+    Time the pair path with the figures drawn inline and in the background: how long the computation is
+    blocked, and how long until the figures are all drawn (heatmaps above 50 students are no longer annotated).
+    """
+    print(f"{'students':>9} {'inline (s)':>11} {'background, blocked (s)':>24} {'figures done (s)':>17}")
+    with tempfile.TemporaryDirectory() as data_path:
+        for n in sizes:
+            quiz = BenchQuiz(syntheticQuizScores(n), data_path + '/')
+            quiz.config.figures_path = data_path + '/'
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                quiz.config.background_figures = False
+                t_inline, _ = timeIt(pairPath, quiz)
+                quiz.config.background_figures = True
+                start = time.perf_counter()
+                pairPath(quiz)
+                t_blocked = time.perf_counter() - start
+                picata_figures.renderer.wait()
+                t_done = time.perf_counter() - start
+            print(f"{n:>9d} {t_inline:>11.2f} {t_blocked:>24.3f} {t_done:>17.2f}")
+    picata_figures.renderer.close()
+
+
+def parseSizes(argv, default):
+    """ Read a comma-separated '--sizes' option from argv. """
+    if '--sizes' in argv:
+        return [int(s) for s in argv[argv.index('--sizes') + 1].split(',')]
+    return default
+
+
+benchmarks = {
+    'distance': lambda argv: benchDistance(parseSizes(argv, [50, 500, 5000])),
+    'present': lambda argv: benchPresent(parseSizes(argv, [100, 1000, 5000])),
+    'session': lambda argv: benchSession(parseSizes(argv, [40, 400, 2000])),
+    'montecarlo': lambda argv: benchMonteCarlo(parseSizes(argv, [40, 400, 2000])),
+    'groups': lambda argv: benchGroups(parseSizes(argv, [100, 1000, 3000])),
+    'profiles': lambda argv: benchProfiles(parseSizes(argv, [10, 40])),
+    'patterns': lambda argv: benchPatterns(parseSizes(argv, [1000, 5000, 20000])),
+    'largeclass': lambda argv: benchLargeClass(parseSizes(argv, [2000, 5000, 20000, 100000])),
+    'partners': lambda argv: benchPartners(parseSizes(argv, [40, 400, 2000])),
+    'pairing': lambda argv: benchPairing(parseSizes(argv, [100, 500, 2000])),
+    'events': lambda argv: benchEvents(parseSizes(argv, [50, 250])),
+    'endtoend': lambda argv: benchEndToEnd(parseSizes(argv, [30, 300, 3000])),
+    'lookups': lambda argv: benchLookups(parseSizes(argv, [250, 1000, 4000])),
+    'startup': lambda argv: benchStartup(parseSizes(argv, [30])),
+    'figures': lambda argv: benchFigures(parseSizes(argv, [30, 200, 1000])),
+}
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        print(f"Usage: picata_bench.py [{'|'.join(benchmarks)}] [--sizes n1,n2,...]")
+        sys.exit(1)
+    benchmarks[sys.argv[1]](sys.argv[2:])
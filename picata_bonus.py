@@ -0,0 +1,122 @@
+import numpy as np
+import pandas as pd
+import picata_distance
+
+
+class BonusRule:
+    """
+    How much bonus each group of a past pairing earns. A group earns the full bonus if the largest
+    distance between its members is at most threshold. If min_agreement is below 1, a group that did
+    not get within the threshold but whose members gave the same score on at least that (weighted)
+    fraction of the questions earns the bonus scaled by that fraction. question_weights maps question
+    ids to weights (1 for questions not given) used both for the agreement fraction and, if given, for
+    a weighted euclidean distance between members in place of the distance matrix.
+    """
+
+    def __init__(self, amount=0.2, threshold=0.01, min_agreement=1.0, question_weights=None):
+        """ The bonus amount is a fraction of the points possible if below 1, otherwise a number of points. """
+        self.amount = amount
+        self.threshold = threshold
+        self.min_agreement = min_agreement
+        self.question_weights = question_weights
+
+    def points(self, points_possible):
+        """ Full bonus in points for a quiz worth points_possible. """
+        return round(self.amount * points_possible) if self.amount < 1.0 else self.amount
+
+    def weights(self, score_cols):
+        """ Weight of each '_score' column (question ids may be given as ints or strings). """
+        weights = {str(question): float(weight) for question, weight in (self.question_weights or {}).items()}
+        return np.array([weights.get(col[:-len('_score')], 1.0) for col in score_cols])
+
+
+def memberColumns(pairings, prefix='id'):
+    """ The member columns of a pairings dataframe (id1, id2, ... or person1, person2, ...) in order of their number. """
+    columns = [col for col in pairings.columns if col.startswith(prefix) and col[len(prefix):].isdigit()]
+    return sorted(columns, key=lambda col: int(col[len(prefix):]))
+
+
+def groupIndices(ids, pairings):
+    """
+    Positions in ids of the members of each group in a pairings dataframe (columns id1, id2, ..., idk) as an
+    array of shape (groups, k), with -1 for a missing member (-1 or NaN) or a student not found in ids.
+    """
+    members = pairings[memberColumns(pairings)].fillna(-1).to_numpy(dtype=np.int64)
+    return pd.Index(ids).get_indexer(members.ravel()).reshape(members.shape)
+
+
+def groupDistances(dists, groups):
+    """
+    Largest distance between the members of each group, gathered from a square distance array (or a DistanceStore)
+    (NaN if one of the first two members is missing).
+    """
+    valid = (groups[:, 0] >= 0) & (groups[:, 1] >= 0)
+    group_dists = np.full(len(groups), -np.inf)
+    for i in range(groups.shape[1]):
+        for j in range(i + 1, groups.shape[1]):
+            a, b = groups[:, i], groups[:, j]
+            both = valid & (a >= 0) & (b >= 0)
+            group_dists = np.where(both, np.maximum(group_dists, dists[np.maximum(a, 0), np.maximum(b, 0)]), group_dists)
+    return np.where(valid, group_dists, np.nan)
+
+
+def groupScores(scores, groups):
+    """ Scores of the members of each group, shape (groups, k, questions), with the first member's scores for a missing member. """
+    filled = np.where(groups >= 0, groups, groups[:, :1])
+    return scores[np.maximum(filled, 0)]
+
+
+def groupAgreement(scores, groups, weights):
+    """ Weighted fraction of the questions on which all members of each group have the same score. """
+    member_scores = groupScores(scores, groups)
+    same = np.all(member_scores == member_scores[:, :1, :], axis=1)
+    return same @ weights / weights.sum() if weights.sum() > 0 else np.ones(len(groups))
+
+
+def weightedGroupDistances(scores, groups, weights):
+    """ Largest weighted euclidean distance between the members of each group, computed from their scores. """
+    member_scores = groupScores(scores, groups) * np.sqrt(weights)
+    first, second = np.triu_indices(groups.shape[1], 1)
+    diffs = member_scores[:, first, :] - member_scores[:, second, :]
+    return np.sqrt((diffs ** 2).sum(axis=2)).max(axis=1)
+
+
+def evaluateBonus(pairings, dist_matrix, quiz_df, rule, points_possible):
+    """
+    Distance, agreement and bonus of every group in a pairings dataframe, in one vectorized pass over
+    all groups (of any size; pairings from several sections can be concatenated as long
+    as dist_matrix and quiz_df cover all of their students). dist_matrix may also be a DistanceStore,
+    or None to compute the distances from the scores. Returns a dataframe with columns
+    distance, agreement and bonus, aligned with pairings.
+    """
+    ids, scores = picata_distance.scoreMatrix(quiz_df)
+    score_cols = quiz_df.columns[quiz_df.columns.str.endswith('_score')]
+    weights = rule.weights(score_cols)
+    score_groups = groupIndices(ids, pairings)
+    # (only the first two members of a group are required)
+    known = np.all((score_groups >= 0) | (np.arange(score_groups.shape[1]) >= 2), axis=1)
+
+    if rule.question_weights is None and isinstance(dist_matrix, picata_distance.DistanceStore):
+        # (looked up from the score patterns of the members, without expanding the matrix)
+        distances = groupDistances(dist_matrix, groupIndices(dist_matrix.positions, pairings))
+    elif rule.question_weights is None and dist_matrix is not None:
+        distances = groupDistances(dist_matrix.to_numpy(), groupIndices(dist_matrix.index, pairings))
+    else:
+        # (without a distance matrix, e.g. for a large class, the unweighted distances are computed the same way)
+        distances = np.where(known, weightedGroupDistances(scores, score_groups, weights), np.nan)
+    agreement = np.where(known, groupAgreement(scores, score_groups, weights), 0.0)
+
+    full = rule.points(points_possible)
+    bonus = np.where(distances <= rule.threshold, full, 0.0)
+    if rule.min_agreement < 1.0:
+        partial = np.where(agreement >= rule.min_agreement, full * agreement, 0.0)
+        bonus = np.maximum(bonus, partial)
+    return pd.DataFrame({'distance': distances, 'agreement': agreement, 'bonus': bonus}, index=pairings.index)
+
+
+def studentBonus(pairings, group_bonus, student_ids):
+    """ Bonus of each student in student_ids: the largest bonus of any group they were in (0 if none). """
+    members = pairings[memberColumns(pairings)].to_numpy()
+    earned = pd.DataFrame({'id': members.ravel(), 'bonus': np.repeat(np.asarray(group_bonus), members.shape[1])})
+    earned = earned[earned['id'] > 0].groupby('id')['bonus'].max()
+    return pd.Series(student_ids).map(earned).fillna(0.0).to_numpy()
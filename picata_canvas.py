@@ -0,0 +1,432 @@
+import io
+import os
+import csv
+import json
+import hashlib
+import time
+from datetime import datetime
+import threading
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+from canvasapi.course import Course
+from canvasapi.exceptions import RateLimitExceeded
+from canvasapi.quiz import Quiz, QuizQuestion
+from canvasapi.util import combine_kwargs
+import numpy as np
+import pandas as pd
+import requests
+import picata_sqlite
+
+# How long (in seconds) cached Canvas reads of each type of resource are used before fetching them again.
+CACHE_TTLS = {
+    'courses': 24 * 3600,
+    'quizzes': 3600,
+    'questions': 24 * 3600,
+    'enrollments': 3600,
+    'report': 3600,
+}
+
+
+class RateLimiter:
+    """
+    Limits the number of concurrent Canvas API requests and slows down when Canvas reports, via the
+    X-Rate-Limit-Remaining header, that the request quota (a leaky bucket of ~700 units) runs low.
+    """
+
+    def __init__(self, max_concurrent=8, low_quota=300.0, max_delay=2.0, max_retries=5):
+        """ Allow max_concurrent requests at once, and wait up to max_delay seconds between requests when the quota is low. """
+        self.max_concurrent = max_concurrent
+        self.low_quota = low_quota
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.remaining = None
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.lock = threading.Lock()
+
+    def resize(self, max_concurrent):
+        """
+        Change the number of concurrent requests allowed (e.g. to share the quota between processes); only call
+        while idle. The locks are made anew, so this also sets up the limiter of a forked process.
+        """
+        self.max_concurrent = max_concurrent
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.lock = threading.Lock()
+
+    def delay(self):
+        """ Seconds to wait before the next request, growing as the remaining quota falls below low_quota. """
+        with self.lock:
+            remaining = self.remaining
+        if remaining is None or remaining >= self.low_quota:
+            return 0.0
+        return self.max_delay * (1.0 - max(remaining, 0.0) / self.low_quota)
+
+    def update(self, response):
+        """ Record the remaining quota reported with a response. """
+        remaining = response.headers.get('X-Rate-Limit-Remaining')
+        if remaining is not None:
+            with self.lock:
+                self.remaining = float(remaining)
+
+    def request(self, requester, method, endpoint=None, **kwargs):
+        """ Make a request through a canvasapi Requester, retrying with exponential backoff when the rate limit is exceeded. """
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self.delay())
+            try:
+                with self.slots:
+                    response = requester.request(method, endpoint, **kwargs)
+            except RateLimitExceeded:
+                if attempt == self.max_retries:
+                    raise
+                with self.lock:
+                    self.remaining = 0.0
+                time.sleep(self.max_delay * 2**attempt)
+                continue
+            self.update(response)
+            return response
+
+    def getPaginated(self, requester, endpoint, root=None, per_page=100, **params):
+        """ GET every page of a Canvas list endpoint and return the items as a list of JSON dicts. """
+        items = []
+        response = self.request(requester, 'GET', endpoint, per_page=per_page, **params)
+        while True:
+            page = response.json()
+            items.extend(page[root] if root else page)
+            next_url = response.links.get('next', {}).get('url')
+            if not next_url:
+                return items
+            response = self.request(requester, 'GET', _url=next_url)
+
+
+# One limiter shared by everything in this process, since the Canvas quota is per access token.
+rate_limiter = RateLimiter()
+
+
+def fetchConcurrently(fetch, items, limiter=rate_limiter):
+    """ Call fetch on every item using a pool of threads; results are returned in the order of items. """
+    with ThreadPoolExecutor(max_workers=limiter.max_concurrent) as pool:
+        return list(pool.map(fetch, items))
+
+
+def getSubmissionEvents(submissions, rows=None, limiter=rate_limiter):
+    """ Fetch the events of the submissions in the given rows of a SubmissionsSnapshot (default all) concurrently; one list of event dicts per row. """
+    def fetch(k):
+        endpoint = f"courses/{submissions.course_id}/quizzes/{submissions.quiz_id}/submissions/{submissions.id[k]}/events"
+        return limiter.getPaginated(submissions.requester, endpoint, root='quiz_submission_events')
+    return fetchConcurrently(fetch, range(len(submissions)) if rows is None else rows, limiter)
+
+
+def parseCanvasTime(timestamp):
+    """ Convert a Canvas ISO 8601 timestamp (e.g. '2025-02-03T17:04:05Z') to a datetime, or None. """
+    return datetime.fromisoformat(timestamp.replace('Z', '+00:00')) if timestamp else None
+
+
+def pollProgress(canvas, progress_id, timeout=300.0, first_delay=0.25, max_delay=5.0, callback=None):
+    """
+    Wait for a Canvas Progress object (e.g. of a report being generated) to complete and return it.
+    The delay between polls starts at first_delay and grows by half each time up to max_delay, and a
+    TimeoutError is raised if it has not completed after timeout seconds.
+    """
+    start = time.monotonic()
+    delay = first_delay
+    progress = canvas.get_progress(progress_id)
+    while progress.workflow_state != 'completed':
+        if callback:
+            callback(progress)
+        if progress.workflow_state == 'failed':
+            raise RuntimeError(f"Canvas job {progress_id} failed: {getattr(progress, 'message', '')}")
+        if time.monotonic() - start > timeout:
+            raise TimeoutError(f"Canvas job {progress_id} did not complete within {timeout:.0f} seconds")
+        time.sleep(delay)
+        delay = min(delay * 1.5, max_delay)
+        progress = canvas.get_progress(progress_id)
+    if callback:
+        callback(progress)
+    return progress
+
+
+class UpdateJournal:
+    """
+    Append-only file with one JSON line for each Canvas update that has completed, so that a run that
+    was interrupted can be resumed without making the same updates (API calls) again.
+    """
+
+    def __init__(self, path):
+        """ Open the journal at path, reading the updates already recorded in it. """
+        self.path = path
+        self.lock = threading.Lock()
+        self.completed = set()
+        if os.path.exists(path):
+            with open(path) as journal:
+                self.completed = {json.loads(line)['key'] for line in journal if line.strip()}
+
+    def done(self, key):
+        """ Whether the update identified by key has already been made. """
+        return key in self.completed
+
+    def record(self, key, **details):
+        """ Record that the update identified by key has been made. """
+        with self.lock:
+            with open(self.path, 'a') as journal:
+                journal.write(json.dumps(dict(details, key=key, time=time.time())) + '\n')
+                journal.flush()
+                os.fsync(journal.fileno())
+            self.completed.add(key)
+
+    def clear(self):
+        """ Delete the journal once every update of a run has been made, so a later run starts afresh. """
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.completed = set()
+
+
+def fudgePointsKey(submission_id, attempt, fudge_points):
+    """ Journal key of setting fudge_points on one attempt of a quiz submission. """
+    return f"{submission_id}:{attempt}:{float(fudge_points)}"
+
+
+def setFudgePoints(submissions, updates, journal, limiter=rate_limiter):
+    """
+    Set the fudge points of quiz submissions concurrently, given a SubmissionsSnapshot and a list of
+    (row, fudge_points). Updates already in the journal are skipped and each completed update is added
+    to it. Returns the number of updates made.
+    """
+    def key(update):
+        k, fudge_points = update
+        return fudgePointsKey(submissions.id[k], submissions.attempt[k], fudge_points)
+    pending = [update for update in updates if not journal.done(key(update))]
+
+    def update(item):
+        k, fudge_points = item
+        quiz_submissions = [{'attempt': int(submissions.attempt[k]), 'fudge_points': float(fudge_points)}]
+        limiter.request(submissions.requester, 'PUT', f"courses/{submissions.course_id}/quizzes/{submissions.quiz_id}/submissions/{submissions.id[k]}",
+                        _kwargs=combine_kwargs(quiz_submissions=quiz_submissions))
+        journal.record(key(item), user_id=int(submissions.user_id[k]), submission_id=int(submissions.id[k]), attempt=int(submissions.attempt[k]),
+                       fudge_points=float(fudge_points))
+    fetchConcurrently(update, pending, limiter)
+    return len(pending)
+
+
+# Columns of the student_analysis report that are kept (after renaming), besides the '<question_id>_score'
+# columns, with the dtype to parse them as (None to let pandas decide). The answer text columns are dropped.
+REPORT_COLUMNS = {
+    'name': None,
+    'id': None,
+    'sis_id': None,
+    'section': 'category',
+    'section_id': None,
+    'submitted': None,
+    'attempt': None,
+    'n_correct': None,
+    'n_incorrect': None,
+    'score': None,
+}
+
+
+def reportColumnNames(header, question_ids):
+    """
+    Shorter, cleaner names for the columns of a student_analysis report, e.g. 'n correct' becomes
+    'n_correct', '123: question text' becomes '123' and the points column after it '123_score'.
+    """
+    names = [col.split(':')[0].replace(' ', '_').replace('.', '_') for col in header]
+    for i, name in enumerate(names[:-1]):
+        if name in question_ids:
+            names[i + 1] = name + '_score'
+    return names
+
+
+def parseQuizReport(stream, question_ids):
+    """
+    Parse a student_analysis report from a text stream (e.g. an HTTP response body) in one pass. Only
+    the REPORT_COLUMNS and a float32 '<question_id>_score' column for each question are loaded.
+    """
+    header = next(csv.reader(stream))
+    names = reportColumnNames(header, question_ids)
+    score_cols = {question_id + '_score' for question_id in question_ids}
+    keep = [i for i, name in enumerate(names) if name in REPORT_COLUMNS or name in score_cols]
+    dtypes = {i: 'float32' if names[i] in score_cols else REPORT_COLUMNS[names[i]] for i in keep}
+    try:
+        quiz_df = pd.read_csv(stream, header=None, usecols=keep, dtype={i: t for i, t in dtypes.items() if t})
+    except pd.errors.EmptyDataError:
+        quiz_df = pd.DataFrame(columns=keep)
+    quiz_df.columns = [names[i] for i in keep]
+    return quiz_df
+
+
+def downloadQuizReport(url, question_ids, archive_path=None):
+    """ Download a student_analysis report and parse it while it streams in, saving the raw csv to archive_path if given. """
+    response = requests.get(url, stream=True)
+    with response:
+        if archive_path:
+            with open(archive_path, 'wb') as csv_file:
+                csv_file.write(response.content)
+            stream = io.StringIO(response.content.decode('utf-8-sig'), newline='')
+        else:
+            response.raw.decode_content = True
+            # (keep the body readable once it is all buffered: urllib3 closes it at the end, before the csv is parsed)
+            response.raw.auto_close = False
+            stream = io.TextIOWrapper(response.raw, encoding='utf-8-sig', newline='')
+        return parseQuizReport(stream, question_ids)
+
+
+def frameToJSON(df):
+    """ A dataframe as a JSON serializable dict (e.g. for CanvasCache) that frameFromJSON turns back into it. """
+    return {'columns': df.columns.tolist(), 'dtypes': [str(t) for t in df.dtypes], 'data': df.to_numpy(dtype=object).tolist()}
+
+
+def frameFromJSON(body):
+    """ The dataframe stored by frameToJSON. """
+    df = pd.DataFrame(body['data'], columns=body['columns'])
+    return df.astype(dict(zip(body['columns'], body['dtypes'])))
+
+
+class CanvasCache(picata_sqlite.SQLiteStore):
+    """
+    Local cache of Canvas API reads in a SQLite file, keyed by resource type and endpoint. An entry is
+    used until the TTL of its resource type runs out, or until the version it was stored with (e.g. the
+    time of the latest quiz submission) changes. Entries fetched before refresh_since are ignored, which
+    is how the --refresh option forces everything to be downloaded again.
+    """
+
+    def __init__(self, path, refresh_since=0.0, ttls=None):
+        """ Open (or create) the cache database at path. """
+        super().__init__(path)
+        self.refresh_since = refresh_since
+        self.ttls = dict(CACHE_TTLS, **(ttls or {}))
+        self.execute("CREATE TABLE IF NOT EXISTS canvas_cache (resource TEXT, key TEXT, version TEXT, fetched_at REAL, body TEXT, "
+                     "PRIMARY KEY (resource, key))")
+
+    def get(self, resource, key, version=None):
+        """ The cached body for key, or None if there is none that is still valid. """
+        rows = self.execute("SELECT version, fetched_at, body FROM canvas_cache WHERE resource = ? AND key = ?", (resource, key))
+        if not rows:
+            return None
+        stored_version, fetched_at, body = rows[0]
+        oldest = max(self.refresh_since, time.time() - self.ttls[resource])
+        if fetched_at < oldest or stored_version != (None if version is None else str(version)):
+            return None
+        return json.loads(body)
+
+    def put(self, resource, key, body, version=None):
+        """ Store a (JSON serializable) body for key. """
+        self.execute("INSERT OR REPLACE INTO canvas_cache VALUES (?, ?, ?, ?, ?)",
+                     (resource, key, None if version is None else str(version), time.time(), json.dumps(body)))
+
+    def invalidate(self, resource, key=None):
+        """ Drop the cached entry for key, or all entries of a resource type, e.g. after writing to Canvas. """
+        if key is None:
+            self.execute("DELETE FROM canvas_cache WHERE resource = ?", (resource,))
+        else:
+            self.execute("DELETE FROM canvas_cache WHERE resource = ? AND key = ?", (resource, key))
+
+    def getList(self, requester, resource, endpoint, root=None, version=None, limiter=rate_limiter, **params):
+        """ All items of a Canvas list endpoint as JSON dicts, from the cache if possible. """
+        key = endpoint + ('?' + urlencode(sorted(params.items())) if params else '')
+        items = self.get(resource, key, version)
+        if items is None:
+            items = limiter.getPaginated(requester, endpoint, root, **params)
+            self.put(resource, key, items, version)
+        return items
+
+    def getObjects(self, cls, requester, resource, endpoint, root=None, extra=None, version=None, **params):
+        """ Like getList, but returns canvasapi objects of type cls (with the extra attributes canvasapi would add). """
+        items = self.getList(requester, resource, endpoint, root, version, **params)
+        return [cls(requester, dict(item, **(extra or {}))) for item in items]
+
+
+def openCache(config):
+    """ The Canvas cache for a PicataConfig. """
+    return CanvasCache(config.cache_path, config.refresh_since)
+
+
+def canvasRequester(canvas):
+    """ The canvasapi Requester of a Canvas object (which, unlike other canvasapi objects, keeps it private). """
+    return canvas._Canvas__requester
+
+
+def getCourses(canvas, cache):
+    """ The courses of the current user. """
+    return cache.getObjects(Course, canvasRequester(canvas), 'courses', "courses")
+
+
+def getQuizzes(course, cache):
+    """ The quizzes of a course. """
+    return cache.getObjects(Quiz, course._requester, 'quizzes', f"courses/{course.id}/quizzes", extra={'course_id': course.id})
+
+
+def getEnrollments(course, cache, limiter=rate_limiter):
+    """ All enrollments (students, teachers, ...) of a course, as JSON dicts. """
+    return cache.getList(course._requester, 'enrollments', f"courses/{course.id}/enrollments", limiter=limiter)
+
+
+def quizVersion(quiz):
+    """ A string that changes whenever the questions of a quiz are edited. """
+    fields = ['updated_at', 'question_count', 'points_possible', 'published']
+    return '|'.join(str(getattr(quiz, field, None)) for field in fields)
+
+
+def getQuizQuestions(quiz, cache):
+    """ The questions of a quiz. """
+    return cache.getObjects(QuizQuestion, quiz._requester, 'questions', f"courses/{quiz.course_id}/quizzes/{quiz.id}/questions",
+                            extra={'course_id': quiz.course_id}, version=quizVersion(quiz))
+
+
+def submissionsEndpoint(quiz):
+    """ The endpoint listing the submissions of a quiz (which is also their cache key). """
+    return f"courses/{quiz.course_id}/quizzes/{quiz.id}/submissions"
+
+
+class SubmissionsSnapshot:
+    """
+    The latest submission of each student who has taken a quiz, as one numpy array per field (with NaN
+    for missing numbers) instead of a canvasapi object per submission. Row k of every array is the same
+    submission; the requester and ids are kept so that submissions can still be written to.
+    """
+
+    FIELDS = {
+        'id': 'int64',
+        'user_id': 'int64',
+        'attempt': 'int64',
+        'score': 'float64',
+        'fudge_points': 'float64',
+        'time_spent': 'float64',
+        'started_at': object,
+        'finished_at': object,
+    }
+
+    def __init__(self, items, requester, course_id, quiz_id):
+        """ Convert the JSON dicts of the quiz submissions endpoint to columns. """
+        self.requester = requester
+        self.course_id = course_id
+        self.quiz_id = quiz_id
+        frame = pd.DataFrame.from_records(items, columns=list(self.FIELDS))
+        for field, dtype in self.FIELDS.items():
+            column = frame[field].fillna(0) if dtype == 'int64' else frame[field]
+            setattr(self, field, column.to_numpy(dtype=dtype))
+
+    def __len__(self):
+        """ Number of submissions. """
+        return len(self.id)
+
+    def latestFinish(self):
+        """ Time the last submission was finished (a Canvas timestamp), or None. """
+        return max((t for t in self.finished_at if t), default=None)
+
+    def version(self):
+        """
+        A string that changes with any new submission and with any change of score or fudge points (e.g. a
+        regrade, or bonus points awarded), for versioning what is computed from the submissions.
+        """
+        order = np.argsort(self.id, kind='stable')
+        state = np.concatenate([self.id[order], self.attempt[order]]).tobytes() + \
+            np.concatenate([np.nan_to_num(self.score[order], nan=-1.0), np.nan_to_num(self.fudge_points[order], nan=-1.0)]).tobytes()
+        return f"{self.latestFinish()}|{hashlib.sha1(state).hexdigest()}"
+
+
+def getSubmissionsSnapshot(quiz):
+    """
+    Snapshot of the (latest) submission of each student who has taken a quiz. The submissions are always
+    downloaded (never read from the local cache), since they decide whether a cached report is still current.
+    """
+    items = rate_limiter.getPaginated(quiz._requester, submissionsEndpoint(quiz), root='quiz_submissions')
+    return SubmissionsSnapshot(items, quiz._requester, quiz.course_id, quiz.id)
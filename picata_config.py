@@ -1,4 +1,17 @@
 import os
+import sys
+import multiprocessing
+
+
+def forkSafe():
+    """
+    Whether picata may fork worker processes (for background figures, Monte Carlo draws and batch workers):
+    only on Linux, since fork is unavailable on Windows and unsafe on macOS with matplotlib, Accelerate and
+    the threads picata has already started. The workers are always forked, never spawned, since spawning
+    would re-run the picata.py script (with its prompts) in every worker; where fork is not safe, the work
+    is done in this process instead.
+    """
+    return sys.platform.startswith('linux') and 'fork' in multiprocessing.get_all_start_methods()
 
 
 class PicataConfig:
@@ -9,3 +22,23 @@ class PicataConfig:
         self.data_path = os.getcwd() + "/data/"
         self.figures_path = os.getcwd() + "/figures/"
         self.quiz_prefix = "quiz_"
+        self.cache_path = self.data_path + "canvas_cache.sqlite"
+        self.archive_reports = False  # also save the raw student_analysis csv report in data/ (see --archive-reports)
+        self.refresh_since = 0.0  # cached Canvas reads from before this time are ignored (see --refresh)
+        self.dry_run = False  # print the Canvas updates that would be made instead of making them (see --dry-run)
+        self.activity_history_path = self.data_path + "activity_history.sqlite"
+        self.activity_csv = False  # also write the dated activity csv snapshots (see --csv)
+        self.figures = ['histograms', 'distance', 'pairing']  # figures to draw in figures/ (see --no-figures and --figures)
+        self.background_figures = forkSafe()  # draw figures in a separate (forked) process while picata carries on
+        self.heatmap_annotate_max = 50  # distance heatmaps of up to this many students have every distance written in its cell
+        self.heatmap_cluster_max = 2000  # larger ones order up to this many students by hierarchical clustering, so similar students form blocks
+        self.heatmap_max_cells = 400  # and are averaged down to at most this many cells per side
+        self.pairing_draws = 0  # random pairings comparePairingMethods evaluates the methods against (see --draws)
+        self.group_size = 2  # students per group formed by the pair task (see --group-size)
+        self.profiles_path = self.data_path + "profiles/"  # scores of every quiz analyzed, by student and question
+        self.history_window = 0  # earlier quizzes of the course included in the distances (see --history)
+        self.history_decay = 0.5  # weight of a quiz relative to the one after it, with history_window
+        self.pairing_history_path = self.data_path + "pairing_history.sqlite"  # who was grouped with whom, by session
+        self.repeat_penalty = 0.0  # subtracted from the distance of two students for each time they were grouped (see --avoid-repeats)
+        self.repeat_sessions = 0  # recent sessions considered for repeat partners, 0 for all (see --repeat-sessions)
+        self.large_class_students = 5000  # above this many students, pair approximately without a distance matrix (see --large-class)
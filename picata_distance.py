@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+
+# Map picata distance names to metrics understood by scipy's pdist. Additional metrics can be
+# added with registerMetric(), either as another scipy metric name or as a callable f(u, v).
+METRICS = {
+    'euclid': 'euclidean',
+    'cosine': 'cosine',
+}
+
+# Distance used in place of 0 for two different students with identical scores, so that a pair
+# of identical students can still be told apart from the (zero) diagonal of the matrix.
+ZERO_DISTANCE = 1E-4
+
+
+def registerMetric(name, metric):
+    """ Make a new distance type available to generateDistanceMatrix (scipy metric name or callable). """
+    METRICS[name] = metric
+
+
+def scoreMatrix(quiz_df):
+    """
+    Extract the '_score' columns of a quiz dataframe once, as a float array with one row per
+    student (sorted by student id) and missing scores set to zero. Returns (ids, scores).
+    """
+    score_cols = quiz_df.columns[quiz_df.columns.str.endswith('_score')]
+    quiz_df_sorted = quiz_df.sort_values('id', kind='stable')
+    scores = quiz_df_sorted[score_cols].to_numpy(dtype=float)
+    np.nan_to_num(scores, copy=False, nan=0.0)
+    return quiz_df_sorted['id'].to_numpy(), scores
+
+
+def distanceArray(scores, distance_type='euclid'):
+    """ Square array of distances between all rows of scores, i.e. between all student pairs. """
+    import scipy.spatial.distance as distance
+    metric = METRICS.get(distance_type, distance_type)
+    n = scores.shape[0]
+    if n < 2:
+        return np.zeros((n, n))
+    dists = distance.squareform(distance.pdist(scores, metric))
+    # (cosine distances of identical vectors can come out as tiny rounding errors instead of exactly 0)
+    dists[(np.abs(dists) < 1E-12) & ~np.eye(n, dtype=bool)] = ZERO_DISTANCE
+    return dists
+
+
+def pairDistances(scores_a, scores_b, distance_type='euclid'):
+    """ Distance between each row of scores_a and the same row of scores_b (with the conventions of distanceArray for identical rows). """
+    metric = METRICS.get(distance_type, distance_type)
+    if metric == 'euclidean':
+        dists = np.linalg.norm(scores_a - scores_b, axis=1)
+    elif metric == 'cosine':
+        norms = np.linalg.norm(scores_a, axis=1) * np.linalg.norm(scores_b, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            dists = 1.0 - np.einsum('ij,ij->i', scores_a, scores_b) / norms
+    else:
+        import scipy.spatial.distance as distance
+        dists = np.array([distance.cdist(a[None, :], b[None, :], metric)[0, 0] for a, b in zip(scores_a, scores_b)])
+    dists[np.abs(dists) < 1E-12] = ZERO_DISTANCE
+    return dists
+
+
+def distanceMatrix(quiz_df, distance_type='euclid'):
+    """ Distance between all student pairs in quiz_df as a dataframe indexed by student id. """
+    ids, scores = scoreMatrix(quiz_df)
+    ids = ids.tolist()
+    return pd.DataFrame(distanceArray(scores, distance_type), index=ids, columns=ids)
+
+
+def scorePatterns(scores):
+    """
+    The distinct rows of scores (score patterns) and the pattern of each row: quiz scores take few distinct
+    values, so a class has far fewer score patterns than students.
+    """
+    patterns, pattern_of = np.unique(scores, axis=0, return_inverse=True)
+    return patterns, pattern_of.ravel()
+
+
+class DistanceStore:
+    """
+    Distances between all students of a quiz, computed once and kept compressed: students with the same
+    scores share a score pattern, and only the distances between the distinct patterns are stored (a few
+    hundred for a quiz of a few questions, however large the class). The distance of two students is
+    looked up from their patterns only when it is needed, e.g. store[a, b] for arrays of positions, and
+    the distance matrix of any subset of the students (e.g. those present today) is expanded from it by
+    indexing. Students with other scores (e.g. zero-filled absentees of the quiz) just get the pattern of
+    their scores; only the distances of patterns not seen before are computed.
+    """
+
+    def __init__(self, quiz_df, distance_type='euclid'):
+        """ Compute the distances between the score patterns of the students of quiz_df. """
+        self.distance_type = distance_type
+        ids, scores = scoreMatrix(quiz_df)
+        self.positions = pd.Index(ids)
+        self.patterns, self.pattern_of = scorePatterns(scores)
+        self.pattern_dists = distanceArray(self.patterns, distance_type)
+        self.pattern_rows = {row.tobytes(): k for k, row in enumerate(self.patterns)}
+
+    def __len__(self):
+        """ Number of students stored. """
+        return len(self.positions)
+
+    def __getitem__(self, pair):
+        """ Distances between the stored students at positions a and b (index arrays), as from a square distance array. """
+        a, b = pair
+        pattern_a, pattern_b = self.pattern_of[a], self.pattern_of[b]
+        return np.where((pattern_a == pattern_b) & (a != b), ZERO_DISTANCE, self.pattern_dists[pattern_a, pattern_b])
+
+    def patternsOf(self, scores):
+        """ The pattern of each row of scores, adding the patterns not stored yet (and computing their distances). """
+        scores = np.ascontiguousarray(scores, dtype=float)
+        keys = [row.tobytes() for row in scores]
+        new = list(dict.fromkeys(key for key in keys if key not in self.pattern_rows))
+        if new:
+            import scipy.spatial.distance as distance
+            n_old = len(self.patterns)
+            self.patterns = np.vstack([self.patterns.reshape(n_old, scores.shape[1]), [np.frombuffer(key) for key in new]])
+            new_dists = distance.cdist(self.patterns[n_old:], self.patterns, METRICS.get(self.distance_type, self.distance_type))
+            # (same conventions as distanceArray: 0 only on the diagonal)
+            new_dists[np.abs(new_dists) < 1E-12] = ZERO_DISTANCE
+            new_dists[np.arange(len(new)), n_old + np.arange(len(new))] = 0.0
+            pattern_dists = np.zeros((len(self.patterns), len(self.patterns)))
+            pattern_dists[:n_old, :n_old] = self.pattern_dists
+            pattern_dists[n_old:, :] = new_dists
+            pattern_dists[:, n_old:] = new_dists.T
+            self.pattern_dists = pattern_dists
+            self.pattern_rows.update({key: n_old + k for k, key in enumerate(new)})
+        return np.array([self.pattern_rows[key] for key in keys], dtype=np.int64)
+
+    def subsetArray(self, scores):
+        """ Square array of distances between the students with the given rows of scores, expanded from their patterns. """
+        patterns = self.patternsOf(scores)
+        dists = self.pattern_dists[np.ix_(patterns, patterns)]
+        # (different students with the same pattern are ZERO_DISTANCE apart, as in distanceArray)
+        dists[dists == 0.0] = ZERO_DISTANCE
+        np.fill_diagonal(dists, 0.0)
+        return dists
+
+    def matrix(self, quiz_df):
+        """ Distance between all student pairs in quiz_df as a dataframe indexed by student id (as distanceMatrix). """
+        ids, scores = scoreMatrix(quiz_df)
+        ids_list = ids.tolist()
+        return pd.DataFrame(self.subsetArray(scores), index=ids_list, columns=ids_list)
@@ -0,0 +1,216 @@
+import multiprocessing
+from multiprocessing import resource_tracker, shared_memory
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import picata_config
+
+
+def plotting():
+    """
+    matplotlib.pyplot, matplotlib and seaborn, imported on first use rather than with this module, since
+    they take most of picata's startup time and are not needed when no figures are drawn.
+    """
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
+    import seaborn as sbn
+    return plt, mpl, sbn
+
+
+def drawHistograms(scores_by_question, path):
+    """ Draw a histogram of the scores of each question, given a dict of question id to scores. """
+    plt, mpl, sbn = plotting()
+    mpl.style.use('seaborn-v0_8')
+    figure, axis = plt.subplots(1, len(scores_by_question), sharey=True)
+    figure.set_size_inches(13, 3)
+    for i, (q, scores) in enumerate(scores_by_question.items()):
+        axis[i].hist(scores, bins=6, facecolor='#00447c', edgecolor='black', alpha=0.8)
+        axis[i].set_xlabel('score')
+        axis[i].set_title('question: ' + q.split('_')[0])
+    axis[0].set_ylabel('# of people')
+    plt.tight_layout()  # Or try plt.subplots_adjust(left=0.05, right=0.98, bottom=0.15, top=0.9)
+    figure.savefig(path, dpi=200)
+    plt.close('all')
+
+
+def clusterOrder(dists):
+    """ Order of the students that puts those close to each other next to each other (average linkage clustering). """
+    import scipy.cluster.hierarchy as hierarchy
+    import scipy.spatial.distance as distance
+    return hierarchy.leaves_list(hierarchy.linkage(distance.squareform(dists, checks=False), 'average'))
+
+
+def downsample(dists, cells):
+    """ Average a square array over blocks of (nearly) equal size so that it has cells rows and columns. """
+    edges = np.linspace(0, dists.shape[0], cells + 1).astype(int)[:-1]
+    sizes = np.diff(np.append(edges, dists.shape[0]))
+    sums = np.add.reduceat(np.add.reduceat(dists, edges, axis=0), edges, axis=1)
+    return sums / np.outer(sizes, sizes)
+
+
+def heatmapView(dists, ids, config):
+    """
+    What to draw for a distance heatmap of this size: (matrix, labels, annotate). Up to config.heatmap_annotate_max
+    students every distance is written in its cell; larger heatmaps are drawn without annotations, with the students
+    ordered by clustering (up to config.heatmap_cluster_max) and averaged down to config.heatmap_max_cells per side.
+    """
+    n = dists.shape[0]
+    if n <= config.heatmap_annotate_max:
+        return dists, ids, True
+    if n <= config.heatmap_cluster_max:
+        order = clusterOrder(dists)
+        dists = dists[np.ix_(order, order)]
+        ids = [ids[k] for k in order]
+    if n > config.heatmap_max_cells:
+        return downsample(dists, config.heatmap_max_cells), False, False
+    return dists, ids, False
+
+
+def drawHeatmap(dists, ids, path, config):
+    """ Draw a heatmap of the distances between all students (annotated, clustered or downsampled depending on their number). """
+    plt, mpl, sbn = plotting()
+    matrix, labels, annotate = heatmapView(dists, ids, config)
+    mpl.style.use('seaborn-v0_8')
+    plt.figure(figsize=(16, 16))
+    sbn.heatmap(
+        matrix,
+        square=True,
+        cmap="YlGnBu",
+        linewidth=0.5 if annotate else 0.0,
+        annot=annotate,
+        cbar=not annotate,
+        xticklabels=labels if labels is not False else False,
+        yticklabels=labels if labels is not False else False,
+    )
+    plt.tight_layout()
+    plt.rc('font', size=9)
+    plt.savefig(path, dpi=200)
+    plt.close()
+
+
+def drawSharedHeatmap(spec, ids, path, config):
+    """ Draw the heatmap of a distance array in shared memory, given as (name, shape, dtype). """
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        drawHeatmap(np.ndarray(shape, dtype=dtype, buffer=shm.buf), ids, path, config)
+    finally:
+        shm.close()
+
+
+def drawPairingComparison(distances_by_method, path):
+    """ Draw a histogram of the pair distances of each pairing method, given a dict of axis label to distances. """
+    plt, mpl, sbn = plotting()
+    plt.figure(edgecolor='black')
+    fig, axes = plt.subplots(1, len(distances_by_method), figsize=(5 * len(distances_by_method), 4))
+    fig.patch.set_facecolor('white')
+    bin_breaks = [x / 2 for x in range(0, (8 + 1))]
+    for axis, (label, distances) in zip(axes, distances_by_method.items()):
+        axis.hist(distances, bins=bin_breaks, edgecolor='black')
+        axis.set_xlabel(label)
+        axis.set_ylim(0, 9)
+    axes[0].set_ylabel('# of Student Pairs')
+    plt.tight_layout()
+    plt.savefig(path, dpi=200)
+    plt.close()
+
+
+def initRenderer():
+    """ Set up the rendering process: draw to files only. """
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+class FigureRenderer:
+    """
+    Draws figures in a background process so that the computation (and the csv files the instructor is
+    waiting for) does not wait for matplotlib. The process is started with the first figure, and the
+    figures are drawn in the order they were submitted. Distance arrays are passed in shared memory.
+    """
+
+    def __init__(self):
+        """ No process is started until a figure is submitted. """
+        self.pool = None
+        self.failed = False
+        self.futures = []
+
+    def start(self):
+        """ Start the rendering process unless it runs already; returns False if it cannot be started (figures are then drawn inline). """
+        if self.pool is None and not self.failed:
+            if not picata_config.forkSafe():
+                self.failed = True
+                return False
+            try:
+                # (the resource tracker is started first so that the rendering process shares it rather than
+                # cleaning up shared arrays itself)
+                resource_tracker.ensure_running()
+                self.pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('fork'), initializer=initRenderer)
+            except (OSError, ValueError) as e:
+                print(f"Cannot draw figures in the background ({type(e).__name__}: {e}); drawing them inline")
+                self.failed = True
+        return self.pool is not None
+
+    def submit(self, draw, *args):
+        """ Draw a figure with draw(*args) in the background (see start); returns its future. """
+        future = self.pool.submit(draw, *args)
+        self.futures.append(future)
+        return future
+
+    def heatmap(self, dists, ids, path, config):
+        """ Draw a distance heatmap in the background, sharing the distance array with the rendering process. """
+        dists = np.ascontiguousarray(dists, dtype=float)
+        shm = shared_memory.SharedMemory(create=True, size=max(dists.nbytes, 1))
+        np.ndarray(dists.shape, dtype=dists.dtype, buffer=shm.buf)[:] = dists
+        future = self.submit(drawSharedHeatmap, (shm.name, dists.shape, dists.dtype.str), list(ids), path, config)
+
+        def release(_):
+            shm.close()
+            shm.unlink()
+        future.add_done_callback(release)
+        return future
+
+    def wait(self):
+        """ Wait for every figure submitted so far; prints any that failed and returns the number drawn. """
+        drawn = 0
+        for future in self.futures:
+            try:
+                future.result()
+                drawn += 1
+            except Exception as e:
+                print(f"Drawing a figure failed: {type(e).__name__}: {e}")
+        self.futures = []
+        return drawn
+
+    def close(self):
+        """ Wait for all figures and stop the rendering process. """
+        drawn = self.wait()
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        return drawn
+
+
+# One renderer for the whole process (used when config.background_figures is set).
+renderer = FigureRenderer()
+
+
+def render(config, draw, *args):
+    """ Draw a figure with draw(*args), in the background if config.background_figures is set (and the rendering process starts). """
+    if config.background_figures and renderer.start():
+        return renderer.submit(draw, *args)
+    draw(*args)
+
+
+def renderHeatmap(config, dist_matrix, path):
+    """ Draw the heatmap of a distance matrix dataframe, in the background if config.background_figures is set. """
+    if config.background_figures and renderer.start():
+        return renderer.heatmap(dist_matrix.to_numpy(), dist_matrix.index.tolist(), path, config)
+    drawHeatmap(dist_matrix.to_numpy(), dist_matrix.index.tolist(), path, config)
+
+
+def finishFigures():
+    """ Wait for the figures still being drawn in the background (call before exiting). """
+    if renderer.futures:
+        print(f"\nWaiting for {len(renderer.futures)} figures to be drawn...")
+    drawn = renderer.close()
+    if drawn:
+        print(f"Drew {drawn} figures in the background")
@@ -0,0 +1,156 @@
+import time
+import numpy as np
+import pandas as pd
+import picata_distance
+import picata_pairing
+
+# Most score patterns (buckets) whose distances are kept; classes with more distinct patterns have each
+# student put in the bucket of the nearest of this many patterns sampled from them.
+MAX_BUCKETS = 2000
+
+# Students whose distances to the sampled patterns are computed at once when assigning buckets.
+CHUNK_STUDENTS = 2000
+
+
+def scoreBuckets(scores, distance_type='euclid', max_buckets=MAX_BUCKETS, seed=0):
+    """
+    Group the students (rows of scores) by score pattern: quiz scores take few distinct values, so a large class
+    has far fewer distinct patterns than students. Returns the patterns and the bucket of each student; with more
+    than max_buckets patterns, max_buckets of them are sampled and each student goes to the nearest one.
+    """
+    patterns, bucket_of = picata_distance.scorePatterns(scores)
+    if len(patterns) <= max_buckets:
+        return patterns, bucket_of
+    import scipy.spatial.distance as distance
+    rng = np.random.default_rng(seed)
+    patterns = patterns[np.sort(rng.choice(len(patterns), max_buckets, replace=False))]
+    metric = picata_distance.METRICS.get(distance_type, distance_type)
+    bucket_of = np.concatenate([distance.cdist(scores[start:start + CHUNK_STUDENTS], patterns, metric).argmin(axis=1)
+                                for start in range(0, len(scores), CHUNK_STUDENTS)])
+    return patterns, bucket_of
+
+
+def farthestBuckets(bucket_dists, counts, rows):
+    """ For the given buckets, the farthest bucket with students left (themselves only if they have two left) and its distance. """
+    work = np.where(counts > 0, bucket_dists[rows], -np.inf)
+    work[np.arange(len(rows)), rows] = np.where(counts[rows] >= 2, 0.0, -np.inf)
+    args = work.argmax(axis=1)
+    return args, work[np.arange(len(rows)), args]
+
+
+def bucketPairs(bucket_dists, counts, method='med'):
+    """
+    Greedy pairing (as greedyGroups) of students given only by the number in each bucket: the bucket of the next
+    student is chosen with the method from the distance to the farthest bucket left of every bucket (counting
+    each of its students, for 'med'), and as many of its students as possible are paired with students of that
+    farthest bucket at once. Only rows whose farthest bucket ran out are recomputed, so this takes O(buckets^2)
+    time and memory however many students there are. Returns the (bucket_a, bucket_b, number of pairs) batches
+    and the number of students left in each bucket (one in all, if the class is odd).
+    """
+    if method not in ['max', 'med', 'min']:
+        raise ValueError("bucketPairs(): invalid method")
+    # (cosine distances of all-zero scores are NaN, taken as 0 as in the exact pairing)
+    bucket_dists = np.nan_to_num(np.asarray(bucket_dists, dtype=float))
+    counts = np.array(counts, dtype=np.int64)
+    buckets = np.arange(len(counts))
+    row_arg, row_max = farthestBuckets(bucket_dists, counts, buckets)
+    batches = []
+    while counts.sum() > 1:
+        alive = np.flatnonzero((counts > 0) & (row_max > -np.inf))
+        if method == 'med':
+            order = alive[np.argsort(row_max[alive], kind='stable')]
+            a = int(order[np.searchsorted(np.cumsum(counts[order]), counts[order].sum() // 2, side='right')])
+        elif method == 'max':
+            a = int(alive[np.argmax(row_max[alive])])
+        else:
+            a = int(alive[np.argmin(row_max[alive])])
+        b = int(row_arg[a])
+        number = counts[a] // 2 if a == b else min(counts[a], counts[b])
+        batches.append((a, b, int(number)))
+        counts[a] -= number
+        counts[b] -= number
+
+        stale = np.flatnonzero((counts > 0) & ((row_arg == a) | (row_arg == b) | (buckets == a) | (buckets == b)))
+        if len(stale) > 0:
+            row_arg[stale], row_max[stale] = farthestBuckets(bucket_dists, counts, stale)
+    return batches, counts
+
+
+def bucketGroups(bucket_of, batches, left):
+    """ Expand bucketPairs batches to pairs of students (rows), with the student left over (if any) added to the last pair. """
+    order = np.argsort(bucket_of, kind='stable')
+    next_member = np.searchsorted(bucket_of[order], np.arange(len(left)))
+    firsts, seconds = [], []
+    for a, b, number in batches:
+        firsts.append(order[next_member[a]:next_member[a] + number])
+        next_member[a] += number
+        seconds.append(order[next_member[b]:next_member[b] + number])
+        next_member[b] += number
+    groups = [tuple(pair) for pair in np.column_stack([np.concatenate(firsts), np.concatenate(seconds)]).tolist()] if batches else []
+    if left.sum() == 1 and groups:
+        groups[-1] = groups[-1] + (int(order[next_member[np.argmax(left)]]),)
+    return groups
+
+
+def approximateGroups(scores, method='med', distance_type='euclid', max_buckets=MAX_BUCKETS, seed=0):
+    """ Pair the students (rows of scores) by their score buckets without a distance matrix; returns index tuples. """
+    if method == 'rand':
+        order = np.random.default_rng(seed).permutation(len(scores))
+        groups = [tuple(pair) for pair in order[:len(order) // 2 * 2].reshape(-1, 2).tolist()]
+        if len(order) % 2 == 1 and groups:
+            groups[-1] = groups[-1] + (int(order[-1]),)
+        return groups
+    patterns, bucket_of = scoreBuckets(scores, distance_type, max_buckets, seed)
+    counts = np.bincount(bucket_of, minlength=len(patterns))
+    batches, left = bucketPairs(picata_distance.distanceArray(patterns, distance_type), counts, method)
+    return bucketGroups(bucket_of, batches, left)
+
+
+def groupDistances(scores, groups, distance_type='euclid'):
+    """ Distance of each group (the largest between any two members), computed from the members' scores only. """
+    width = max(len(group) for group in groups)
+    members = np.array([group + (group[0],) * (width - len(group)) for group in groups])
+    dists = np.zeros(len(groups))
+    for i in range(width):
+        for j in range(i + 1, width):
+            dists = np.maximum(dists, picata_distance.pairDistances(scores[members[:, i]], scores[members[:, j]], distance_type))
+    return dists
+
+
+def approximatePairings(ids, scores, method='med', distance_type='euclid'):
+    """ Pair the students ids with rows of scores approximately (see approximateGroups); returns (id1, id2, [id3,] distance) tuples. """
+    groups = approximateGroups(scores, method, distance_type)
+    if not groups:
+        return []
+    return [tuple(ids[k] for k in group) + (float(dist),) for group, dist in zip(groups, groupDistances(scores, groups, distance_type))]
+
+
+def sampleQuality(scores, method='med', distance_type='euclid', samples=3, sample_size=1000, seed=0):
+    """
+    Compare approximate pairing with the exact method (greedyGroups on the full distance matrix) on random samples
+    of sample_size students: the mean group distance and time of each, per sample. A class of no more than
+    sample_size students is sampled by halves, since samples of the whole class would all be the same.
+    """
+    if sample_size >= len(scores):
+        sample_size = max(len(scores) // 2, 2)
+    rng = np.random.default_rng(seed)
+    rows = []
+    for sample in range(samples):
+        sample_scores = scores[np.sort(rng.choice(len(scores), min(sample_size, len(scores)), replace=False))]
+        start = time.perf_counter()
+        dists = picata_distance.distanceArray(sample_scores, distance_type)
+        exact = picata_pairing.greedyGroups(dists, method)
+        exact_time = time.perf_counter() - start
+        start = time.perf_counter()
+        approximate = approximateGroups(sample_scores, method, distance_type, seed=seed + sample)
+        approximate_time = time.perf_counter() - start
+        rows.append({
+            'students': len(sample_scores),
+            'exact': np.mean([picata_pairing.groupDistance(dists, group) for group in exact]),
+            'approximate': np.mean([picata_pairing.groupDistance(dists, group) for group in approximate]),
+            'exact_time': exact_time,
+            'approximate_time': approximate_time,
+        })
+    quality = pd.DataFrame(rows)
+    quality['ratio'] = quality['approximate'] / quality['exact']
+    return quality
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+A local stand-in for the parts of the Canvas REST API that picata uses, serving synthetic course
+data with configurable latency, page size and rate limiting, so that picata can be measured offline.
+
+Usage: python picata_mock.py [--courses 1] [--students 250] [--quizzes 1] [--questions 6] [--per-page 50]
+                            [--latency 0.05] [--report-seconds 0.5] [--port 8765]
+"""
+import io
+import re
+import csv
+import sys
+import json
+import time
+import random
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+
+EVENT_TYPES = ['page_focused', 'page_blurred', 'question_answered', 'question_viewed', 'session_started']
+
+
+def isoTime(t):
+    """ Format a datetime the way Canvas does. """
+    return t.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+def syntheticCourse(n_students=30, n_questions=6, events_per_submission=10, course_id=1, quiz_id=1, seed=0, n_quizzes=1):
+    """
+    Generate a course with n_students students and n_quizzes quizzes (with ids from quiz_id) of n_questions
+    one-point questions, which each student has submitted: every answer scores 0, 0.5 or 1, and the score of a
+    submission is the sum of its answers, as in the student_analysis report generated from them.
+    """
+    rng = random.Random(seed)
+    start = datetime(2026, 9, 1, 9, 0, 0)
+    students = [{'id': 10000 + i, 'name': f"Student {i:05d}", 'sortable_name': f"{i:05d}, Student",
+                 'sis_user_id': str(900000000 + i)} for i in range(n_students)]
+    quizzes = {}
+    for k in range(n_quizzes):
+        quiz_start = start + timedelta(days=7 * k)
+        questions = [{'id': 100000 * course_id + 100 * (quiz_id + k) + q, 'quiz_id': quiz_id + k, 'position': q + 1,
+                      'question_name': f"Question {q + 1}", 'question_type': 'multiple_choice_question',
+                      'question_text': f"<p>Question {q + 1} of quiz {k + 1}</p>", 'points_possible': 1.0} for q in range(n_questions)]
+        submissions = []
+        for i, student in enumerate(students):
+            minutes = rng.randint(5, 30)
+            answers = [rng.choices([0.0, 0.5, 1.0], weights=[0.3, 0.1, 0.6])[0] for _ in range(n_questions)]
+            events = [{'id': (k * n_students + i) * events_per_submission + e, 'event_type': rng.choice(EVENT_TYPES),
+                       'created_at': isoTime(quiz_start + timedelta(seconds=e * 60 * minutes / events_per_submission))}
+                      for e in range(events_per_submission)]
+            submissions.append({'id': 50000 + k * n_students + i, 'quiz_id': quiz_id + k, 'user_id': student['id'], 'attempt': 1,
+                                'score': sum(answers), 'fudge_points': None, 'started_at': isoTime(quiz_start),
+                                'finished_at': isoTime(quiz_start + timedelta(minutes=minutes)), 'time_spent': minutes * 60,
+                                'answers': answers, 'events': events})
+        quizzes[quiz_id + k] = {'id': quiz_id + k, 'course_id': course_id, 'title': f"Quiz {k + 1}", 'points_possible': float(n_questions),
+                                'question_count': n_questions, 'published': True, 'due_at': isoTime(quiz_start + timedelta(hours=1)),
+                                'updated_at': isoTime(quiz_start - timedelta(days=1)), 'questions': questions,
+                                'submissions': submissions, 'reports': []}
+    return {'id': course_id, 'name': f"Synthetic Course {course_id}", 'course_code': f"SYN{course_id}", 'start_at': isoTime(start),
+            'end_at': None, 'enrollment_term_id': 1, 'students': students, 'quizzes': quizzes}
+
+
+def syntheticCourses(n_courses, n_students=30, **options):
+    """ Generate n_courses courses (ids 1..n_courses, quiz ids 100 * course id + 1, ...) with syntheticCourse. """
+    return [syntheticCourse(n_students, course_id=c, quiz_id=100 * c + 1, seed=c, **options) for c in range(1, n_courses + 1)]
+
+
+def studentAnalysisCSV(quiz, students):
+    """ The student_analysis report of a quiz as Canvas generates it: an answer and a points column per question. """
+    out = io.StringIO()
+    writer = csv.writer(out)
+    header = ['name', 'id', 'sis_id', 'section', 'section_id', 'section_sis_id', 'submitted', 'attempt']
+    for question in quiz['questions']:
+        header += [f"{question['id']}: {question['question_text']}", str(question['points_possible'])]
+    writer.writerow(header + ['n correct', 'n incorrect', 'score'])
+    names = {student['id']: student for student in students}
+    for sub in quiz['submissions']:
+        student = names[sub['user_id']]
+        row = [student['name'], student['id'], student['sis_user_id'], 'Section 1', 1, '', sub['finished_at'], sub['attempt']]
+        for answer in sub['answers']:
+            row += ['an answer', answer]
+        row += [sum(answer == 1.0 for answer in sub['answers']), sum(answer == 0.0 for answer in sub['answers']), sub['score']]
+        writer.writerow(row)
+    return out.getvalue().encode('utf-8')
+
+
+class MockCanvas:
+    """
+    The state of the mock Canvas instance: the course data plus a leaky-bucket request quota like
+    Canvas's, where each request in flight holds a penalty of 50 units and the bucket refills over time.
+    """
+
+    def __init__(self, course, latency=0.05, max_per_page=50, quota=700.0, refill_rate=10.0, request_cost=1.0, report_seconds=0.5):
+        """
+        Serve course (or a list of courses) with latency seconds added to every request and at most max_per_page items per page;
+        quiz reports take report_seconds to generate.
+        """
+        courses = course if isinstance(course, list) else [course]
+        self.course = courses[0]
+        self.courses = {c['id']: c for c in courses}
+        self.latency = latency
+        self.report_seconds = report_seconds
+        self.base_url = ''  # set by startMockCanvas, for the progress and file urls of reports
+        self.progress = {}
+        self.files = {}
+        self.max_per_page = max_per_page
+        self.quota = quota
+        self.refill_rate = refill_rate
+        self.request_cost = request_cost
+        self.remaining = quota
+        self.last_refill = time.monotonic()
+        self.n_requests = 0
+        self.lock = threading.Lock()
+
+    def startRequest(self):
+        """ Charge the in-flight penalty for a new request; returns False if the quota is exhausted. """
+        with self.lock:
+            now = time.monotonic()
+            self.remaining = min(self.quota, self.remaining + (now - self.last_refill) * self.refill_rate)
+            self.last_refill = now
+            self.n_requests += 1
+            if self.remaining < 0:
+                return False
+            self.remaining -= 50.0
+            return True
+
+    def finishRequest(self):
+        """ Refund the in-flight penalty less the request cost; returns the remaining quota. """
+        with self.lock:
+            self.remaining += 50.0 - self.request_cost
+            return self.remaining
+
+    def getCourses(self):
+        """ GET courses """
+        return None, [{k: v for k, v in course.items() if k not in ['students', 'quizzes']} for course in self.courses.values()]
+
+    def getCourse(self, course_id):
+        """ GET courses/:id """
+        course = self.courses.get(int(course_id))
+        return None if course is None else (None, {k: v for k, v in course.items() if k not in ['students', 'quizzes']})
+
+    def getQuizzes(self, course_id):
+        """ GET courses/:course_id/quizzes """
+        course = self.courses.get(int(course_id))
+        if course is None:
+            return None
+        return None, [{k: v for k, v in quiz.items() if k not in ['questions', 'submissions', 'reports']} for quiz in course['quizzes'].values()]
+
+    def getQuiz(self, course_id, quiz_id):
+        """ GET courses/:course_id/quizzes/:id """
+        quiz = self.quiz(course_id, quiz_id)
+        return None if quiz is None else (None, {k: v for k, v in quiz.items() if k not in ['questions', 'submissions', 'reports']})
+
+    def getQuestions(self, course_id, quiz_id):
+        """ GET courses/:course_id/quizzes/:quiz_id/questions """
+        quiz = self.quiz(course_id, quiz_id)
+        return None if quiz is None else (None, quiz['questions'])
+
+    def advance(self, progress):
+        """ Update the completion of a report's progress: it completes report_seconds after the report was requested. """
+        if progress['workflow_state'] != 'completed':
+            elapsed = time.monotonic() - progress['started']
+            if elapsed >= self.report_seconds:
+                progress.update({'workflow_state': 'completed', 'completion': 100.0})
+            else:
+                progress['completion'] = 100.0 * elapsed / self.report_seconds
+        return progress
+
+    def report(self, course_id, quiz_id, report):
+        """
+        A quiz report as Canvas shows it: with its file once generated (see advance). The csv is made from the
+        submissions at that time and served at /files/:id/download.
+        """
+        with self.lock:
+            if 'file' not in report and self.advance(self.progress[report['progress_id']])['workflow_state'] == 'completed':
+                file_id = len(self.files) + 1
+                self.files[file_id] = studentAnalysisCSV(self.quiz(course_id, quiz_id), self.courses[int(course_id)]['students'])
+                report['file'] = {'id': file_id, 'url': f"{self.base_url}/files/{file_id}/download", 'created_at': isoTime(datetime.utcnow()),
+                                  'filename': f"quiz_{quiz_id}_student_analysis.csv", 'content-type': 'text/csv'}
+                report['updated_at'] = report['file']['created_at']
+        return {k: v for k, v in report.items() if k != 'progress_id'}
+
+    def getReports(self, course_id, quiz_id):
+        """ GET courses/:course_id/quizzes/:quiz_id/reports """
+        quiz = self.quiz(course_id, quiz_id)
+        return None if quiz is None else (None, [self.report(course_id, quiz_id, report) for report in quiz['reports']])
+
+    def createReport(self, course_id, quiz_id, params):
+        """ POST courses/:course_id/quizzes/:quiz_id/reports (generated in the background, see getProgress) """
+        quiz = self.quiz(course_id, quiz_id)
+        if quiz is None:
+            return None
+        with self.lock:
+            progress_id = len(self.progress) + 1
+            self.progress[progress_id] = {'id': progress_id, 'workflow_state': 'running', 'completion': 0.0, 'started': time.monotonic(),
+                                          'context_type': 'Quizzes::QuizStatistics', 'tag': 'Quizzes::QuizReport'}
+            report = {'id': len(quiz['reports']) + 1, 'quiz_id': quiz['id'], 'report_type': params['quiz_report[report_type]'][0],
+                      'includes_all_versions': False, 'created_at': isoTime(datetime.utcnow()), 'updated_at': isoTime(datetime.utcnow()),
+                      'progress_url': f"{self.base_url}/api/v1/progress/{progress_id}", 'progress_id': progress_id}
+            quiz['reports'].append(report)
+        return None, {k: v for k, v in report.items() if k != 'progress_id'}
+
+    def getReport(self, course_id, quiz_id, report_id):
+        """ GET courses/:course_id/quizzes/:quiz_id/reports/:id """
+        quiz = self.quiz(course_id, quiz_id)
+        reports = [report for report in quiz['reports'] if report['id'] == int(report_id)] if quiz else []
+        return (None, self.report(course_id, quiz_id, reports[0])) if reports else None
+
+    def getProgress(self, progress_id):
+        """ GET progress/:id """
+        progress = self.progress.get(int(progress_id))
+        if progress is None:
+            return None
+        with self.lock:
+            return None, {k: v for k, v in self.advance(progress).items() if k != 'started'}
+
+    def getFile(self, file_id):
+        """ GET files/:id/download (the csv of a generated report) """
+        content = self.files.get(int(file_id))
+        return None if content is None else ('text/csv', content)
+
+    def quiz(self, course_id, quiz_id):
+        """ The quiz with the given ids, or None. """
+        course = self.courses.get(int(course_id))
+        return course['quizzes'].get(int(quiz_id)) if course else None
+
+    def getEnrollments(self, course_id):
+        """ GET courses/:course_id/enrollments (the students, with activity totals derived from their ids) """
+        course = self.courses.get(int(course_id))
+        if course is None:
+            return None
+        return None, [{'id': 70000 + s['id'], 'course_id': course['id'], 'user_id': s['id'], 'role': 'StudentEnrollment',
+                       'enrollment_state': 'active', 'sis_user_id': s['sis_user_id'], 'total_activity_time': 60 * (s['id'] % 500),
+                       'last_activity_at': None, 'user': {k: s[k] for k in ['id', 'name', 'sortable_name']}}
+                      for s in course['students']]
+
+    def getStudentSummaries(self, course_id):
+        """ GET courses/:course_id/analytics/student_summaries """
+        course = self.courses.get(int(course_id))
+        if course is None:
+            return None
+        return None, [{'id': s['id'], 'page_views': s['id'] % 97, 'participations': s['id'] % 13,
+                       'tardiness_breakdown': {'missing': s['id'] % 3, 'late': s['id'] % 2, 'on_time': 5, 'floating': 0, 'total': 8}}
+                      for s in course['students']]
+
+    def submission(self, course_id, quiz_id, sub_id):
+        """ The quiz submission with the given ids, or None. """
+        quiz = self.quiz(course_id, quiz_id)
+        subs = [s for s in quiz['submissions'] if s['id'] == int(sub_id)] if quiz else []
+        return subs[0] if subs else None
+
+    def getSubmissions(self, course_id, quiz_id):
+        """ GET courses/:course_id/quizzes/:quiz_id/submissions """
+        quiz = self.quiz(course_id, quiz_id)
+        if quiz is None:
+            return None
+        return 'quiz_submissions', [{k: v for k, v in s.items() if k not in ['events', 'answers']} for s in quiz['submissions']]
+
+    def getSubmissionEvents(self, course_id, quiz_id, sub_id):
+        """ GET courses/:course_id/quizzes/:quiz_id/submissions/:id/events """
+        sub = self.submission(course_id, quiz_id, sub_id)
+        return None if sub is None else ('quiz_submission_events', sub['events'])
+
+    def updateSubmission(self, course_id, quiz_id, sub_id, params):
+        """ PUT courses/:course_id/quizzes/:quiz_id/submissions/:id (only fudge points are supported) """
+        sub = self.submission(course_id, quiz_id, sub_id)
+        if sub is None:
+            return None
+        fudge_points = params.get('quiz_submissions[][fudge_points]')
+        if fudge_points:
+            with self.lock:
+                sub['score'] += float(fudge_points[0]) - (sub['fudge_points'] or 0.0)
+                sub['fudge_points'] = float(fudge_points[0])
+        return 'quiz_submissions', [{k: v for k, v in sub.items() if k not in ['events', 'answers']}]
+
+    routes = [
+        ('GET', r'/api/v1/courses', 'getCourses'),
+        ('GET', r'/api/v1/courses/(\d+)', 'getCourse'),
+        ('GET', r'/api/v1/courses/(\d+)/quizzes', 'getQuizzes'),
+        ('GET', r'/api/v1/courses/(\d+)/quizzes/(\d+)', 'getQuiz'),
+        ('GET', r'/api/v1/courses/(\d+)/quizzes/(\d+)/questions', 'getQuestions'),
+        ('GET', r'/api/v1/courses/(\d+)/quizzes/(\d+)/reports', 'getReports'),
+        ('POST', r'/api/v1/courses/(\d+)/quizzes/(\d+)/reports', 'createReport'),
+        ('GET', r'/api/v1/courses/(\d+)/quizzes/(\d+)/reports/(\d+)', 'getReport'),
+        ('GET', r'/api/v1/progress/(\d+)', 'getProgress'),
+        ('GET', r'/files/(\d+)/download', 'getFile'),
+        ('GET', r'/api/v1/courses/(\d+)/enrollments', 'getEnrollments'),
+        ('GET', r'/api/v1/courses/(\d+)/analytics/student_summaries', 'getStudentSummaries'),
+        ('GET', r'/api/v1/courses/(\d+)/quizzes/(\d+)/submissions', 'getSubmissions'),
+        ('GET', r'/api/v1/courses/(\d+)/quizzes/(\d+)/submissions/(\d+)/events', 'getSubmissionEvents'),
+        ('PUT', r'/api/v1/courses/(\d+)/quizzes/(\d+)/submissions/(\d+)', 'updateSubmission'),
+    ]
+
+
+class MockCanvasHandler(BaseHTTPRequestHandler):
+    """ Dispatches HTTP requests to the MockCanvas methods in MockCanvas.routes. """
+
+    mock = None
+
+    def log_message(self, format, *args):
+        """ Keep the console quiet. """
+        pass
+
+    def sendJSON(self, status, body, headers=None):
+        """ Send a JSON response with the rate limit headers Canvas adds. """
+        self.sendBody(status, json.dumps(body).encode(), 'application/json', headers)
+
+    def sendBody(self, status, content, content_type, headers=None):
+        """ Send a response with the given content (bytes) and headers. """
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def paginate(self, url, root, items):
+        """ The requested page of items (wrapped in root, if any) and its Link header. """
+        params = {k: v[0] for k, v in parse_qs(url.query).items()}
+        per_page = min(int(params.get('per_page', 10)), self.mock.max_per_page)
+        page = int(params.get('page', 1))
+        page_items = items[(page - 1) * per_page:page * per_page]
+        headers = {}
+        if page * per_page < len(items):
+            params.update({'page': page + 1, 'per_page': per_page})
+            headers['Link'] = f"<http://{self.headers['Host']}{url.path}?{urlencode(params)}>; rel=\"next\""
+        return ({root: page_items} if root else page_items), headers
+
+    def handle(self):
+        """ Handle a connection, ignoring clients that disconnect early. """
+        try:
+            super().handle()
+        except ConnectionError:
+            pass
+
+    def dispatch(self, method):
+        """ Route a request to the matching MockCanvas method (which, except for GET, also gets the form parameters). """
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        args = () if method == 'GET' else (parse_qs(body, keep_blank_values=True),)
+        if not self.mock.startRequest():
+            self.sendJSON(403, 'Forbidden (Rate Limit Exceeded)', {'X-Rate-Limit-Remaining': '0.0'})
+            return
+        time.sleep(self.mock.latency)
+        result = None
+        for route_method, pattern, name in self.mock.routes:
+            match = re.fullmatch(pattern, url.path)
+            if route_method == method and match:
+                result = getattr(self.mock, name)(*match.groups(), *args)
+                break
+        remaining = self.mock.finishRequest()
+        headers = {'X-Rate-Limit-Remaining': f"{remaining:.1f}", 'X-Request-Cost': f"{self.mock.request_cost:.1f}"}
+        if result is None:
+            self.sendJSON(404, {'errors': [{'message': 'The specified resource does not exist.'}]}, headers)
+            return
+        root, items = result
+        if isinstance(items, bytes):
+            self.sendBody(200, items, root, headers)
+            return
+        if isinstance(items, list):
+            items, link = self.paginate(url, root, items)
+            headers.update(link)
+        self.sendJSON(200, items, headers)
+
+    def do_GET(self):
+        """ Handle a GET request. """
+        self.dispatch('GET')
+
+    def do_PUT(self):
+        """ Handle a PUT request. """
+        self.dispatch('PUT')
+
+    def do_POST(self):
+        """ Handle a POST request. """
+        self.dispatch('POST')
+
+
+def startMockCanvas(mock, host='127.0.0.1', port=0):
+    """ Serve mock in a background thread; returns the server and the base URL to give canvasapi.Canvas. """
+    handler = type('Handler', (MockCanvasHandler,), {'mock': mock})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    mock.base_url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, mock.base_url
+
+
+def optionValue(argv, option, default):
+    """ Value following option in argv, converted to the type of default. """
+    return type(default)(argv[argv.index(option) + 1]) if option in argv else default
+
+
+if __name__ == '__main__':
+    courses = syntheticCourses(optionValue(sys.argv, '--courses', 1), n_students=optionValue(sys.argv, '--students', 250),
+                               n_questions=optionValue(sys.argv, '--questions', 6), n_quizzes=optionValue(sys.argv, '--quizzes', 1))
+    mock = MockCanvas(courses, latency=optionValue(sys.argv, '--latency', 0.05), max_per_page=optionValue(sys.argv, '--per-page', 50),
+                      report_seconds=optionValue(sys.argv, '--report-seconds', 0.5))
+    server, url = startMockCanvas(mock, port=optionValue(sys.argv, '--port', 8765))
+    print(f"Mock Canvas serving {len(courses)} course(s) of {len(courses[0]['students'])} students at {url} (Ctrl-C to stop)")
+    print(f"Run picata against it with: CANVAS_URL={url} CANVAS_TOKEN=mock-token python picata.py <task>")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,127 @@
+import os
+import multiprocessing
+from statistics import NormalDist
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import picata_config
+
+# Random pairings drawn per task (and per vectorized batch within a task, to bound memory).
+CHUNK_DRAWS = 2000
+BATCH_DRAWS = 250
+
+# Below this many draws x students the pairings are drawn in this process (starting workers would take longer).
+PARALLEL_MIN_WORK = 2000000
+
+
+def randomGroupDistances(dists, draws, rng):
+    """
+    Distance of every group of draws random pairings of the students of a square distance array at once,
+    shape (draws, n // 2): each row is a random permutation read as consecutive pairs, with the student
+    left over (if n is odd) added to the last pair, as PicaQuiz's 'rand' method does.
+    """
+    n = dists.shape[0]
+    perms = rng.permuted(np.tile(np.arange(n), (draws, 1)), axis=1)
+    a, b = perms[:, 0:n - 1:2], perms[:, 1:n:2]
+    groups = dists[a, b]
+    if n % 2 == 1:
+        left = perms[:, -1]
+        groups[:, -1] = np.maximum(groups[:, -1], np.maximum(dists[a[:, -1], left], dists[b[:, -1], left]))
+    return groups
+
+
+def drawStats(dists, draws, seed):
+    """ Mean and variance of the group distances of draws random pairings, seeded with seed (a SeedSequence or int). """
+    rng = np.random.default_rng(seed)
+    means, variances = [], []
+    for start in range(0, draws, BATCH_DRAWS):
+        groups = randomGroupDistances(dists, min(BATCH_DRAWS, draws - start), rng)
+        means.append(groups.mean(axis=1))
+        variances.append(groups.var(axis=1))
+    return np.concatenate(means), np.concatenate(variances)
+
+
+def randomPairingStats(dists, draws, seed=0, workers=None):
+    """
+    Mean and variance of the group distances of draws random pairings, drawn in chunks of CHUNK_DRAWS
+    spread over (forked) worker processes, each with its own stream spawned from seed (so the result depends
+    on seed and draws only, not on the number of workers; without fork, see picata_config.forkSafe, they are
+    all drawn in this process). Returns two arrays of length draws.
+    """
+    dists = np.nan_to_num(np.asarray(dists, dtype=float))
+    sizes = [min(CHUNK_DRAWS, draws - start) for start in range(0, draws, CHUNK_DRAWS)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    workers = min(workers or os.cpu_count() or 1, len(sizes))
+    if draws * dists.shape[0] < PARALLEL_MIN_WORK or not picata_config.forkSafe():
+        workers = 1
+    if workers <= 1:
+        results = [drawStats(dists, size, chunk_seed) for size, chunk_seed in zip(sizes, seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork')) as pool:
+            results = list(pool.map(drawStats, [dists] * len(sizes), sizes, seeds))
+    return np.concatenate([means for means, _ in results]), np.concatenate([variances for _, variances in results])
+
+
+def summarize(values, confidence=0.95):
+    """
+    Distribution of a statistic over many pairings: its mean and standard deviation, the central interval
+    holding the given fraction of the pairings, and the confidence interval of the mean.
+    """
+    values = np.asarray(values, dtype=float)
+    mean = float(values.mean())
+    std = float(values.std(ddof=1)) if len(values) > 1 else 0.0
+    tail = (1 - confidence) / 2
+    half_width = NormalDist().inv_cdf(1 - tail) * std / np.sqrt(len(values))
+    return {
+        'mean': mean,
+        'std': std,
+        'interval': [float(np.quantile(values, tail)), float(np.quantile(values, 1 - tail))],
+        'mean_ci': [mean - half_width, mean + half_width],
+    }
+
+
+def evaluatePairingMethods(dists, pairings_by_method, draws, seed=0, workers=None, confidence=0.95):
+    """
+    Compare pairing methods with the distribution of draws random pairings: for each method the mean and
+    variance of its group distances (for 'rand', their distribution over all the draws, with confidence
+    intervals; the other methods are deterministic, so theirs is the single value of their one pairing,
+    marked 'deterministic') and the fraction of random pairings with a mean distance at least as large. pairings_by_method
+    maps each method to its (id1, id2, [id3,] distance) tuples. Returns a dict that can be saved as JSON.
+    """
+    means, variances = randomPairingStats(dists, draws, seed, workers)
+    methods = {'rand': {
+        'draws': int(draws),
+        'mean_distance': summarize(means, confidence),
+        'var_distance': summarize(variances, confidence),
+    }}
+    for method, pairings in pairings_by_method.items():
+        if method == 'rand':
+            continue
+        distances = np.nan_to_num(np.array([pairing[-1] for pairing in pairings], dtype=float))
+        methods[method] = {
+            'draws': 1,
+            'deterministic': True,
+            'mean_distance': {'mean': float(distances.mean())},
+            'var_distance': {'mean': float(distances.var())},
+            'random_at_least_as_good': float(np.mean(means >= distances.mean() - 1E-12)),
+        }
+    return {'students': int(dists.shape[0]), 'draws': int(draws), 'seed': seed, 'confidence': confidence, 'methods': methods}
+
+
+def evaluationTable(evaluation):
+    """ The result of evaluatePairingMethods as a text table, with the deterministic methods' single values marked. """
+    percent = f"{100 * evaluation['confidence']:g}%"
+    lines = [f"{'method':>8} {'draws':>7} {'mean dist':>10} {percent + ' CI of mean':>20} {percent + ' of pairings':>20} "
+             f"{'var dist':>9} {percent + ' of pairings':>20} {'rand >= (%)':>11}"]
+    deterministic = [method for method, stats in evaluation['methods'].items() if stats.get('deterministic')]
+    for method, stats in evaluation['methods'].items():
+        mean, var = stats['mean_distance'], stats['var_distance']
+        draws = 'single' if stats.get('deterministic') else f"{stats['draws']:d}"
+        ci = f"[{mean['mean_ci'][0]:.3f}, {mean['mean_ci'][1]:.3f}]" if 'mean_ci' in mean else ''
+        mean_interval = f"[{mean['interval'][0]:.3f}, {mean['interval'][1]:.3f}]" if 'interval' in mean else ''
+        var_interval = f"[{var['interval'][0]:.3f}, {var['interval'][1]:.3f}]" if 'interval' in var else ''
+        better = f"{100 * stats['random_at_least_as_good']:.1f}" if 'random_at_least_as_good' in stats else ''
+        lines.append(f"{method:>8} {draws:>7} {mean['mean']:>10.3f} {ci:>20} {mean_interval:>20} "
+                     f"{var['mean']:>9.3f} {var_interval:>20} {better:>11}")
+    if deterministic:
+        lines.append(f"({', '.join(deterministic)}: one deterministic pairing each, so a single value and no intervals)")
+    return '\n'.join(lines)
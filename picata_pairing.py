@@ -0,0 +1,357 @@
+import random
+import numpy as np
+
+PAIRING_METHODS = ['max', 'med', 'min', 'rand', 'optimal']
+
+# Above this many students the O(n^3) assignment problem takes more than a few seconds, so 'optimal'
+# pairing starts from the greedy 'max' pairs instead, and a looser (row maxima) upper bound is used.
+ASSIGNMENT_MAX_STUDENTS = 1500
+
+
+def selectStudent(row_max, alive, method):
+    """ Choose the next student to pair, given the max distance in each row of those not yet paired. """
+    # 'max' is a greedy approach taking largest pair difference first
+    if method == 'max':
+        return int(np.argmax(np.where(alive, row_max, -np.inf)))
+    # 'med' is median difference and generally leads to highest mean diff and lowest variance
+    if method == 'med':
+        remaining = np.flatnonzero(alive)
+        order = np.argsort(row_max[remaining], kind='stable')
+        return int(remaining[order[len(remaining) // 2]])
+    # 'min' uses conservative approach by taking min pair difference (among maxes) but often leads to high var
+    if method == 'min':
+        return int(np.argmin(np.where(alive, row_max, np.inf)))
+    raise ValueError("selectStudent(): invalid method")
+
+
+def greedyGroups(dists, method='med'):
+    """
+    Pair the rows/columns of a square distance array greedily using the given method, and return a
+    list of index tuples. Each pair is the chosen student and the student farthest from them among
+    those not yet paired. The maximum of each row (and the column it is in) is kept in an array that
+    is only recomputed for rows whose farthest student was just paired, so each step is O(n) rather
+    than a scan and copy of the whole remaining matrix. With an odd number of students the one left
+    over is added to the last pair.
+    """
+    if method not in PAIRING_METHODS or method == 'optimal':
+        raise ValueError("greedyGroups(): invalid method")
+    n = dists.shape[0]
+    work = np.array(dists, dtype=float)
+    work[np.isnan(work)] = -0.5
+    np.fill_diagonal(work, -1.0)
+    row_arg = work.argmax(axis=1)
+    row_max = work[np.arange(n), row_arg]
+    alive = np.ones(n, dtype=bool)
+
+    groups = []
+    while alive.sum() > 2:
+        if method == 'rand':
+            a, b = random.sample(np.flatnonzero(alive).tolist(), 2)
+        else:
+            a = selectStudent(row_max, alive, method)
+            b = int(row_arg[a])
+        groups.append((a, b))
+        alive[[a, b]] = False
+
+        # only rows whose farthest student was just removed need a new maximum
+        stale = np.flatnonzero(alive & ((row_arg == a) | (row_arg == b)))
+        if len(stale) > 0:
+            stale_rows = np.where(alive, work[stale], -np.inf)
+            row_arg[stale] = stale_rows.argmax(axis=1)
+            row_max[stale] = stale_rows[np.arange(len(stale)), row_arg[stale]]
+
+    remaining = np.flatnonzero(alive).tolist()
+    if len(remaining) == 2:
+        groups.append(tuple(remaining))
+    else:
+        assert len(remaining) == 1 and len(groups) > 0
+        groups[-1] = groups[-1] + tuple(remaining)
+    return groups
+
+
+def groupDistance(dists, group):
+    """ Distance of a group of students, i.e. the largest distance between any two of them. """
+    return max(dists[a, b] for i, a in enumerate(group) for b in group[i + 1:])
+
+
+def groupsToPairings(dists, ids, groups):
+    """ Convert index groups to the (id1, id2, [id3,] distance) tuples used by PicaQuiz. """
+    return [tuple(ids[k] for k in group) + (groupDistance(dists, group),) for group in groups]
+
+
+def matchingWeights(dists):
+    """ Copy of a distance array usable as matching weights: no NaNs and an extra zero-distance student if n is odd. """
+    weights = np.nan_to_num(np.array(dists, dtype=float), nan=0.0)
+    np.fill_diagonal(weights, 0.0)
+    if weights.shape[0] % 2 == 1:
+        weights = np.pad(weights, ((0, 1), (0, 1)))
+    return weights
+
+
+def matchingUpperBound(dists):
+    """
+    Upper bound on the total distance of any set of disjoint pairs: every such pairing, read in both
+    directions, is a permutation of the students, so it weighs at most half of the max-weight
+    permutation (an assignment problem, solved exactly in O(n^3) by linear_sum_assignment). For very
+    large classes half the sum of each student's largest distance is used instead.
+    """
+    from scipy.optimize import linear_sum_assignment
+    weights = matchingWeights(dists)
+    if weights.shape[0] > ASSIGNMENT_MAX_STUDENTS:
+        return weights.max(axis=1).sum() / 2
+    rows, cols = linear_sum_assignment(weights, maximize=True)
+    return weights[rows, cols].sum() / 2
+
+
+def cycleMatching(weights, cycle):
+    """ Best pairs along one cycle of an assignment: alternate edges, leaving one student out if the cycle is odd. """
+    k = len(cycle)
+    if k == 1:
+        return [], cycle
+    edges = np.array([weights[cycle[j], cycle[(j + 1) % k]] for j in range(k)])
+    if k % 2 == 0:
+        start = 0 if edges[0::2].sum() >= edges[1::2].sum() else 1
+        return [(cycle[j], cycle[(j + 1) % k]) for j in range(start, k, 2)], []
+    # for an odd cycle leave out student t, then take every other edge of the path that remains
+    edges2 = np.concatenate([edges, edges])
+    t = int(np.argmax([edges2[t + 1:t + k - 1:2].sum() for t in range(k)]))
+    return [(cycle[j % k], cycle[(j + 1) % k]) for j in range(t + 1, t + k - 1, 2)], [cycle[t]]
+
+
+def assignmentPairs(weights):
+    """ Initial pairs from the max-weight permutation, with any students left over paired greedily. """
+    from scipy.optimize import linear_sum_assignment
+    rows, cols = linear_sum_assignment(weights, maximize=True)
+    seen = np.zeros(len(cols), dtype=bool)
+    pairs = []
+    free = []
+    for start in range(len(cols)):
+        cycle = []
+        k = start
+        while not seen[k]:
+            seen[k] = True
+            cycle.append(k)
+            k = cols[k]
+        cycle_pairs, cycle_free = cycleMatching(weights, cycle)
+        pairs.extend(cycle_pairs)
+        free.extend(cycle_free)
+    while len(free) > 1:
+        a = free.pop(0)
+        b = free.pop(int(np.argmax(weights[a, free])))
+        pairs.append((a, b))
+    return np.array(pairs)
+
+
+def improvePairs(weights, pairs, max_passes=50):
+    """ Local search: swap partners between two pairs whenever that increases the total distance. """
+    for _ in range(max_passes):
+        improved = False
+        for i in range(len(pairs)):
+            a, b = pairs[i]
+            c, d = pairs[:, 0], pairs[:, 1]
+            current = weights[a, b] + weights[c, d]
+            swap_ac = weights[a, c] + weights[b, d] - current
+            swap_ad = weights[a, d] + weights[b, c] - current
+            j = int(np.argmax(np.maximum(swap_ac, swap_ad)))
+            if max(swap_ac[j], swap_ad[j]) <= 1E-12:
+                continue
+            c, d = pairs[j]
+            pairs[i], pairs[j] = ((a, c), (b, d)) if swap_ac[j] >= swap_ad[j] else ((a, d), (b, c))
+            improved = True
+        if not improved:
+            break
+    return pairs
+
+
+def optimalGroups(dists):
+    """
+    Pair students to (approximately) maximize the total distance over all pairs. Starts from the
+    max-weight permutation, which also gives the upper bound of matchingUpperBound, (or from the greedy
+    'max' pairs for very large classes) and improves it by local search; the result is usually within
+    a fraction of a percent of that bound. With an odd number of students the one left over is added
+    to the pair farthest from them, as a group of three.
+    """
+    n = dists.shape[0]
+    weights = matchingWeights(dists)
+    if weights.shape[0] > ASSIGNMENT_MAX_STUDENTS:
+        pairs = np.array(greedyGroups(weights, 'max'))
+    else:
+        pairs = assignmentPairs(weights)
+    pairs = improvePairs(weights, pairs)
+    groups = [tuple(int(k) for k in pair) for pair in pairs if max(pair) < n]
+    if n % 2 == 1:
+        left_out = int(pairs[np.any(pairs == n, axis=1)].min())
+        k = int(np.argmax([max(weights[left_out, a], weights[left_out, b]) for a, b in groups]))
+        groups[k] = groups[k] + (left_out,)
+    return groups
+
+
+def pairingWeight(dists, groups):
+    """ Total distance between the first two students of each group, comparable with matchingUpperBound. """
+    return sum(np.nan_to_num(dists[group[0], group[1]]) for group in groups)
+
+
+def studentPairings(dist_matrix, method='med', penalty=0.0):
+    """
+    Pair the students in a distance matrix dataframe; returns (id1, id2, [id3,] distance) tuples. The pairs
+    maximize the distances less penalty (e.g. a repeat-partner array of picata_partners), but the distance of
+    each group is its actual one.
+    """
+    dists = dist_matrix.to_numpy()
+    if method == 'optimal':
+        groups = optimalGroups(dists - penalty)
+    else:
+        groups = greedyGroups(dists - penalty, method)
+    return groupsToPairings(dists, dist_matrix.index.tolist(), groups)
+
+
+def insertStudent(dists, groups, student):
+    """
+    Add a student to index groups in place, changing as few groups as possible: the student is paired
+    with a member of the group of three if there is one (the member whose leaving keeps the most
+    distance), otherwise added to the pair farthest from them. Returns the positions of the changed groups.
+    """
+    for k, group in enumerate(groups):
+        if len(group) == 1:
+            groups[k] = group + (student,)
+            return [k]
+    for k, group in enumerate(groups):
+        if len(group) == 3:
+            options = [(tuple(m for m in group if m != x), x) for x in group]
+            pair, x = max(options, key=lambda option: dists[option[0][0], option[0][1]] + dists[option[1], student])
+            groups[k] = pair
+            groups.append((x, student))
+            return [k, len(groups) - 1]
+    if not groups:
+        groups.append((student,))
+        return [0]
+    k = int(np.argmax([max(dists[student, a], dists[student, b]) for a, b in groups]))
+    groups[k] = groups[k] + (student,)
+    return [k]
+
+
+def removeStudent(dists, groups, student):
+    """ Remove a student from index groups in place; a partner left alone is added again with insertStudent. Returns the positions of the changed groups. """
+    k = next(k for k, group in enumerate(groups) if student in group)
+    rest = tuple(m for m in groups[k] if m != student)
+    if len(rest) == 2:
+        groups[k] = rest
+        return [k]
+    del groups[k]
+    return insertStudent(dists, groups, rest[0]) if rest else []
+
+
+def improveGroups(dists, groups, changed):
+    """
+    Swap partners between each changed pair and any other pair whenever that increases the total distance
+    (the swap of improvePairs, for these pairs only), so that only the affected students are re-matched.
+    Returns the positions of all groups changed, including those swapped with.
+    """
+    swapped = []
+    for k in changed:
+        others = [j for j, group in enumerate(groups) if len(group) == 2 and j != k]
+        if len(groups[k]) != 2 or not others:
+            continue
+        a, b = groups[k]
+        c, d = np.array([groups[j] for j in others]).T
+        current = dists[a, b] + dists[c, d]
+        swap_ac = dists[a, c] + dists[b, d] - current
+        swap_ad = dists[a, d] + dists[b, c] - current
+        i = int(np.argmax(np.maximum(swap_ac, swap_ad)))
+        if max(swap_ac[i], swap_ad[i]) <= 1E-12:
+            continue
+        j = others[i]
+        c, d = groups[j]
+        groups[k], groups[j] = ((a, c), (b, d)) if swap_ac[i] >= swap_ad[i] else ((a, d), (b, c))
+        swapped.append(j)
+    return sorted(set(changed) | set(swapped))
+
+
+def groupSizes(n, group_size):
+    """
+    Sizes of the groups n students are split into, differing by at most one: groups of group_size and some
+    one smaller, except for pairs, where (as for the pairing methods) a student left over makes a group of three.
+    """
+    n_groups = max(1, n // group_size if group_size == 2 else -(-n // group_size))
+    extra = n - n_groups * group_size
+    return [group_size + extra // n_groups + (1 if g < extra % n_groups else 0) for g in range(n_groups)]
+
+
+def seedGroups(dists, sizes):
+    """
+    Greedy start for diverseGroups: students are placed one at a time, those farthest from everyone first,
+    each in the group (with room left) whose members they are farthest from in total. The total distance of
+    every student to the members of every group is kept in an (n, groups) array updated as students are placed.
+    Returns the group of each student and that array.
+    """
+    n = dists.shape[0]
+    room = np.array(sizes)
+    members = np.zeros(len(sizes), dtype=int)
+    gain = np.zeros((n, len(sizes)))
+    group_of = np.full(n, -1)
+    for s in np.argsort(-dists.sum(axis=1), kind='stable'):
+        # (among groups with room, the farthest; the emptiest first while some groups are still empty)
+        score = np.where(room > 0, gain[s] - 1E9 * members, -np.inf)
+        g = int(np.argmax(score))
+        group_of[s] = g
+        room[g] -= 1
+        members[g] += 1
+        gain[:, g] += dists[:, s]
+    return group_of, gain
+
+
+def swapStudents(dists, group_of, gain, max_passes=20):
+    """
+    Local search for diverseGroups: swap two students of different groups whenever that increases the total
+    distance within the groups. Each student is tried against all others at once using the gain array of
+    seedGroups (kept up to date), so a pass is O(n^2).
+    """
+    n = dists.shape[0]
+    everyone = np.arange(n)
+    for _ in range(max_passes):
+        improved = False
+        for a in range(n):
+            ga = group_of[a]
+            # change in total distance if a and b swap groups, for every b
+            delta = (gain[a, group_of] - dists[a] - gain[a, ga]) + (gain[everyone, ga] - dists[a] - gain[everyone, group_of])
+            delta[group_of == ga] = -np.inf
+            b = int(np.argmax(delta))
+            if delta[b] <= 1E-12:
+                continue
+            gb = group_of[b]
+            gain[:, ga] += dists[:, b] - dists[:, a]
+            gain[:, gb] += dists[:, a] - dists[:, b]
+            group_of[a], group_of[b] = gb, ga
+            improved = True
+        if not improved:
+            break
+    return group_of
+
+
+def diverseGroups(dists, group_size=3, max_passes=20):
+    """
+    Split the students of a square distance array into groups of group_size (see groupSizes) that are as
+    diverse as possible, i.e. with the largest total distance between members of the same group: a greedy
+    start (seedGroups) improved by swapping students between groups (swapStudents). Works in O(n^2) memory
+    and time per pass, so it scales to thousands of students. Returns index tuples.
+    """
+    weights = np.nan_to_num(np.array(dists, dtype=float), nan=0.0)
+    np.fill_diagonal(weights, 0.0)
+    n = weights.shape[0]
+    if n < 2:
+        return [tuple(range(n))] if n else []
+    group_of, gain = seedGroups(weights, groupSizes(n, group_size))
+    group_of = swapStudents(weights, group_of, gain, max_passes)
+    groups = [tuple(int(k) for k in np.flatnonzero(group_of == g)) for g in range(group_of.max() + 1)]
+    return sorted(groups)
+
+
+def groupingWeight(dists, groups):
+    """ Total distance between all members of each group (what diverseGroups maximizes). """
+    return sum(np.nan_to_num(dists[a, b]) for group in groups for i, a in enumerate(group) for b in group[i + 1:])
+
+
+def studentGroups(dist_matrix, group_size=3, penalty=0.0):
+    """ Split the students in a distance matrix dataframe into diverse groups (of the distances less penalty); returns (id1, ..., idk, distance) tuples. """
+    dists = dist_matrix.to_numpy()
+    return groupsToPairings(dists, dist_matrix.index.tolist(), diverseGroups(dists - penalty, group_size))
@@ -0,0 +1,101 @@
+import re
+import sys
+import numpy as np
+import pandas as pd
+import picata_bonus
+import picata_config
+import picata_sqlite
+
+# Penalty of a forbidden repeat partner: more than any distance, but finite, so that the 'optimal' method's
+# assignment problem stays feasible (and a repeat is still made) when every possible partner is a repeat.
+FORBIDDEN = 1E6
+
+
+class PairingHistory(picata_sqlite.SQLiteStore):
+    """
+    Who has been grouped with whom, in a SQLite file: a row for every two students in a group of a pairing
+    csv written for a course, with the quiz and session (the date of the csv) it was for. The pairs of the
+    students about to be paired are read with one indexed query into a co-occurrence array, so a semester
+    of sessions costs the pairing methods an O(1) lookup per candidate pair.
+    """
+
+    def __init__(self, path):
+        """ Open (or create) the history database at path. """
+        super().__init__(path)
+        self.execute("CREATE TABLE IF NOT EXISTS pairing_history (course_id INTEGER, session TEXT, quiz_id INTEGER, "
+                     "id_a INTEGER, id_b INTEGER, PRIMARY KEY (course_id, session, quiz_id, id_a, id_b))")
+
+    def record(self, course_id, quiz_id, session, groups):
+        """
+        Store the groups (tuples of student ids, -1 for none) of a pairing, replacing the pairing stored for the
+        same quiz and session, since the pairing csv is rewritten when it changes. Returns the number of pairs.
+        """
+        pairs = {(min(a, b), max(a, b)) for group in groups for i, a in enumerate(group) for b in group[i + 1:] if a != -1 and b != -1}
+        with self.transaction() as db:
+            db.execute("DELETE FROM pairing_history WHERE course_id = ? AND quiz_id = ? AND session = ?", (int(course_id), int(quiz_id), session))
+            db.executemany("INSERT OR REPLACE INTO pairing_history VALUES (?, ?, ?, ?, ?)",
+                           [(int(course_id), session, int(quiz_id), int(a), int(b)) for a, b in pairs])
+        return len(pairs)
+
+    def pairs(self, course_id, recent_sessions=0, exclude=None):
+        """
+        The stored pairs of a course (columns id_a, id_b and session), of its last recent_sessions sessions
+        only if given, leaving out the pairing of exclude=(quiz_id, session), e.g. the one being made.
+        """
+        where, params = "course_id = ?", [int(course_id)]
+        if exclude:
+            where += " AND NOT (quiz_id = ? AND session = ?)"
+            params += [int(exclude[0]), exclude[1]]
+        if recent_sessions:
+            where += f" AND session IN (SELECT DISTINCT session FROM pairing_history WHERE {where} ORDER BY session DESC LIMIT ?)"
+            params += params + [int(recent_sessions)]
+        return self.read(f"SELECT id_a, id_b, session FROM pairing_history WHERE {where}", params)
+
+    def repeatCounts(self, ids, course_id, recent_sessions=0, exclude=None):
+        """ Square array of the number of times each two of the students ids have been grouped together (see pairs). """
+        pairs = self.pairs(course_id, recent_sessions, exclude)
+        positions = pd.Index(ids)
+        a, b = positions.get_indexer(pairs['id_a']), positions.get_indexer(pairs['id_b'])
+        both = (a >= 0) & (b >= 0)
+        counts = np.zeros((len(positions), len(positions)))
+        np.add.at(counts, (a[both], b[both]), 1)
+        return counts + counts.T
+
+
+def openPairingHistory(config):
+    """ The pairing history for a PicataConfig. """
+    return PairingHistory(config.pairing_history_path)
+
+
+def repeatPenalty(counts, penalty):
+    """
+    Penalty to subtract from the distances of the students of a repeatCounts array before pairing them:
+    penalty for each time two students were grouped together before, or FORBIDDEN if penalty is infinite.
+    """
+    return np.where(counts > 0, FORBIDDEN, 0.0) if np.isinf(penalty) else penalty * counts
+
+
+def repeatPartners(counts, ids, pairings):
+    """ Number of pairs within the groups of pairings ((id1, id2, [id3,] distance) tuples) that have counts for the students ids. """
+    positions = pd.Index(ids)
+    return sum(1 for pairing in pairings for i, a in enumerate(pairing[:-1]) for b in pairing[i + 1:-1]
+               if counts[positions.get_loc(a), positions.get_loc(b)] > 0)
+
+
+def importPairings(history, csv_path, course_id):
+    """ Add a pairing csv written by PicaQuiz (..._<quiz id>_pairing_via_<method>_<yyyymmdd>.csv) to the history. """
+    match = re.search(r"_(\d+)_pairing_via_.*_(\d{8})\.csv$", csv_path)
+    if match is None:
+        raise ValueError(f"{csv_path} is not named like a pairing csv")
+    pairings = pd.read_csv(csv_path)
+    groups = pairings[picata_bonus.memberColumns(pairings)].fillna(-1).astype('int64').itertuples(index=False)
+    return history.record(course_id, int(match.group(1)), match.group(2), list(groups))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 4 or sys.argv[1] != 'import':
+        print("Usage: picata_partners.py import <course id> <pairing csv files...>")
+        sys.exit(1)
+    pairing_history = openPairingHistory(picata_config.PicataConfig())
+    for pairing_csv in sys.argv[3:]:
+        print(f"{pairing_csv}: {importPairings(pairing_history, pairing_csv, int(sys.argv[2]))} pairs")
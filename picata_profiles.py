@@ -0,0 +1,196 @@
+import os
+import csv
+import re
+import sys
+import json
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+import pandas as pd
+import picata_canvas
+import picata_config
+
+# Rows (questions) and columns (students) the score matrix starts with; it doubles when it fills up.
+INITIAL_QUESTIONS = 64
+INITIAL_STUDENTS = 256
+
+
+class ProfileStore:
+    """
+    Scores of every student on every question of every quiz analyzed so far, in one float32 matrix memory-
+    mapped from data/profiles/scores.npy (a row per question, a column per student, NaN where a student has
+    no score) and an index.json with the student and question ids of the rows and columns and the quizzes
+    they came from. Each quiz only writes its own rows, and the rows of a few quizzes are read without
+    loading the rest, so distances over recent quizzes need neither the whole history nor the old reports.
+    """
+
+    def __init__(self, path):
+        """ Open (or create) the store in the directory path. """
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.index_path = os.path.join(path, "index.json")
+        self.scores_path = os.path.join(path, "scores.npy")
+        self.load()
+
+    def load(self):
+        """ (Re)read the index and map the score matrix. """
+        index = {'students': [], 'questions': [], 'quizzes': {}}
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+        self.students = index['students']
+        self.questions = index['questions']
+        self.quizzes = index['quizzes']
+        self.student_cols = {student_id: k for k, student_id in enumerate(self.students)}
+        self.question_rows = {question_id: k for k, question_id in enumerate(self.questions)}
+        self.scores = np.load(self.scores_path, mmap_mode='r+') if os.path.exists(self.scores_path) else None
+
+    @contextmanager
+    def locked(self):
+        """ Hold the store's lock (other processes, e.g. batch workers, may update it at the same time). """
+        with open(os.path.join(self.path, "lock"), 'w') as lock:
+            if sys.platform == 'win32':
+                import msvcrt
+                # (LK_LOCK gives up after 10 seconds, so keep trying while another process holds the lock)
+                while True:
+                    try:
+                        msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        continue
+                try:
+                    yield
+                finally:
+                    lock.seek(0)
+                    msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def reserve(self, n_questions, n_students):
+        """ Make the score matrix at least n_questions x n_students, doubling it (into a new file) when it is too small. """
+        rows, cols = self.scores.shape if self.scores is not None else (0, 0)
+        if n_questions <= rows and n_students <= cols:
+            return
+        shape = (max(n_questions, 2 * rows, INITIAL_QUESTIONS), max(n_students, 2 * cols, INITIAL_STUDENTS))
+        tmp_path = self.scores_path + ".tmp.npy"
+        scores = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=shape)
+        scores[:] = np.nan
+        if self.scores is not None:
+            scores[:rows, :cols] = self.scores
+        scores.flush()
+        del scores
+        os.replace(tmp_path, self.scores_path)
+        self.scores = np.load(self.scores_path, mmap_mode='r+')
+
+    def writeIndex(self):
+        """ Save the index (replacing the old one at once, so readers never see half of it). """
+        with open(self.index_path + ".tmp", 'w') as f:
+            json.dump({'students': self.students, 'questions': self.questions, 'quizzes': self.quizzes}, f)
+        os.replace(self.index_path + ".tmp", self.index_path)
+
+    def update(self, quiz_df, question_ids, quiz_id, course_id, quiz_time):
+        """ Store the '<question_id>_score' columns of a quiz report dataframe, replacing what was stored for that quiz. """
+        with self.locked():
+            self.load()
+            student_ids = [int(student_id) for student_id in quiz_df['id']]
+            for student_id in student_ids:
+                if student_id not in self.student_cols:
+                    self.student_cols[student_id] = len(self.students)
+                    self.students.append(student_id)
+            for question_id in question_ids:
+                if question_id not in self.question_rows:
+                    self.question_rows[question_id] = len(self.questions)
+                    self.questions.append(question_id)
+            self.reserve(len(self.questions), len(self.students))
+
+            rows = [self.question_rows[question_id] for question_id in question_ids]
+            self.scores[rows, :] = np.nan
+            block = quiz_df.reindex(columns=[question_id + '_score' for question_id in question_ids]).to_numpy(dtype=np.float32).T
+            self.scores[np.ix_(rows, [self.student_cols[student_id] for student_id in student_ids])] = block
+            self.scores.flush()
+            self.quizzes[str(quiz_id)] = {'course_id': int(course_id), 'time': quiz_time, 'questions': list(question_ids)}
+            self.writeIndex()
+
+    def recentQuizzes(self, course_id, quiz_id, window):
+        """ The ids of quiz_id and the (up to) window quizzes of the course stored before it, newest first. """
+        this = self.quizzes.get(str(quiz_id))
+        if this is None:
+            return []
+        earlier = [(quiz['time'], int(other_id)) for other_id, quiz in self.quizzes.items()
+                   if quiz['course_id'] == int(course_id) and other_id != str(quiz_id) and quiz['time'] <= this['time']]
+        return [int(quiz_id)] + [other_id for _, other_id in sorted(earlier, reverse=True)[:window]]
+
+    def scoreFrame(self, quiz_weights):
+        """
+        Scores on the questions of the given quizzes (a dict of quiz id to weight) as a dataframe with an 'id'
+        column and a '<question_id>_score' column for each question, multiplied by the square root of the
+        quiz's weight so that (euclidean) distances over these columns weigh each quiz by its weight. Only
+        students with a score on at least one of the questions are included; missing scores are NaN.
+        """
+        columns, weights = [], []
+        for quiz_id, weight in quiz_weights.items():
+            for question_id in self.quizzes[str(quiz_id)]['questions']:
+                columns.append(question_id)
+                weights.append(weight)
+        scores = self.scores[[self.question_rows[question_id] for question_id in columns], :len(self.students)]
+        scores = scores * np.sqrt(np.array(weights, dtype=np.float32))[:, None]
+        keep = ~np.all(np.isnan(scores), axis=0)
+        frame = pd.DataFrame(scores[:, keep].T, columns=[question_id + '_score' for question_id in columns])
+        frame.insert(0, 'id', np.array(self.students, dtype=np.int64)[keep])
+        return frame
+
+    def historyFrame(self, course_id, quiz_id, window, decay=0.5):
+        """ The scoreFrame of quiz_id and the window quizzes of the course before it, the k-th before it weighted by decay**k. """
+        return self.scoreFrame({other_id: decay ** age for age, other_id in enumerate(self.recentQuizzes(course_id, quiz_id, window))})
+
+    def studentProfile(self, student_id):
+        """ The stored scores of one student, one row per quiz (in time order) with the mean score and number of questions. """
+        col = self.student_cols[int(student_id)]
+        rows = []
+        for quiz_id, quiz in sorted(self.quizzes.items(), key=lambda item: item[1]['time']):
+            scores = self.scores[[self.question_rows[question_id] for question_id in quiz['questions']], col]
+            if not np.all(np.isnan(scores)):
+                rows.append({'course_id': quiz['course_id'], 'quiz_id': int(quiz_id), 'time': quiz['time'],
+                             'questions': int(np.sum(~np.isnan(scores))), 'mean_score': float(np.nanmean(scores))})
+        return pd.DataFrame(rows)
+
+
+def openProfiles(config):
+    """ The profile store for a PicataConfig. """
+    return ProfileStore(config.profiles_path)
+
+
+def importReport(store, csv_path, course_id):
+    """
+    Add an archived student_analysis report (quiz_..._<quiz id>_<yyyymmdd>_student_analysis.csv, as saved with
+    --archive-reports) to the store, with the question ids read from its header and the date from its name.
+    """
+    match = re.search(r"_(\d+)_(\d{8})_student_analysis\.csv$", csv_path)
+    if match is None:
+        raise ValueError(f"{csv_path} is not named like an archived student_analysis report")
+    with open(csv_path, encoding='utf-8-sig', newline='') as f:
+        question_ids = [col.split(':')[0] for col in next(csv.reader(f)) if col.split(':')[0].isdigit()]
+        f.seek(0)
+        quiz_df = picata_canvas.parseQuizReport(f, question_ids)
+    quiz_time = datetime.strptime(match.group(2), '%Y%m%d').strftime('%Y-%m-%dT%H:%M:%SZ')
+    store.update(quiz_df, question_ids, int(match.group(1)), course_id, quiz_time)
+    return len(quiz_df), len(question_ids)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ['import', 'show']:
+        print("Usage: picata_profiles.py import <course id> <archived student_analysis csv files...>")
+        print("       picata_profiles.py show <student id>")
+        sys.exit(1)
+    profiles = openProfiles(picata_config.PicataConfig())
+    if sys.argv[1] == 'import':
+        for report_csv in sys.argv[3:]:
+            n_students, n_questions = importReport(profiles, report_csv, int(sys.argv[2]))
+            print(f"{report_csv}: {n_students} students, {n_questions} questions")
+    else:
+        print(profiles.studentProfile(int(sys.argv[2])).to_string(index=False))
@@ -0,0 +1,119 @@
+import time
+import numpy as np
+import pandas as pd
+import picata_pairing
+import picata_partners
+
+SESSION_HELP = """Commands:
+  add <id or name>      a student walked in: pair them without disturbing the other groups
+  remove <id or name>   a student left: re-match their partner only
+  pairs                 show the current groups
+  help                  show this list
+  done                  end the session"""
+
+
+class PairingSession:
+    """
+    Keeps the pairing of the students present in memory during class, so that students who walk in late
+    (or leave) are added to (or removed from) it without re-running the pair task: the existing groups are
+    kept, only the students affected are re-matched, and the pairing csv in data/ is rewritten.
+    """
+
+    def __init__(self, pica_quiz, roster, method='med'):
+        """ Start from the pairing of the students present in pica_quiz (after openPresentCSV); roster is the course's student dicts. """
+        self.pica_quiz = pica_quiz
+        self.method = method
+        self.names = dict(zip(pica_quiz.quiz_df['id'], pica_quiz.quiz_df['name']))
+        self.names.update({student['id']: student['name'] for student in roster})
+        pairings = pica_quiz.createStudentPairings(method=method, write_csv=True)
+        self.groups = [tuple(pairing[:-1]) for pairing in pairings]
+
+    def findStudent(self, query):
+        """ The id of the student given by id or by (part of) their name; raises ValueError unless exactly one matches. """
+        if query.strip().isdigit() and int(query) in self.names:
+            return int(query)
+        matches = [student_id for student_id, name in self.names.items() if query.strip().lower() in str(name).lower()]
+        if len(matches) != 1:
+            found = ', '.join(f"{self.names[m]} ({m})" for m in matches[:5]) if matches else 'nobody'
+            raise ValueError(f"'{query}' matches {found}")
+        return matches[0]
+
+    def present(self):
+        """ The ids of the students present. """
+        return set(self.pica_quiz.df_present['id'])
+
+    def update(self, df_present, change):
+        """ Set the students present, apply change(dists, index groups) to the groups and rewrite the pairing csv. """
+        pica_quiz = self.pica_quiz
+        pica_quiz.setPresentStudents(df_present)
+        pica_quiz.dist_matrix = pica_quiz.studentDistances(pica_quiz.df_quiz_scores_present)
+        ids = pica_quiz.dist_matrix.index
+        # (repeat partners are avoided as in createStudentPairings)
+        dists = np.nan_to_num(pica_quiz.dist_matrix.to_numpy()) - \
+            picata_partners.repeatPenalty(pica_quiz.repeatCounts(ids), pica_quiz.config.repeat_penalty)
+        groups = [tuple(int(k) for k in ids.get_indexer(group)) for group in self.groups]
+        changed = picata_pairing.improveGroups(dists, groups, change(dists, groups, ids))
+        self.groups = [tuple(ids[k] for k in group) for group in groups]
+        if all(len(group) > 1 for group in groups):
+            pica_quiz.writePairingsCSV(self.method, picata_pairing.groupsToPairings(pica_quiz.dist_matrix.to_numpy(), ids.tolist(), groups))
+        else:
+            print("Warning: a student is on their own, so the pairing csv was not rewritten and is out of date until someone is added")
+        return [self.groups[k] for k in changed]
+
+    def add(self, student_id):
+        """ Add a student to the pairing; returns the groups that changed, or None if the student is already present. """
+        if student_id in self.present():
+            return None
+        df_present = pd.concat([self.pica_quiz.df_present, pd.DataFrame({'name': [self.names[student_id]], 'id': [student_id], 'present': [1]})],
+                               ignore_index=True)
+        return self.update(df_present, lambda dists, groups, ids: picata_pairing.insertStudent(dists, groups, ids.get_loc(student_id)))
+
+    def remove(self, student_id):
+        """ Remove a student from the pairing; returns the groups that changed, or None if the student is not present. """
+        if student_id not in self.present():
+            return None
+        df_present = self.pica_quiz.df_present[self.pica_quiz.df_present['id'] != student_id]
+        # (the student is no longer in dist_matrix, so their position in the groups is -1)
+        return self.update(df_present, lambda dists, groups, ids: picata_pairing.removeStudent(dists, groups, -1))
+
+    def groupText(self, group):
+        """ One group as 'name (id), name (id)'. """
+        return ', '.join(f"{self.names.get(m, '?')} ({m})" for m in group)
+
+    def run(self):
+        """ Read commands until 'done' (or the end of input), rewriting the pairing csv after each change. """
+        print(f"\nLive pairing session: {len(self.present())} students present in {len(self.groups)} groups.")
+        print(SESSION_HELP)
+        while True:
+            try:
+                command, _, argument = input("\npairing> ").strip().partition(' ')
+            except EOFError:
+                break
+            if command in ['done', 'quit', 'exit']:
+                break
+            if command == 'pairs':
+                for group in self.groups:
+                    print("  " + self.groupText(group))
+                continue
+            if command not in ['add', 'remove'] or not argument:
+                print(SESSION_HELP)
+                continue
+            try:
+                student_id = self.findStudent(argument)
+            except ValueError as e:
+                print(f"  {e}")
+                continue
+            start = time.perf_counter()
+            changed = self.add(student_id) if command == 'add' else self.remove(student_id)
+            self.printChange(command, student_id, changed, time.perf_counter() - start)
+
+    def printChange(self, command, student_id, changed, seconds):
+        """ Show what an add or remove command changed (None if the student already was, or was not, present). """
+        if changed is None:
+            print(f"  {self.names[student_id]} is {'already' if command == 'add' else 'not'} present")
+        elif not changed:
+            print(f"  {len(self.present())} present; no group needed to change ({seconds:.3f}s, pairing csv rewritten)")
+        else:
+            print(f"  {len(self.present())} present; changed groups ({seconds:.3f}s, pairing csv rewritten):")
+            for group in changed:
+                print("    " + self.groupText(group))
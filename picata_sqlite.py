@@ -0,0 +1,32 @@
+import sqlite3
+from contextlib import closing, contextmanager
+import pandas as pd
+
+
+class SQLiteStore:
+    """
+    Base of the local SQLite files (the Canvas cache, the activity and pairing histories): every statement
+    runs in its own short connection, so a store can be shared by threads and by other processes (e.g.
+    batch workers) writing the same file, each waiting up to 30 seconds for the others' transactions.
+    """
+
+    def __init__(self, path):
+        """ Use the database file at path (created by the first statement if it does not exist). """
+        self.path = path
+
+    @contextmanager
+    def transaction(self):
+        """ A connection whose statements are committed together when the block ends (or rolled back on an exception). """
+        with closing(sqlite3.connect(self.path, timeout=30)) as db:
+            with db:
+                yield db
+
+    def execute(self, sql, params=()):
+        """ Run one statement in its own transaction and return all rows. """
+        with self.transaction() as db:
+            return db.execute(sql, params).fetchall()
+
+    def read(self, sql, params=()):
+        """ The result of a query as a dataframe. """
+        with closing(sqlite3.connect(self.path, timeout=30)) as db:
+            return pd.read_sql_query(sql, db, params=params)
@@ -1,16 +1,21 @@
 import os
+import json
 import re
 import sys
-import random
-import requests
 import time
+import numpy as np
 import pandas as pd
-import scipy.stats as stats
-import scipy.spatial.distance as distance
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-import seaborn as sbn
 from datetime import datetime
+import picata_activity
+import picata_bonus
+import picata_canvas
+import picata_distance
+import picata_figures
+import picata_largeclass
+import picata_montecarlo
+import picata_pairing
+import picata_partners
+import picata_profiles
 
 def selectFromList(paginated_list, item_type="item"):
     """
@@ -30,10 +35,24 @@ def selectFromList(paginated_list, item_type="item"):
 
     return subobject_list[int(str_index)]
 
-def selectCourse(canvas):
+
+def quizPrefix(title):
+    """ The prefix of the names of a quiz's output files, from its title (e.g. 'Quiz 3' -> 'quiz_3_'). """
+    return title.lower().replace(" ", "_") + "_"
+
+
+def optionValue(argv, option, default=None):
+    """ The command line value following option in argv (a string), or default if the option is not given. """
+    if option in argv and argv.index(option) + 1 < len(argv):
+        return argv[argv.index(option) + 1]
+    return default
+
+
+def selectCourse(canvas, cache):
     """
     Given a canvas instance object, display a list of courses and prompt
-    the user to select a course. The selected course is returned.
+    the user to select a course. The selected course is returned. The
+    list of courses is read from the local Canvas cache when possible.
 
     1. First prompt the user to choose between past or current courses.
     2. List the selected type of courses (past or current).
@@ -43,7 +62,7 @@ def selectCourse(canvas):
     current_courses = []
     current_date = datetime.now()
 
-    for course in canvas.get_courses():
+    for course in picata_canvas.getCourses(canvas, cache):
         try:
             course_name = course.name
 
@@ -95,7 +114,7 @@ def selectCourse(canvas):
     if course_index < 0 or course_index >= len(valid_courses):
         raise IndexError("Invalid course selection.")
 
-    return canvas.get_course(valid_courses[course_index].id)
+    return valid_courses[course_index]
 
 def sendMessage(canvas, pica_course, pairs):
     """
@@ -142,40 +161,32 @@ class PicaCourse:
     def __init__(self, canvas_course, config, verbose=False):
         """ Retrieve the selected course and get list of all students. """
         self.canvas_course = canvas_course
-        self.students = []
         self.verbose = verbose
-        student = None
-        for i, student in enumerate(self.canvas_course.get_enrollments()):
-            # Use print(f"dir(student): {dir(student)}") to see all attributes
-            if student.role == 'StudentEnrollment' and student.enrollment_state == 'active' and student.sis_user_id is not None:
-                student.user['total_activity_time'] = None
-                if hasattr(student, 'total_activity_time') and isinstance(student.total_activity_time, (int, float)):
-                    student.user['total_activity_time'] = student.total_activity_time
-                student.user['last_activity_at'] = None
-                if hasattr(student, 'last_activity_at') and isinstance(student.last_activity_at, (int, float)):
-                    student.user['last_activity_at'] = student.last_activity_at
-                self.students.append(student.user)
+        self.config = config
+        self.cache = picata_canvas.openCache(config)
+        self.students = picata_activity.activeStudents(picata_canvas.getEnrollments(self.canvas_course, self.cache))
         if verbose:
             print(self.students)
 
     def saveStudentActivity(self, data_path):
-        """ Get student activity from two sources and save to csv files """
-        student_summary_data = self.canvas_course.get_course_level_student_summary_data()
-        summ_acts = pd.DataFrame(columns=['id', 'page_views', 'missing', 'late'])
-        for s in student_summary_data:
-            summ_acts.loc[len(summ_acts)] = [s.id, s.page_views, s.tardiness_breakdown['missing'], s.tardiness_breakdown['late']]
+        """
+        Get student activity from two sources and add what changed since the last run to the activity
+        history (data/activity_history.sqlite); the dated csv files are only written if config.activity_csv is set.
+        """
+        summ_acts = picata_activity.summaryFrame(picata_activity.getStudentSummaries(self.canvas_course))
+        acts = picata_activity.studentFrame(self.students)
+
+        # do an outer join of summ_acts and acts on 'id' column and record it in the history
+        merged_acts = picata_activity.mergeActivity(summ_acts, acts)
+        n_changed = picata_activity.openHistory(self.config).record(merged_acts.assign(course_id=self.canvas_course.id))
+        print(f"Recorded activity changes of {n_changed} of {len(merged_acts)} students in {self.config.activity_history_path}")
+        if not self.config.activity_csv:
+            return
+
         summ_activity_csv = data_path + "course_activity_partA_" + datetime.today().strftime('%Y%m%d') + ".csv"
         summ_acts.to_csv(summ_activity_csv, index=False)
-
-        acts = pd.DataFrame(columns=['name', 'id', 'total_activity_mins', 'last_activity_at'])
-        for s in self.students:
-            acts.loc[len(acts)] = [s['name'], s['id'], s['total_activity_time'] / 60.0, s['last_activity_at']]
         activity_csv = data_path + "course_activity_partB_" + datetime.today().strftime('%Y%m%d') + ".csv"
         acts.to_csv(activity_csv, index=False)
-
-        # do an outer join of summ_acts and acts on 'id' column and save to csv file
-        merged_acts = pd.merge(summ_acts, acts, on='id', how='outer')
-        merged_acts = merged_acts[['name', 'id', 'page_views', 'missing', 'late', 'total_activity_mins', 'last_activity_at']]
         merged_acts_csv = data_path + "course_activity_both_" + datetime.today().strftime('%Y%m%d') + ".csv"
         merged_acts.to_csv(merged_acts_csv, index=False)
 
@@ -189,17 +200,22 @@ class PicaQuiz:
         self.canvas_quiz = canvas_quiz
         self.verbose = verbose
         self.config = config
-        self.config.quiz_prefix = self.canvas_quiz.title.lower().replace(" ", "_") + "_"
+        self.config.quiz_prefix = quizPrefix(self.canvas_quiz.title)
+        self.cache = picata_canvas.openCache(config)
         self.quiz_df = None
         self.n_students = None
         self.question_stats = None
         self.dist_matrix = None
+        self.distances = None  # DistanceStore of the whole class (by score pattern), from which dist_matrix is taken
+        self.history = None  # scores of recent quizzes from the profile store (with config.history_window)
+        self.large_class = None  # (scores, distance type) of students paired without dist_matrix (see config.large_class_students)
+        self.submissions = None  # loaded by getSubmissions() when first needed
         self.quiz_questions = []  # Can later get text for kth question using quiz_question[k].question_text
 
         if self.verbose:
             print(f"Quiz title: {self.canvas_quiz.title}")
 
-        for i, quest in enumerate(canvas_quiz.get_questions()):
+        for i, quest in enumerate(picata_canvas.getQuizQuestions(canvas_quiz, self.cache)):
             self.quiz_questions.append(quest)
             if verbose:
                 print(f"Question {i}: {quest}")
@@ -207,51 +223,30 @@ class PicaQuiz:
         self.getQuizData()
 
     def getQuizData(self):
-        """ Download student_analysis csv quiz report. """
-        quiz_report_request = self.canvas_quiz.create_report('student_analysis')
-        request_id = quiz_report_request.progress_url.split('/')[-1]
-        if self.verbose:
-            print("type(quiz_report_request) = ", type(quiz_report_request))
-            print("quiz_report_request.__dict__ = ", quiz_report_request.__dict__)
-
-        quiz_report_progress = self.canvas.get_progress(request_id)
-        while quiz_report_progress.workflow_state != 'completed':
-            #print(f"  report progress: {quiz_report_progress.completion}% completed")
-            self.progressBar(quiz_report_progress.completion, 100)
-            time.sleep(0.1)
-            quiz_report_progress = self.canvas.get_progress(request_id)
-        self.progressBar(quiz_report_progress.completion, 100)
-        print("\nQuiz download complete!")
-
-        quiz_report = self.canvas_quiz.get_quiz_report(quiz_report_request)
-        quiz_csv_url = quiz_report.file['url']
-        quiz_csv = requests.get(quiz_csv_url)
-        csv_name = self.config.data_path + self.config.quiz_prefix + str(self.canvas_quiz.id) + "_" + \
-            datetime.today().strftime('%Y%m%d') + "_student_analysis.csv"
-
-        csv = open(csv_name, 'wb')
-        for content in quiz_csv.iter_content(chunk_size=2**20):
-            if content:
-                csv.write(content)
-        csv.close()
-
-        self.quiz_df = pd.read_csv(csv_name)
-
-        # rename columns to be shorter, cleaner, and with question_id as a column
-        for old_col_name in self.quiz_df.columns:
-            new_col_name = old_col_name.split(':')[0].replace(' ', '_').replace('.', '_')
-            self.quiz_df.rename(columns={old_col_name: new_col_name}, inplace=True)
-
-        for i, col in enumerate(self.quiz_df.columns):
-            if col in self.quiz_question_ids:
-                next_col = self.quiz_df.columns[i + 1]
-                next_col_new_name = col + '_score'
-                self.quiz_df.rename(columns={next_col: next_col_new_name}, inplace=True)
-                self.quiz_df[next_col_new_name].apply(pd.to_numeric)
+        """ Download and parse student_analysis csv quiz report (unless a cached copy is still up to date). """
+        # the cached report is only used if no submission has been made, and no score or fudge points changed
+        # (regrades, bonus points), since it was downloaded
+        report_key = f"courses/{self.canvas_quiz.course_id}/quizzes/{self.canvas_quiz.id}/reports/student_analysis"
+        latest_submission = self.latestSubmission()
+        report_version = self.getSubmissions().version()
+        cached_report = self.cache.get('report', report_key, report_version)
+        if cached_report is None:
+            self.quiz_df = self.downloadQuizReport(latest_submission)
+            self.cache.put('report', report_key, picata_canvas.frameToJSON(self.quiz_df), report_version)
+        else:
+            self.quiz_df = picata_canvas.frameFromJSON(cached_report)
+        self.distances = None
+        self.history = None
+
+        # add the scores to the cross-quiz profile store (used for distances over recent quizzes)
+        quiz_time = getattr(self.canvas_quiz, 'due_at', None) or latest_submission or datetime.now().strftime('%Y-%m-%dT%H:%M:%SZ')
+        picata_profiles.openProfiles(self.config).update(self.quiz_df, self.quiz_question_ids, self.canvas_quiz.id,
+                                                         self.canvas_quiz.course_id, quiz_time)
 
         self.n_students = self.quiz_df.shape[0]
 
         # dictionary w/ question id as key and summary stats for each question
+        import scipy.stats as stats
         self.question_stats = dict()
         for q in self.quiz_question_ids:
             score_col = q + '_score'
@@ -267,6 +262,85 @@ class PicaQuiz:
             for key, val in self.question_stats.items():
                 print("key =", key, "->", val)
 
+    def findFreshReport(self, latest_submission):
+        """
+        The latest student_analysis report Canvas already has, if it was generated after latest_submission (the
+        time of the latest submission, see latestSubmission). Reports without a time are skipped, since they
+        cannot be shown to be fresh.
+        """
+        fresh_reports = [report for report in self.canvas_quiz.get_all_quiz_reports()
+                         if report.report_type == 'student_analysis' and not getattr(report, 'includes_all_versions', False) and
+                         getattr(report, 'file', None) and report.file.get('url')]
+        generated = [(picata_canvas.parseCanvasTime(report.file.get('created_at') or getattr(report, 'updated_at', None)), report)
+                     for report in fresh_reports]
+        generated = [(generated_at, report) for generated_at, report in generated if generated_at is not None]
+        if not generated:
+            return None
+        newest_time, newest = max(generated, key=lambda item: item[0])
+        if latest_submission and newest_time < picata_canvas.parseCanvasTime(latest_submission):
+            return None
+        return newest
+
+    def downloadQuizReport(self, latest_submission=None):
+        """
+        Return the student_analysis report as a dataframe, parsed as it downloads. A report that Canvas
+        generated after the latest submission is downloaded directly, otherwise Canvas is asked to
+        generate a new one. The raw csv is only saved in data/ if config.archive_reports is set.
+        Without latest_submission, the submissions are downloaded to find it (see latestSubmission).
+        """
+        timings = {'lookup': 0.0, 'generation': 0.0, 'polling': 0.0, 'download': 0.0}
+        start = time.perf_counter()
+        if latest_submission is None:
+            latest_submission = self.latestSubmission()
+        quiz_report = self.findFreshReport(latest_submission)
+        timings['lookup'] = time.perf_counter() - start
+
+        if quiz_report is None:
+            start = time.perf_counter()
+            quiz_report_request = self.canvas_quiz.create_report('student_analysis')
+            request_id = quiz_report_request.progress_url.split('/')[-1]
+            if self.verbose:
+                print("type(quiz_report_request) = ", type(quiz_report_request))
+                print("quiz_report_request.__dict__ = ", quiz_report_request.__dict__)
+            timings['generation'] = time.perf_counter() - start
+
+            start = time.perf_counter()
+            picata_canvas.pollProgress(self.canvas, request_id, callback=lambda progress: self.progressBar(progress.completion or 0, 100))
+            quiz_report = self.canvas_quiz.get_quiz_report(quiz_report_request)
+            timings['polling'] = time.perf_counter() - start
+            print("\nQuiz download complete!")
+        else:
+            print("\nReusing the quiz report Canvas generated after the latest submission")
+
+        archive_path = None
+        if self.config.archive_reports:
+            archive_path = self.config.data_path + self.config.quiz_prefix + str(self.canvas_quiz.id) + "_" + \
+                datetime.today().strftime('%Y%m%d') + "_student_analysis.csv"
+        start = time.perf_counter()
+        quiz_df = picata_canvas.downloadQuizReport(quiz_report.file['url'], self.quiz_question_ids, archive_path)
+        timings['download'] = time.perf_counter() - start
+
+        self.report_timings = timings
+        print("Quiz report time: " + ", ".join(f"{step} {seconds:.1f}s" for step, seconds in timings.items()))
+        return quiz_df
+
+    def getSubmissions(self):
+        """
+        Snapshot (picata_canvas.SubmissionsSnapshot) of the latest submission of each student for this quiz,
+        downloaded once (never read from the local Canvas cache) and shared by every stage.
+        """
+        if self.submissions is None:
+            self.submissions = picata_canvas.getSubmissionsSnapshot(self.canvas_quiz)
+        return self.submissions
+
+    def latestSubmission(self):
+        """ Time the latest submission was finished, from the submissions as they are in Canvas (see getSubmissions). """
+        return self.getSubmissions().latestFinish()
+
+    def refreshSubmissions(self):
+        """ Drop the submissions snapshot after writing to Canvas, so the next read downloads them again. """
+        self.submissions = None
+
     def progressBar(self, current, total, bar_length=20):
         """ Displays or updates a console progress bar. """
         progress = current / total
@@ -277,64 +351,58 @@ class PicaQuiz:
         sys.stdout.flush()
 
     def generateQuestionHistograms(self):
-        """ Draw a histogram of scores of each question. """
-        mpl.style.use('seaborn-v0_8')
-        figure, axis = plt.subplots(1, len(self.quiz_question_ids), sharey=True)
-        figure.set_size_inches(13, 3)
-        for i, q in enumerate(self.quiz_question_ids):
-            score_col = q + '_score'
-            axis[i].hist(self.quiz_df[score_col], bins=6, facecolor='#00447c', edgecolor='black', alpha=0.8)
-            axis[i].set_xlabel('score')
-            axis[i].set_title('question: ' + q.split('_')[0])
-        axis[0].set_ylabel('# of people')
-        plt.tight_layout()  # Or try plt.subplots_adjust(left=0.05, right=0.98, bottom=0.15, top=0.9)
-        figure.savefig(self.config.figures_path + self.config.quiz_prefix + str(self.canvas_quiz.id) + "_" +
-                       datetime.today().strftime('%Y%m%d') + "_histograms.png", dpi=200)
-        plt.close('all')
+        """ Draw a histogram of scores of each question (unless 'histograms' is not in config.figures). """
+        if 'histograms' not in self.config.figures:
+            return
+        scores_by_question = {q: self.quiz_df[q + '_score'].to_numpy() for q in self.quiz_question_ids}
+        picata_figures.render(self.config, picata_figures.drawHistograms, scores_by_question,
+                              self.config.figures_path + self.config.quiz_prefix + str(self.canvas_quiz.id) + "_" +
+                              datetime.today().strftime('%Y%m%d') + "_histograms.png")
 
     def generateDistanceMatrix(self, only_present, distance_type='euclid'):
-        """ Calculate vector distance between all possible student pairs. """
-        quiz_df_local = self.df_quiz_scores_present.copy() if only_present else self.quiz_df.copy()
-        student_ids = list(quiz_df_local['id'])
-        student_ids.sort()
-        self.dist_matrix = pd.DataFrame(0.0, columns=student_ids, index=student_ids)
-
-        for i, id1 in enumerate(student_ids):
-            x = quiz_df_local.loc[quiz_df_local.id == id1, quiz_df_local.columns.str.endswith('_score')].to_numpy().flatten()
-            x = [0.0 if pd.isna(val) else val for val in x]
-            if self.verbose:
-                print(id1, "values =", x)
-            for j, id2 in enumerate(student_ids):
-                if i < j:
-                    y = quiz_df_local.loc[quiz_df_local.id == id2, quiz_df_local.columns.str.endswith('_score')].to_numpy().flatten()
-                    y = [0.0 if pd.isna(val) else val for val in y]
-                    if self.verbose:
-                        print(id2, "    values =", y)
-                    if distance_type == 'euclid':
-                        dist = distance.euclidean(x, y)
-                    elif distance_type == 'cosine':
-                        dist = distance.cosine(x, y)
-                    if dist == 0:
-                        dist = 1E-4
-                    #self.dist_matrix.loc[id1][id2] = dist # this won't work with pandas v3
-                    self.dist_matrix.loc[id1, id2] = dist
-                    self.dist_matrix.loc[id2, id1] = dist
-
-        mpl.style.use('seaborn-v0_8')
-        plt.figure(figsize=(16, 16))
-        sbn.heatmap(
-            self.dist_matrix,
-            square=True,
-            cmap="YlGnBu",
-            linewidth=0.5,
-            annot=True,
-            cbar=False
-        )
-        plt.tight_layout()
-        plt.rc('font', size=9)
-        plt.savefig(self.config.figures_path + self.config.quiz_prefix + str(self.canvas_quiz.id) + "_" +
-                    datetime.today().strftime('%Y%m%d') + "_dist_" + distance_type + ".png", dpi=200)
-        plt.close()
+        """
+        Calculate vector distance between all possible student pairs (and draw them as a heatmap if 'distance' is in
+        config.figures). The distances of the whole class are computed once; those of the students present are taken from them.
+        """
+        quiz_df_local = self.df_quiz_scores_present if only_present else self.quiz_df
+        if len(quiz_df_local) > self.config.large_class_students:
+            print(f"\n{len(quiz_df_local)} students: pairing them approximately, without a distance matrix")
+            self.dist_matrix = None
+            self.large_class = (self.distanceScores(quiz_df_local), distance_type)
+            return
+        self.large_class = None
+        self.dist_matrix = self.studentDistances(quiz_df_local, distance_type)
+        if self.verbose:
+            print(self.dist_matrix)
+        if 'distance' not in self.config.figures:
+            return
+        picata_figures.renderHeatmap(self.config, self.dist_matrix,
+                                     self.config.figures_path + self.config.quiz_prefix + str(self.canvas_quiz.id) + "_" +
+                                     datetime.today().strftime('%Y%m%d') + "_dist_" + distance_type + ".png")
+
+    def studentDistances(self, quiz_df_local, distance_type='euclid'):
+        """
+        Distance matrix of the students of quiz_df_local, taken from the distances of the whole class (computed once),
+        or computed for these students only if the whole class has more than config.large_class_students.
+        """
+        if len(self.quiz_df) > self.config.large_class_students:
+            return picata_distance.distanceMatrix(self.distanceScores(quiz_df_local), distance_type)
+        if self.distances is None or self.distances.distance_type != distance_type:
+            self.distances = picata_distance.DistanceStore(self.distanceScores(self.quiz_df), distance_type)
+        return self.distances.matrix(self.distanceScores(quiz_df_local))
+
+    def distanceScores(self, quiz_df_local):
+        """
+        The students of quiz_df_local with the '_score' columns their distances are computed over: this quiz's, or
+        with config.history_window, those of this quiz and that many earlier quizzes of the course from the profile
+        store, each weighted by config.history_decay per quiz back.
+        """
+        if not self.config.history_window:
+            return quiz_df_local
+        if self.history is None:
+            self.history = picata_profiles.openProfiles(self.config).historyFrame(
+                self.canvas_quiz.course_id, self.canvas_quiz.id, self.config.history_window, self.config.history_decay)
+        return pd.merge(quiz_df_local[['name', 'id']], self.history, on='id', how='left')
 
     def openPresentCSV(self, csv_path=None):
         """ Prompt user for a local CSV file and return a pandas dataframe. """
@@ -358,13 +426,17 @@ class PicaQuiz:
 
         # Open the file and remove those that are not present today, then return this dataframe.
         df_present_all = pd.read_csv(csv_path + present_csvs[int(csv_index)])
-        self.df_present = df_present_all[df_present_all['present'] == 1]
+        self.setPresentStudents(df_present_all[df_present_all['present'] == 1])
         print(f"  *** (double check there are {len(self.df_present)} students present today) ***")
 
+    def setPresentStudents(self, df_present):
+        """ Set the students present (a dataframe with name and id columns) and their quiz scores (zero if they missed the quiz). """
+        self.df_present = df_present
         self.df_quiz_scores_present = pd.merge(self.df_present[['name', 'id']], self.quiz_df, how='left')  # on=['name','id'])
-        # replace missing vals with zero (for people who missed pre-quiz)
+        # replace missing vals with zero (for people who missed pre-quiz); categorical report columns (section) are left as they are
+        filled = self.df_quiz_scores_present.select_dtypes(exclude='category').columns
         with pd.option_context("future.no_silent_downcasting", True):
-            self.df_quiz_scores_present = self.df_quiz_scores_present.fillna(0).infer_objects(copy=False)
+            self.df_quiz_scores_present[filled] = self.df_quiz_scores_present[filled].fillna(0).infer_objects(copy=False)
         if self.verbose:
             print(f"self.df_quiz_scores_present.columns = {self.df_quiz_scores_present.columns}")
         assert len(self.df_quiz_scores_present) == len(self.df_present)
@@ -376,8 +448,8 @@ class PicaQuiz:
             csv_path = self.config.data_path
         print("\nCSV Options:")
 
-        # List all files in current directory that contain the string: 'pairing'.
-        pastpairs_csvs = [f for f in os.listdir(csv_path) if 'pairing' in f]
+        # List all csv files in current directory that contain the string: 'pairing'.
+        pastpairs_csvs = [f for f in os.listdir(csv_path) if 'pairing' in f and f.endswith('.csv')]
         pastpairs_csvs.sort()
         for i, f in enumerate(pastpairs_csvs):
             fstring = f"[ {i:2d} ] {f}" if len(pastpairs_csvs) > 10 else f"[ {i} ] {f}"
@@ -393,16 +465,11 @@ class PicaQuiz:
         # Open the file and return the dataframe
         self.df_past_pairings = pd.read_csv(csv_path + pastpairs_csvs[int(csv_index)])
 
-        # Get list of students who were paired in the past and put into long format
-        paired_students1 = self.df_past_pairings[['person1', 'id1']].copy()
-        paired_students1.rename(columns={'person1': 'name', 'id1': 'id'}, inplace=True)
-        paired_students2 = self.df_past_pairings[['person2', 'id2']].copy()
-        paired_students2.rename(columns={'person2': 'name', 'id2': 'id'}, inplace=True)
-        paired_students3 = self.df_past_pairings[['person3', 'id3']].copy()
-        paired_students3.rename(columns={'person3': 'name', 'id3': 'id'}, inplace=True)
-
-        # Get columns person2, id2, from df_past_pairings and append these rows to paired_students
-        paired_students = pd.concat([paired_students1, paired_students2, paired_students3], ignore_index=True)
+        # Get list of students who were paired in the past (in groups of any size) and put into long format
+        paired_students = pd.concat([self.df_past_pairings[[person, id_col]].set_axis(['name', 'id'], axis=1)
+                                     for person, id_col in zip(picata_bonus.memberColumns(self.df_past_pairings, 'person'),
+                                                               picata_bonus.memberColumns(self.df_past_pairings, 'id'))],
+                                    ignore_index=True)
 
         # Remove any rows with NaN or -1 values, and reset index
         paired_students.dropna(inplace=True)
@@ -434,57 +501,22 @@ class PicaQuiz:
         # Open the file and return the dataframe
         self.df_past_bonus = pd.read_csv(csv_path + pastbonus_csvs[int(csv_index)])
 
-    def createStudentPairings(self, method='med', write_csv=True):
-        """ Generate student pairings using one of several methods, but not saved unless write_csv is True. """
-        dm = self.dist_matrix.copy()
-        pairings = []
-
-        while dm.shape[0] > 2:
-
-            # retrieve max entry in each column/row and corresponding index
-            # (note that indices and columns are canvas student ids)
-            col_maximums = dm.max()
-            col_max_indices = dm.idxmax()
-
-            # 'max' is a greedy approach taking largest pair difference first
-            if method == 'max':
-                person_A = col_maximums.idxmax()
-            # 'med' is median difference and generally leads to highest mean diff and lowest variance
-            elif method == 'med':
-                col_maximums.sort_values(inplace=True)
-                person_A = col_maximums.index[len(col_maximums) // 2]
-            # 'min' uses conservative approach by taking min pair difference (among maxes) but often leads to high var
-            elif method == 'min':
-                person_A = col_maximums.idxmin()
-            elif method == 'rand':
-                people = list(dm.index)
-                random.shuffle(people)
-                person_A = people[0]
-                person_B = people[1]
-                pairings.append((person_A, person_B, dm.loc[person_A, person_B]))
-            else:
-                raise ValueError("vectorDistancePairings(): invalid method")
-
-            if method != 'rand':
-                person_B = col_max_indices[person_A]
-                pairings.append((person_A, person_B, col_maximums[person_A]))
-
-            dm.drop(index=person_A, axis=0, inplace=True)
-            dm.drop(person_A, axis=1, inplace=True)
-            dm.drop(index=person_B, axis=0, inplace=True)
-            dm.drop(person_B, axis=1, inplace=True)
-
-            assert dm.shape[0] == dm.shape[1]
-
-        # only two people left in dm so they must be paired together
-        if dm.shape[0] == 2:
-            pairings.append((dm.index[0], dm.index[1], dm.iat[0, 1]))
-        # only one person left in dm so add them to the last pair that was created and use max distance among the three 3c2 possible distances among them
+    def createStudentPairings(self, method='med', write_csv=True, group_size=None):
+        """
+        Generate student pairings using one of several methods, but not saved unless write_csv is True. With a
+        group_size (default: config.group_size) above 2 the students are split into diverse groups of that size
+        instead, and the method is 'groups_of_<k>'.
+        """
+        if self.large_class is not None:
+            return self.createApproximatePairings(method, write_csv)
+        group_size = group_size or self.config.group_size
+        repeats = self.repeatCounts(self.dist_matrix.index)
+        penalty = picata_partners.repeatPenalty(repeats, self.config.repeat_penalty)
+        if group_size > 2:
+            method = f"groups_of_{group_size}"
+            pairings = picata_pairing.studentGroups(self.dist_matrix, group_size, penalty)
         else:
-            assert dm.shape == (1, 1)
-            temp_tuple = pairings[-1]
-            pairings[-1] = (temp_tuple[0], temp_tuple[1], dm.index[0],
-                            max(temp_tuple[2], self.dist_matrix.loc[temp_tuple[0], dm.index[0]], self.dist_matrix.loc[temp_tuple[1], dm.index[0]]))
+            pairings = picata_pairing.studentPairings(self.dist_matrix, method, penalty)
 
         if self.verbose:
             print("Pairings:")
@@ -499,149 +531,206 @@ class PicaQuiz:
             print(f"    mean(pair distances) = {mean_pair_dist}")
             print(f"     var(pair distances) = {var_pair_dist}")
 
+        if write_csv:
+            if self.config.repeat_penalty:
+                print(f"  {picata_partners.repeatPartners(repeats, self.dist_matrix.index, pairings)} repeat partners in the {method} pairing")
+            self.writePairingsCSV(method, pairings)
+        return pairings
+
+    def createApproximatePairings(self, method='med', write_csv=True):
+        """
+        Pair the students of a large class (see generateDistanceMatrix) by score pattern, without a distance matrix
+        (see picata_largeclass); groups of more than two and repeat-partner avoidance need the matrix, so are not made.
+        """
+        scores_df, distance_type = self.large_class
+        if self.config.group_size > 2 or self.config.repeat_penalty:
+            print("  (groups and repeat-partner avoidance need a distance matrix, so plain pairs are made)")
+        ids, scores = picata_distance.scoreMatrix(scores_df)
+        pairings = picata_largeclass.approximatePairings(ids.tolist(), scores, method, distance_type)
         if write_csv:
             self.writePairingsCSV(method, pairings)
         return pairings
 
+    def reportApproximateQuality(self, method='med', samples=3, sample_size=1000):
+        """ Print the mean pair distance of approximate and exact pairing of random samples of a large class. """
+        scores_df, distance_type = self.large_class
+        quality = picata_largeclass.sampleQuality(picata_distance.scoreMatrix(scores_df)[1], method, distance_type, samples, sample_size)
+        print(f"\nApproximate ('{method}') against exact pairing of {samples} samples of {quality['students'].iloc[0]} students (mean pair distance):")
+        print(quality.to_string(index=False, float_format=lambda x: f"{x:.3f}"))
+        return quality
+
+    def repeatCounts(self, ids):
+        """
+        Number of times each two of the students ids were grouped in an earlier session of the course (the last
+        config.repeat_sessions), from the pairing history; all zero unless config.repeat_penalty is set.
+        """
+        if not self.config.repeat_penalty:
+            return np.zeros((len(ids), len(ids)))
+        return picata_partners.openPairingHistory(self.config).repeatCounts(
+            ids, self.canvas_quiz.course_id, self.config.repeat_sessions, exclude=(self.canvas_quiz.id, datetime.today().strftime('%Y%m%d')))
+
     def comparePairingMethods(self):
-        """ Compare the median, max, min, and rand methods of pairing students. """
-        pairs_med = self.createStudentPairings(method='med', write_csv=False)
-        pairs_max = self.createStudentPairings(method='max', write_csv=False)
-        pairs_min = self.createStudentPairings(method='min', write_csv=False)
-        pairs_rand = self.createStudentPairings(method='rand', write_csv=False)
-        pairs_med_distances = pd.Series([x[-1] for x in pairs_med])
-        pairs_max_distances = pd.Series([x[-1] for x in pairs_max])
-        pairs_min_distances = pd.Series([x[-1] for x in pairs_min])
-        pairs_rand_distances = pd.Series([x[-1] for x in pairs_rand])
-
-        plt.figure(edgecolor='black')
-        fig, axes = plt.subplots(1, 4, figsize=(20, 4))
-        fig.patch.set_facecolor('white')
-        bin_breaks = [x / 2 for x in range(0, (8 + 1))]
-        pairs_med_distances.hist(bins=bin_breaks, ax=axes[0], edgecolor='black')
-        pairs_max_distances.hist(bins=bin_breaks, ax=axes[1], edgecolor='black')
-        pairs_min_distances.hist(bins=bin_breaks, ax=axes[2], edgecolor='black')
-        pairs_rand_distances.hist(bins=bin_breaks, ax=axes[3], edgecolor='black')
-        axes[0].set_xlabel('Pairing via: Median-Max Approach')
-        axes[1].set_xlabel('Max-Max Approach')
-        axes[2].set_xlabel('Min-Max Approach')
-        axes[3].set_xlabel('Randomized Pairs')
-        axes[1].set_ylim(0, 9)
-        axes[0].set_ylim(0, 9)
-        axes[2].set_ylim(0, 9)
-        axes[3].set_ylim(0, 9)
-        axes[0].set_ylabel('# of Student Pairs')
-        plt.tight_layout()
-        plt.savefig(self.config.figures_path + self.config.quiz_prefix + str(self.canvas_quiz.id) +
-                    "_compare_pairing_methods_" + datetime.today().strftime('%Y%m%d') + ".png", dpi=200)
-        plt.close()
+        """
+        Compare the median, max, min, rand, and optimal methods of pairing students (with a figure if 'pairing' is in config.figures),
+        or for a large class, approximate and exact pairing on samples of the class.
+        """
+        if self.large_class is not None:
+            self.reportApproximateQuality()
+            return
+        pairs_med = self.createStudentPairings(method='med', write_csv=False, group_size=2)
+        pairs_max = self.createStudentPairings(method='max', write_csv=False, group_size=2)
+        pairs_min = self.createStudentPairings(method='min', write_csv=False, group_size=2)
+        pairs_rand = self.createStudentPairings(method='rand', write_csv=False, group_size=2)
+        pairs_opt = self.createStudentPairings(method='optimal', write_csv=False, group_size=2)
+        pairings_by_method = {'med': pairs_med, 'max': pairs_max, 'min': pairs_min, 'rand': pairs_rand, 'optimal': pairs_opt}
+        self.reportPairingQuality(pairings_by_method)
+        if self.config.pairing_draws:
+            self.evaluatePairingMethods(pairings_by_method, self.config.pairing_draws)
+        if 'pairing' not in self.config.figures:
+            return
+
+        distances_by_method = {
+            'Pairing via: Median-Max Approach': [x[-1] for x in pairs_med],
+            'Max-Max Approach': [x[-1] for x in pairs_max],
+            'Min-Max Approach': [x[-1] for x in pairs_min],
+            'Randomized Pairs': [x[-1] for x in pairs_rand],
+            'Optimal Matching': [x[-1] for x in pairs_opt],
+        }
+        picata_figures.render(self.config, picata_figures.drawPairingComparison, distances_by_method,
+                              self.config.figures_path + self.config.quiz_prefix + str(self.canvas_quiz.id) +
+                              "_compare_pairing_methods_" + datetime.today().strftime('%Y%m%d') + ".png")
+
+    def evaluatePairingMethods(self, pairings_by_method, draws, seed=0):
+        """
+        Compare the pairing methods with draws random pairings (drawn in parallel): print the distribution of the
+        mean and variance of pair distance of each method and save it as json in data/. Returns the evaluation dict.
+        """
+        start = time.perf_counter()
+        evaluation = picata_montecarlo.evaluatePairingMethods(self.dist_matrix.to_numpy(), pairings_by_method, draws, seed)
+        evaluation['quiz_id'] = self.canvas_quiz.id
+        print(f"\nPair distance by method, against {draws} random pairings ({time.perf_counter() - start:.1f}s):")
+        print(picata_montecarlo.evaluationTable(evaluation))
+        evaluation_json = self.config.data_path + self.config.quiz_prefix + str(self.canvas_quiz.id) + \
+            "_pairing_evaluation_" + datetime.today().strftime('%Y%m%d') + ".json"
+        with open(evaluation_json, 'w') as f:
+            json.dump(evaluation, f, indent=2)
+        return evaluation
+
+    def reportPairingQuality(self, pairings_by_method):
+        """ Print the total pair distance of each method as a percentage of an upper bound on the optimum. """
+        upper_bound = picata_pairing.matchingUpperBound(self.dist_matrix.to_numpy())
+        print(f"\nTotal pair distance by method (upper bound on optimum = {upper_bound:.3f}):")
+        for method, pairs in pairings_by_method.items():
+            # only the first two students of a group of three were paired intentionally
+            total = sum(self.dist_matrix.loc[pair[0], pair[1]] for pair in pairs)
+            print(f"  {method:>7}: {total:9.3f} ({100 * total / upper_bound:5.1f}% of bound)")
 
     def writePairingsCSV(self, method, pairs):
-        """ Create an output csv file in data/ with the given student pairings. """
-        df = self.df_quiz_scores_present.copy()
-        name1 = []
-        name2 = []
-        name3 = []
-        person1 = []
-        person2 = []
-        person3 = []
-
-        for i, pair in enumerate(pairs):
-            name1.append(df.name[df.id == pair[0]].to_string(index=False))
-            name2.append(df.name[df.id == pair[1]].to_string(index=False))
-            person1.append(pair[0])
-            person2.append(pair[1])
-
-            # Only needed for 3-tuple groups since there are 3 possible distances.
-            # Note that when there are 3 the first distance is used since first two people were paired intentionally.
-            if len(pair) == 2 + 1:
-                dists = (self.dist_matrix.loc[pair[0], pair[1]], -1, -1)
-            else:
-                dists = (self.dist_matrix.loc[pair[0], pair[1]], self.dist_matrix.loc[pair[0], pair[2]], self.dist_matrix.loc[pair[1], pair[2]])
-
-            if self.verbose:
-                print(f"pair = {pair}, dists = {dists}")
-
-            if len(pair) == 2 + 1:
-                name3.append(None)
-                person3.append(-1)
-                # print(f"    2-tuple {i+1:2.0f}: {df.name[df.id == pair[0]].to_string(index=False)}, {df.name[df.id == pair[1]].to_string(index=False)}")
-            if len(pair) == 3 + 1:
-                name3.append(df.name[df.id == pair[2]].to_string(index=False))
-                person3.append(pair[2])
-                if self.verbose:
-                    print(f"    3-tuple {i+1:2.0f}: {df.name[df.id == pair[0]].to_string(index=False)}, \
-                          {df.name[df.id == pair[1]].to_string(index=False)}, {df.name[df.id == pair[2]].to_string(index=False)}")
-                if self.verbose:
-                    print(f"p1, p2, dist = {(pair[0], pair[1], self.dist_matrix.loc[pair[0], pair[1]])}")
-                    print(f"p1, p3, dist = {(pair[0], pair[2], self.dist_matrix.loc[pair[0], pair[2]])}")
-                    print(f"p2, p3, dist = {(pair[1], pair[2], self.dist_matrix.loc[pair[1], pair[2]])}")
-
-        df_pairs = pd.DataFrame({'person1': name1, 'person2': name2, 'person3': name3,
-                                 'id1': person1, 'id2': person2, 'id3': person3, 'distance': [x[-1] for x in pairs]})
+        """
+        Create an output csv file in data/ with the given student pairings (or groups): one row per group with
+        columns person1..personk, id1..idk for the largest group (at least three, None and -1 for a missing
+        member) and the group's distance, the largest between any two of its members. The groups are also
+        recorded in the pairing history (replacing those written earlier today for this quiz).
+        """
+        df = self.df_quiz_scores_present
+        names = dict(zip(df.id, df.name))
+        width = max([3] + [len(pair) - 1 for pair in pairs])
+        members = [list(pair[:-1]) + [-1] * (width + 1 - len(pair)) for pair in pairs]
+
+        if self.verbose and self.dist_matrix is not None:
+            for i, pair in enumerate(pairs):
+                dists = [self.dist_matrix.loc[a, b] for j, a in enumerate(pair[:-1]) for b in pair[j + 1:-1]]
+                print(f"    group {i + 1:2d}: {', '.join(names[m] for m in pair[:-1])}, dists = {dists}")
+
+        columns = {f"person{j + 1}": [names[group[j]] if group[j] != -1 else None for group in members] for j in range(width)}
+        columns.update({f"id{j + 1}": [group[j] for group in members] for j in range(width)})
+        df_pairs = pd.DataFrame(columns)
+        df_pairs['distance'] = [x[-1] for x in pairs]
         pairs_csv = self.config.data_path + self.config.quiz_prefix + str(self.canvas_quiz.id) + \
             "_pairing_via_" + method + "_" + datetime.today().strftime('%Y%m%d') + ".csv"
         df_pairs.to_csv(pairs_csv, index=False)
-
-    def checkForBonusEarned(self, bonus_amount=0.2):
-        """ Check if any students have a distance of 0 with their partner. """
+        picata_partners.openPairingHistory(self.config).record(
+            self.canvas_quiz.course_id, self.canvas_quiz.id, datetime.today().strftime('%Y%m%d'), members)
+
+    def checkForBonusEarned(self, bonus_amount=0.2, rule=None):
+        """
+        Check which groups of the past pairings earned the bonus (by default, those whose members all have a
+        distance of 0 from each other), and set the 'bonus' of each paired student. A picata_bonus.BonusRule
+        can be given to change the threshold, scale the bonus by partial agreement, or weight the questions.
+        """
+        if rule is None:
+            rule = picata_bonus.BonusRule(amount=bonus_amount)
 
         # Rename the column 'distance' to 'previous_distance' in df_past_pairings
         self.df_past_pairings.rename(columns={'distance': 'previous_distance'}, inplace=True)
 
-        # Create a new column 'distance' in df_past_pairings and set it to 0
-        self.df_past_pairings['distance'] = 0.0
-
-        # Create a new column 'bonus' in df_paired_students and set it to 0
-        self.df_paired_students['bonus'] = 0.0
-
-        # set bonus_to_add to be added as a percentage of the total points possible, or as a fixed number of points
-        if bonus_amount < 1.0:
-            bonus = round(bonus_amount * self.canvas_quiz.points_possible)
+        # Evaluate all pairs and triples at once, then give each student the bonus of their group. The bonus is for
+        # agreeing on this quiz, so with config.history_window (whose distances also cover earlier quizzes) the
+        # distances are computed from this quiz's scores instead.
+        if self.config.history_window:
+            distances = None
         else:
-            bonus = bonus_amount
-
-        # Iterate through each row of df_past_pairings
-        for i, row in self.df_past_pairings.iterrows():
-            person1 = row['id1']
-            person2 = row['id2']
-            dist = self.dist_matrix.loc[person1, person2]
-            person3 = row['id3']
-            if person3 > 0:
-                dist = max(dist, self.dist_matrix.loc[person1, person3], self.dist_matrix.loc[person2, person3])
-            self.df_past_pairings.at[i, 'distance'] = dist
-
-            if dist <= 0.01:
-                self.df_paired_students.loc[self.df_paired_students['id'] == person1, 'bonus'] = bonus
-                self.df_paired_students.loc[self.df_paired_students['id'] == person2, 'bonus'] = bonus
-                if person3 > 0:
-                    self.df_paired_students.loc[self.df_paired_students['id'] == person3, 'bonus'] = bonus
+            distances = self.distances if self.distances is not None else self.dist_matrix
+        result = picata_bonus.evaluateBonus(self.df_past_pairings, distances, self.quiz_df, rule, self.canvas_quiz.points_possible)
+        self.df_past_pairings['distance'] = result['distance']
+        self.df_past_pairings['agreement'] = result['agreement']
+        self.df_past_pairings['bonus'] = result['bonus']
+        self.df_paired_students['bonus'] = picata_bonus.studentBonus(self.df_past_pairings, result['bonus'], self.df_paired_students['id'])
 
     def getUserQuizEvents(self):
-        quiz_takers = self.quiz_df[['name', 'id']].copy()
-        #quiz_takers = pica_quiz.quiz_df[['name', 'id']].copy()
-
-        # Define a user_events dataframe with columns 'name', 'id', 'event', 'timestamp'
-        user_events = pd.DataFrame(columns=['name', 'id', 'event', 'timestamp'])
-
-        subs = self.canvas_quiz.get_submissions()
-        #subs = pica_quiz.canvas_quiz.get_submissions()
-        for i, sub in enumerate(subs):
-            # Get row from quiz_takers where column 'id' matches sub.user_id
-            row = quiz_takers[quiz_takers['id'] == sub.user_id]
-            if len(row) == 0: # no quiz taker found for this user
-                continue
-
-            # Get user submission events for this submission
-            events = sub.get_submission_events()
-
-            for event in events:
-                user_events.loc[len(user_events)] = [row['name'].values[0], sub.user_id, event.event_type, event.created_at]
+        """ Download the events (e.g. page focus/blur) of every quiz taker's submission and save them to a csv file. """
+        quiz_takers = dict(zip(self.quiz_df['id'], self.quiz_df['name']))
+        subs = self.getSubmissions()
+        rows = [k for k, user_id in enumerate(subs.user_id) if user_id in quiz_takers]
+
+        # Fetch the events of all submissions concurrently, then build the dataframe in one go
+        user_events = {'name': [], 'id': [], 'event': [], 'timestamp': []}
+        for k, events in zip(rows, picata_canvas.getSubmissionEvents(subs, rows)):
+            user_events['name'].extend([quiz_takers[subs.user_id[k]]] * len(events))
+            user_events['id'].extend([subs.user_id[k]] * len(events))
+            user_events['event'].extend(event['event_type'] for event in events)
+            user_events['timestamp'].extend(event['created_at'] for event in events)
+        user_events = pd.DataFrame(user_events)
 
         user_events_csv = self.config.data_path + self.config.quiz_prefix + str(self.canvas_quiz.id) + \
             "_user_events_" + datetime.today().strftime('%Y%m%d') + ".csv"
         user_events.to_csv(user_events_csv, index=False)
 
+    def updateFudgePoints(self, updates):
+        """
+        Set fudge points for a list of (row of the submissions snapshot, fudge_points), concurrently and
+        recording each one in a journal file, so that re-running after an interruption only makes the
+        updates still missing. The journal is deleted once all updates are made: a later run (e.g. a
+        re-award after fudge points were changed in Canvas) relies on the submissions, skipping only those
+        whose fudge points already match. With config.dry_run the plan is only printed; returns False in
+        that case (nothing was written).
+        """
+        subs = self.getSubmissions()
+        journal_path = self.config.data_path + self.config.quiz_prefix + str(self.canvas_quiz.id) + "_fudge_points_journal.jsonl"
+        journal = picata_canvas.UpdateJournal(journal_path)
+        done = [journal.done(picata_canvas.fudgePointsKey(subs.id[k], subs.attempt[k], pts)) or subs.fudge_points[k] == pts
+                for k, pts in updates]
+
+        print(f"\nFudge point updates: {len(updates)} ({sum(done)} already made)")
+        if self.config.dry_run or self.verbose:
+            print(f"{'user_id':>10} {'attempt':>8} {'score':>7} {'fudge_points':>13}  status")
+            for (k, pts), made in zip(updates, done):
+                print(f"{subs.user_id[k]:>10} {subs.attempt[k]:>8} {subs.score[k]:>7.2f} {pts:>13.2f}  {'done' if made else 'pending'}")
+        if self.config.dry_run:
+            print("Dry run: no fudge points were set in Canvas, and neither the fudge points journal nor the scores_w_bonus csv was written")
+            print("  (the Canvas cache, profile store and user events csv in data/ were updated as in any run)")
+            return False
+
+        pending = [update for update, made in zip(updates, done) if not made]
+        n_updated = picata_canvas.setFudgePoints(subs, pending, journal)
+        journal.clear()
+        print(f"Updated fudge points of {n_updated} submissions")
+
+        # the submissions just updated are out of date, both here and in the cache
+        if n_updated > 0:
+            self.refreshSubmissions()
+        return True
+
     def awardBonusPoints(self):
         """ Award bonus points to students who received it by setting fudge points. """
         quiz_summary = self.quiz_df[['name', 'id', 'n_correct', 'n_incorrect', 'score']].copy()
@@ -665,35 +754,28 @@ class PicaQuiz:
         quiz_summary.drop(columns='lastname', inplace=True)
         quiz_summary.reset_index(drop=True, inplace=True)
 
-        subs = self.canvas_quiz.get_submissions()
-        for i, sub in enumerate(subs):
-            # Get row from quiz_summary where column 'id' matches sub.user_id
-            row = quiz_summary[quiz_summary['id'] == sub.user_id]
-
-            # Confirm that the sub.score matches row['score'] using an assert statement
-            assert abs(sub.score - row['score'].values[0]) < 0.001
-
-            # Set quiz_summary for this user_id and column 'start' with string in sub.started_at
-            quiz_summary.at[row.index[0], 'start'] = sub.started_at
-            quiz_summary.at[row.index[0], 'finish'] = sub.finished_at
-            quiz_summary.at[row.index[0], 'minutes'] = sub.time_spent / 60.0
+        # Match the submissions to the rows of quiz_summary (which has a fresh 0..n-1 index) all at once
+        subs = self.getSubmissions()
+        rows = pd.Index(quiz_summary['id']).get_indexer(subs.user_id)
+        assert (rows >= 0).all(), "submission from a student who is not in the quiz report"
+        score = quiz_summary['score'].to_numpy()[rows]
+        bonus = quiz_summary['bonus'].to_numpy()[rows]
 
-            # Check if bonus needs to be added
-            if row['bonus'].values[0] > 0:
+        # Confirm that the sub.score matches the report score (allowing for fudge points set by an earlier run)
+        fudge_points = np.nan_to_num(subs.fudge_points)
+        assert (np.minimum(abs(subs.score - score), abs(subs.score - fudge_points - score)) < 0.001).all()
 
-                # Set points before fudget points are added
-                newattributes = { 'excused?': True, 'score_before_regrade': sub.score }
-                upd1 = sub.set_attributes(newattributes)
+        # Set start, finish, minutes and score_w_bonus (score + bonus, if any) of each student with a submission
+        quiz_summary.loc[rows, 'start'] = subs.started_at
+        quiz_summary.loc[rows, 'finish'] = subs.finished_at
+        quiz_summary.loc[rows, 'minutes'] = subs.time_spent / 60.0
+        quiz_summary.loc[rows, 'score_w_bonus'] = score + np.where(bonus > 0, bonus, 0.0)
 
-                # Now set fudge points
-                update_obj = [ { 'attempt': sub.attempt, 'fudge_points': row['bonus'].values[0] } ]
-                sub.update_score_and_comments(quiz_submissions=update_obj)
+        # Fudge points are set for everyone who earned the bonus at once
+        updates = [(k, bonus[k]) for k in np.flatnonzero(bonus > 0)]
 
-                # Set quiz_summary for this user_id and column 'score_w_bonus' with sub.score + row['bonus']
-                quiz_summary.at[row.index[0], 'score_w_bonus'] = row['score'].values[0] + row['bonus'].values[0]
-
-            else:
-                quiz_summary.at[row.index[0], 'score_w_bonus'] = row['score'].values[0]
+        if not self.updateFudgePoints(updates):
+            return
 
         quiz_summary_csv = self.config.data_path + self.config.quiz_prefix + str(self.canvas_quiz.id) + \
             "_scores_w_bonus_" + datetime.today().strftime('%Y%m%d') + ".csv"
@@ -717,41 +799,33 @@ class PicaQuiz:
         past_bonus['minutes_new'] = past_bonus['minutes_new'].astype(float)
         past_bonus['new_score_w_bonus'] = past_bonus['score_w_bonus']
 
-        subs = self.canvas_quiz.get_submissions()
-        for i, sub in enumerate(subs):
-
-            # no bonus to award if user_id not in past_bonus
-            if sub.user_id not in past_bonus['id'].values:
-                continue
-
-            # Get row from quiz_summary where column 'id' matches sub.user_id
-            row = past_bonus[past_bonus['id'] == sub.user_id]
-            if self.verbose:
-                print(f"name = {past_bonus.at[row.index[0], 'name']}")
-                print(f"  sub.user_id = {sub.user_id}, sub.attempt = {sub.attempt}, sub.score = {sub.score}, sub.fudge_points = {sub.fudge_points}")
-
-            # Update past_bonus df for this user_id
-            past_bonus.at[row.index[0], 'new_score'] = sub.score
-            past_bonus.at[row.index[0], 'start_new'] = sub.started_at
-            past_bonus.at[row.index[0], 'finish_new'] = sub.finished_at
-            if sub.time_spent is not None:
-                past_bonus.at[row.index[0], 'minutes_new'] = sub.time_spent / 60.0
-            else:
-                past_bonus.at[row.index[0], 'minutes_new'] = -1.0
-
-            # Check bonus was received before and new score is better than past score (w/o bonus)
-            if row['bonus'].values[0] > 0 and sub.score > row['score'].values[0]:
-
-                # Set points before fudget points are added
-                newattributes = { 'excused?': True, 'score_before_regrade': sub.score }
-                upd1 = sub.set_attributes(newattributes)
-
-                # Now set fudge points
-                update_obj = [ { 'attempt': sub.attempt, 'fudge_points': row['bonus'].values[0] } ]
-                sub.update_score_and_comments(quiz_submissions=update_obj)
-
-                # Update 'new_score_w_bonus' using sub.score + row['bonus']
-                past_bonus.at[row.index[0], 'new_score_w_bonus'] = sub.score + row['bonus'].values[0]
+        # Match the submissions to the rows of past_bonus (no bonus to award to students not in it)
+        subs = self.getSubmissions()
+        past_bonus.reset_index(drop=True, inplace=True)
+        all_rows = pd.Index(past_bonus['id']).get_indexer(subs.user_id)
+        found = np.flatnonzero(all_rows >= 0)
+        rows = all_rows[found]
+        if self.verbose:
+            for k, row in zip(found, rows):
+                print(f"name = {past_bonus.at[row, 'name']}")
+                print(f"  sub.user_id = {subs.user_id[k]}, sub.attempt = {subs.attempt[k]}, sub.score = {subs.score[k]}, "
+                      f"sub.fudge_points = {subs.fudge_points[k]}")
+
+        # Update past_bonus df for these user_ids
+        past_bonus.loc[rows, 'new_score'] = subs.score[found]
+        past_bonus.loc[rows, 'start_new'] = subs.started_at[found]
+        past_bonus.loc[rows, 'finish_new'] = subs.finished_at[found]
+        past_bonus.loc[rows, 'minutes_new'] = np.nan_to_num(subs.time_spent[found] / 60.0, nan=-1.0)
+
+        # Check bonus was received before and new score (w/o fudge points) is better than past score (w/o bonus)
+        score = subs.score[found] - np.nan_to_num(subs.fudge_points[found])
+        bonus = past_bonus['bonus'].to_numpy()[rows]
+        earned = (bonus > 0) & (score > past_bonus['score'].to_numpy()[rows])
+        past_bonus.loc[rows[earned], 'new_score_w_bonus'] = score[earned] + bonus[earned]
+        updates = list(zip(found[earned], bonus[earned]))
+
+        if not self.updateFudgePoints(updates):
+            return
 
         past_bonus_csv = self.config.data_path + self.config.quiz_prefix + str(self.canvas_quiz.id) + \
             "_scores_w_bonus_new_" + datetime.today().strftime('%Y%m%d') + ".csv"